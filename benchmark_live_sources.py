@@ -0,0 +1,268 @@
+"""直播源处理脚本的性能基准测试
+
+离线运行：使用仓库中的 debug_original_content.txt 作为真实样本，
+并可以生成任意规模的 zubo 格式合成数据，逐阶段测量吞吐量和峰值内存。
+用法:
+  python benchmark_live_sources.py [--repeat N]
+  python benchmark_live_sources.py --lines 10000 100000 1000000 --duplicate-ratio 0.2
+  python benchmark_live_sources.py --save-baseline bench_baseline.json
+  python benchmark_live_sources.py --baseline bench_baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import process_live_sources as pls
+
+
+def legacy_normalize_channel_name(channel_name):
+    """原始的线性扫描实现，作为正确性与性能的对照"""
+    channel_name_clean = channel_name.strip()
+
+    for standard_name, variants in pls.get_rules().channel_name_mapping.items():
+        if channel_name_clean in variants:
+            return standard_name
+
+    for standard_name, variants in pls.get_rules().channel_name_mapping.items():
+        for variant in variants:
+            if variant.lower() in channel_name_clean.lower() or channel_name_clean.lower() in variant.lower():
+                return standard_name
+
+    return channel_name_clean
+
+
+def load_sample_channel_names(path='debug_original_content.txt'):
+    """从调试样本中提取频道名称"""
+    names = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or '#genre#' in line.lower() or ',' not in line:
+                continue
+            names.append(line.split(',', 1)[0].strip().strip('"'))
+    return names
+
+
+def time_call(func, items, repeat):
+    """对每个元素调用func，返回最优一轮的耗时（秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark_normalize(names, repeat):
+    """对比预编译标准化器与线性扫描实现"""
+    start = time.perf_counter()
+    normalizer = pls.ChannelNameNormalizer(pls.get_rules().channel_name_mapping)
+    build_time = time.perf_counter() - start
+
+    mismatches = [name for name in names if normalizer.normalize(name) != legacy_normalize_channel_name(name)]
+    if mismatches:
+        print(f"结果不一致: {len(mismatches)} 个, 例如 {mismatches[:5]}")
+        return False
+
+    legacy_time = time_call(legacy_normalize_channel_name, names, repeat)
+    indexed_time = time_call(normalizer.normalize, names, repeat)
+    print(f"normalize_channel_name: {len(names)} 个名称")
+    print(f"  构建索引: {build_time * 1000:.1f} ms")
+    print(f"  线性扫描: {legacy_time * 1000:.1f} ms ({len(names) / legacy_time:,.0f} 个/秒)")
+    print(f"  预编译索引: {indexed_time * 1000:.1f} ms ({len(names) / indexed_time:,.0f} 个/秒)")
+    print(f"  加速比: {legacy_time / indexed_time:.1f}x")
+    return True
+
+
+# 合成数据使用的省份和运营商
+SYNTHETIC_PROVINCES = ["四川", "广东", "山东", "北京", "上海", "江苏", "浙江", "湖南", "湖北", "河南",
+                       "河北", "福建", "安徽", "江西", "陕西", "辽宁", "吉林", "重庆", "天津", "云南"]
+SYNTHETIC_OPERATORS = ["电信", "联通", "移动"]
+
+
+def synthetic_channel_names(unknown_ratio=0.15, seed=0):
+    """合成数据的频道名称池：规则中的标准名、变体名，以及一定比例不在规则中的名称"""
+    rules = pls.get_rules()
+    names = [name for channels in rules.category_mapping.values() for name in channels]
+    names.extend(variant for variants in rules.channel_name_mapping.values() for variant in variants)
+    names = list(dict.fromkeys(names))
+    rng = random.Random(seed)
+    unknown = int(len(names) * unknown_ratio / (1 - unknown_ratio))
+    names.extend(f"地方频道{rng.randrange(100000)}" for _ in range(unknown))
+    return names
+
+
+def iter_synthetic_lines(lines, regions=200, quoted_ratio=0.0, duplicate_ratio=0.1, seed=0):
+    """生成 zubo 格式的合成数据行（前两行与上游一致，会被跳过）
+
+    lines: 总行数（含地区行）
+    regions: 地区块数量，每块的频道数约为 lines / regions
+    quoted_ratio: 使用 "频道名称","地址" 引号格式的行所占比例
+    duplicate_ratio: 重复之前出现过的地址的比例
+    """
+    rng = random.Random(seed)
+    names = synthetic_channel_names(seed=seed)
+    channels_per_region = max(1, (lines - 2) // max(1, regions) - 1)
+    yield "2025/01/01 00:00更新,#genre#"
+    yield "浙江卫视,http://example.com/channels/lantian/channel001/1080p.m3u8"
+    produced = 2
+    seen_urls = []
+    region_number = 0
+    while produced < lines:
+        region_number += 1
+        province = SYNTHETIC_PROVINCES[region_number % len(SYNTHETIC_PROVINCES)]
+        operator = SYNTHETIC_OPERATORS[region_number % len(SYNTHETIC_OPERATORS)]
+        region = f"{province}{operator}-组播{region_number}"
+        host = (f"http://{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}."
+                f"{rng.randrange(1, 255)}:{rng.randrange(1024, 65535)}")
+        yield f'"{region}","#genre#"' if rng.random() < quoted_ratio else f"{region},#genre#"
+        produced += 1
+        for _ in range(channels_per_region):
+            if produced >= lines:
+                return
+            if seen_urls and rng.random() < duplicate_ratio:
+                url = rng.choice(seen_urls)
+            else:
+                url = f"{host}/udp/239.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}:5140"
+                seen_urls.append(url)
+            name = rng.choice(names)
+            yield f'"{name}","{url}"' if rng.random() < quoted_ratio else f"{name},{url}"
+            produced += 1
+
+
+def generate_synthetic_content(lines, **options):
+    """生成完整的合成上游内容"""
+    return '\n'.join(iter_synthetic_lines(lines, **options)) + '\n'
+
+
+def measure(func, repeat):
+    """运行func：先测最优耗时，再单独运行一次用tracemalloc测峰值内存（避免追踪开销影响计时）"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def benchmark_stages(label, content, repeat):
+    """逐阶段测量：解析/过滤、标准化、分类、去重、生成输出，以及单遍流式管道"""
+    results = {}
+    line_count = content.count('\n')
+
+    def record(stage, func, count):
+        elapsed, peak, result = measure(func, repeat)
+        results[stage] = {'seconds': elapsed, 'items': count, 'per_second': count / elapsed if elapsed else 0.0,
+                          'peak_bytes': peak}
+        print(f"  {stage:<10} {elapsed * 1000:9.1f} ms  {results[stage]['per_second']:>13,.0f} 个/秒  "
+              f"峰值内存 {peak / 1024 / 1024:7.1f} MB  ({count} 个)")
+        return result
+
+    print(f"[{label}] {line_count} 行, {len(content.encode('utf-8')) / 1024 / 1024:.1f} MB")
+    channels = record('parse', lambda: pls.parse_source_content(content), line_count)
+    names = [channel.name for channel in channels]
+    normalizer = pls.get_channel_name_normalizer()
+    record('normalize', lambda: [normalizer.normalize(name) for name in names], len(names))
+    categorized, uncategorized = record('categorize', lambda: pls.categorize_channels(channels), len(channels))
+
+    def dedup():
+        deduplicator = pls.ChannelDeduplicator()
+        for channel in channels:
+            deduplicator.is_duplicate(channel.url)
+        return deduplicator
+    record('dedup', dedup, len(channels))
+
+    # 输出阶段会写文件，放到临时目录中进行
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            record('output', lambda: pls.generate_output_files(categorized, uncategorized, channels), len(channels))
+
+            def pipeline():
+                writer = pls.OutputWriter()
+                pls.run_pipeline([content], writer)
+                writer.commit()
+            record('pipeline', pipeline, line_count)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def compare_with_baseline(current, baseline, threshold):
+    """与保存的基线比较耗时，返回变慢超过threshold倍的 (数据集, 阶段, 倍数) 列表"""
+    regressions = []
+    print(f"与基线比较（耗时比值，>{threshold:.2f} 视为退化）:")
+    for dataset, stages in current.items():
+        for stage, result in stages.items():
+            previous = baseline.get(dataset, {}).get(stage)
+            if not previous or not previous.get('seconds'):
+                continue
+            ratio = result['seconds'] / previous['seconds']
+            memory_ratio = result['peak_bytes'] / previous['peak_bytes'] if previous.get('peak_bytes') else 0.0
+            flag = '  <-- 退化' if ratio > threshold else ''
+            print(f"  {dataset:<16} {stage:<10} 耗时 {ratio:5.2f}x  内存 {memory_ratio:5.2f}x{flag}")
+            if ratio > threshold:
+                regressions.append((dataset, stage, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='直播源处理性能基准测试')
+    parser.add_argument('--repeat', type=int, default=3, help='每项测试重复次数，取最优值')
+    parser.add_argument('--fixture', default='debug_original_content.txt', help='真实样本文件')
+    parser.add_argument('--lines', type=int, nargs='*', default=[10000, 100000],
+                        help='合成数据的行数，可指定多个（例如 10000 100000 1000000），不指定则只测真实样本')
+    parser.add_argument('--regions', type=int, default=200, help='合成数据的地区块数量')
+    parser.add_argument('--quoted-ratio', type=float, default=0.0, help='引号格式行所占比例')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1, help='重复地址所占比例')
+    parser.add_argument('--seed', type=int, default=0, help='合成数据的随机种子')
+    parser.add_argument('--save-baseline', metavar='PATH', help='把本次结果保存为基线')
+    parser.add_argument('--baseline', metavar='PATH', help='与保存的基线比较，出现退化时返回非零')
+    parser.add_argument('--threshold', type=float, default=1.25, help='耗时超过基线多少倍视为退化')
+    args = parser.parse_args()
+
+    pls.set_log_level('warning')
+    ok = benchmark_normalize(load_sample_channel_names(args.fixture), args.repeat)
+
+    results = {}
+    with open(args.fixture, 'r', encoding='utf-8') as f:
+        results['fixture'] = benchmark_stages('fixture', f.read(), args.repeat)
+    for lines in args.lines:
+        content = generate_synthetic_content(lines, regions=args.regions, quoted_ratio=args.quoted_ratio,
+                                             duplicate_ratio=args.duplicate_ratio, seed=args.seed)
+        results[f'synthetic-{lines}'] = benchmark_stages(f'synthetic-{lines}', content, args.repeat)
+        del content
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"基线已保存到 {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare_with_baseline(results, baseline, args.threshold):
+            ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
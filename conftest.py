@@ -0,0 +1 @@
+# 让 tests/ 下的测试可以直接 import 仓库根目录的脚本
@@ -1,67 +1,579 @@
 import requests
 import re
-from collections import defaultdict
+import argparse
+import codecs
+import fnmatch
+import functools
+import hashlib
+import heapq
+import json
+import asyncio
+import ssl
+import shutil
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import defaultdict, OrderedDict, Counter, deque, namedtuple
+import itertools
 import os
 from datetime import datetime, timezone, timedelta
 import sys
 import traceback
+import signal
+import sqlite3
+import threading
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+import unicodedata
+from types import MappingProxyType
+from requests.adapters import HTTPAdapter
 
-def debug_log(message):
-    """调试日志函数"""
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+# 日志级别：低于当前级别的消息直接丢弃，逐行循环里的日志都使用DEBUG级别
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LOG_LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+_log_level = INFO
+
+def set_log_level(level):
+    """设置日志级别，可以是级别名称或数值"""
+    global _log_level
+    _log_level = LOG_LEVELS[level] if isinstance(level, str) else level
+
+def log_enabled(level):
+    return level >= _log_level
+
+def debug_log(message, *args, level=INFO):
+    """调试日志函数；传入args时按 message % args 延迟格式化，级别不够时不做任何格式化"""
+    if level < _log_level:
+        return
+    if args:
+        message = message % args
     # 生成北京时间
-    beijing_time = datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S")
+    beijing_time = datetime.now(BEIJING_TZ).strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{beijing_time}] {message}")
 
-def fetch_original_data(url):
-    """从GitHub获取原始数据"""
-    try:
-        debug_log("开始获取原始数据...")
-        # 将GitHub页面链接转换为原始内容链接
-        raw_url = url.replace('github.com', 'raw.githubusercontent.com').replace('/blob/', '/')
-        debug_log(f"转换后的URL: {raw_url}")
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+class _StageTimer:
+    """RunMetrics.stage 返回的上下文管理器（每个频道都会进出，直接内联栈操作）"""
+
+    __slots__ = ('metrics', 'name')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        metrics = self.metrics
+        now = metrics.clock()
+        stack = metrics._stack
+        if stack:
+            metrics.timings[stack[-1]] += now - metrics._last
+        metrics._last = now
+        stack.append(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        metrics = self.metrics
+        now = metrics.clock()
+        metrics.timings[metrics._stack.pop()] += now - metrics._last
+        metrics._last = now
+        return False
+
+class _NullStage:
+    """不计时时使用的空上下文管理器"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class RunMetrics:
+    """一次运行的各阶段耗时和计数器
+
+    阶段可以嵌套（例如 categorize 中调用 normalize，parse 拉取 read 产出的行），
+    计时采用栈结构，每段时间只记到栈顶阶段上，因此各阶段耗时是不含子阶段的自身耗时。
+    enabled为False时不计时（计数器照常累加），逐频道的计时不产生额外开销。
+    """
+
+    VERSION = 1
+
+    def __init__(self, clock=time.perf_counter, enabled=True):
+        self.clock = clock
+        self.enabled = enabled
+        self.started_at = datetime.now(BEIJING_TZ).strftime("%Y-%m-%d %H:%M:%S")
+        self.timings = defaultdict(float)
+        self.counters = Counter()
+        self.sources = {}
+        self._stack = []
+        self._stages = {}
+        self._start = self._last = clock()
+
+    def _switch(self):
+        now = self.clock()
+        if self._stack:
+            self.timings[self._stack[-1]] += now - self._last
+        self._last = now
+
+    def enter(self, stage):
+        self._switch()
+        self._stack.append(stage)
+
+    def exit(self):
+        self._switch()
+        self._stack.pop()
+
+    def stage(self, name):
+        """计时上下文管理器：with metrics.stage('write'): ..."""
+        if not self.enabled:
+            return _NULL_STAGE
+        timer = self._stages.get(name)
+        if timer is None:
+            timer = self._stages[name] = _StageTimer(self, name)
+        return timer
+
+    def timed(self, iterable, stage):
+        """透传迭代器，把产出每个元素所花的时间记到stage上"""
+        if not self.enabled:
+            return iterable
+        return self._timed(iterable, stage)
+
+    def _timed(self, iterable, stage):
+        iterator = iter(iterable)
+        enter, exit_ = self.enter, self.exit
+        while True:
+            enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                exit_()
+            yield item
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def record_fetch(self, result):
+        """记录单个上游源的获取情况"""
+        self.sources[result.source.name] = {
+            'ok': result.ok or result.not_modified,
+            'not_modified': result.not_modified,
+            'status_code': result.status_code,
+            'attempts': result.attempts,
+            'length': result.length,
+            'elapsed': round(result.elapsed or 0.0, 6),
         }
-        
-        response = requests.get(raw_url, timeout=30, headers=headers)
-        response.raise_for_status()
-        response.encoding = 'utf-8'
-        
-        debug_log(f"成功获取数据，长度: {len(response.text)} 字符")
-        return response.text
-    except Exception as e:
-        debug_log(f"获取数据失败: {e}")
+
+    def to_dict(self, exit_code=None):
+        return {
+            'version': self.VERSION,
+            'started_at': self.started_at,
+            'exit_code': exit_code,
+            'total_seconds': round(self.clock() - self._start, 6),
+            'stages': {name: round(seconds, 6) for name, seconds in sorted(self.timings.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'sources': self.sources,
+        }
+
+    def write(self, path, exit_code=None):
+        """把指标写成JSON文件"""
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(exit_code), f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        os.replace(path + '.tmp', path)
+
+_metrics = RunMetrics(enabled=False)
+
+def set_metrics(metrics):
+    """替换当前收集指标的对象"""
+    global _metrics
+    _metrics = metrics
+
+def get_metrics():
+    return _metrics
+
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+def to_raw_github_url(url):
+    """将GitHub页面链接转换为原始内容链接"""
+    return url.replace('github.com', 'raw.githubusercontent.com').replace('/blob/', '/')
+
+class UpstreamSource:
+    """上游直播源配置"""
+
+    def __init__(self, name, url, timeout=30, retries=2, backoff=1.0, deadline=120):
+        self.name = name
+        self.url = url
+        self.timeout = timeout      # 单次连接/读取超时（秒）
+        self.retries = retries      # 失败后的重试次数
+        self.backoff = backoff      # 重试退避基数（秒），按 backoff * 2^n 递增
+        self.deadline = deadline    # 单次下载的总时长上限（秒），防止慢速源无限拖延
+
+    @property
+    def raw_url(self):
+        return to_raw_github_url(self.url)
+
+    @property
+    def local_path(self):
+        """本地文件源（file:// 或不带协议的路径）的文件路径，网络源返回None"""
+        if self.url.startswith('file://'):
+            return self.url[len('file://'):]
+        if '://' not in self.url:
+            return self.url
         return None
 
-def should_filter_region(region):
-    """检查地区运营商是否需要过滤"""
-    # 需要过滤的关键词列表
-    filter_keywords = ["四川移动", "广东移动", "山东联通"]
-    
-    # 如果地区运营商包含任何一个关键词，则返回True（需要过滤）
-    for keyword in filter_keywords:
-        if keyword in region:
-            return True
-    return False
+    def __repr__(self):
+        return f"UpstreamSource({self.name!r}, {self.url!r})"
 
-def parse_original_data_skip_first_two_lines(content):
-    """解析原始数据，跳过前两行，并过滤特定地区运营商"""
-    debug_log("开始解析原始数据（跳过前两行）...")
-    lines = content.split('\n')
-    
-    # 跳过前两行
-    if len(lines) > 2:
-        debug_log(f"跳过前两行，从第3行开始处理，总行数: {len(lines)}")
-        lines = lines[2:]
+
+# 条件请求缓存文件（记录上游的ETag/Last-Modified/内容哈希）
+FETCH_CACHE_FILE = 'fetch_cache.json'
+
+# 上游直播源列表（按顺序合并）
+UPSTREAM_SOURCES = [
+    UpstreamSource("zubo_all", "https://github.com/q1017673817/iptvz/blob/main/zubo_all.txt"),
+]
+
+class FetchResult:
+    """单个上游源的下载结果，正文以文本形式缓存在spool中"""
+
+    def __init__(self, source):
+        self.source = source
+        self.spool = None
+        self.error = None
+        self.status_code = None
+        self.attempts = 0
+        self.length = 0
+        self.elapsed = 0.0
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.not_modified = False  # 条件请求返回304
+
+    @property
+    def ok(self):
+        return self.error is None and self.spool is not None
+
+    def iter_text(self, chunk_size=64 * 1024):
+        """按块读取缓存的正文"""
+        self.spool.seek(0)
+        while True:
+            chunk = self.spool.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+class SourceFetchError(Exception):
+    """上游源下载失败"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+def create_session(pool_size=10):
+    """创建带连接池的会话，所有上游源共用"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(REQUEST_HEADERS)
+    return session
+
+def iter_decoded_text(byte_chunks):
+    """把字节块解码为文本：自动识别gzip压缩的正文（如.gz文件），按UTF-8增量解码"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    decompressor = None
+    first = True
+    for chunk in byte_chunks:
+        if not chunk:
+            continue
+        if first:
+            first = False
+            if chunk[:2] == b'\x1f\x8b':
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decompressor.flush() if decompressor is not None else b''
+    text = decoder.decode(tail, final=True)
+    if text:
+        yield text
+
+def _spool_text(byte_chunks, spool, result):
+    """把字节块解码写入spool，同时记录长度和内容哈希"""
+    digest = hashlib.sha256()
+    length = 0
+    try:
+        for text in iter_decoded_text(byte_chunks):
+            spool.write(text)
+            digest.update(text.encode('utf-8'))
+            length += len(text)
+    except zlib.error as e:
+        # 损坏的gzip正文重试也不会变好
+        raise SourceFetchError(f"解压失败: {e}", retryable=False)
+    result.length = length
+    result.content_hash = digest.hexdigest()
+
+def _read_local_source(source, spool, result, chunk_size=64 * 1024):
+    """读取本地文件源；文件没有ETag，是否变化由内容哈希判断"""
+    try:
+        with open(source.local_path, 'rb') as f:
+            _spool_text(iter(lambda: f.read(chunk_size), b''), spool, result)
+    except OSError as e:
+        raise SourceFetchError(f"无法读取本地文件: {e}", retryable=False)
+
+def _download_source(session, source, spool, result, headers=None, chunk_size=64 * 1024):
+    """下载一次上游源到spool，把状态码、缓存校验信息和内容哈希记录到result"""
+    if source.local_path is not None:
+        _read_local_source(source, spool, result, chunk_size=chunk_size)
+        return
+    started = time.monotonic()
+    with session.get(source.raw_url, timeout=source.timeout, stream=True, headers=headers) as response:
+        result.status_code = response.status_code
+        if response.status_code == 304:
+            result.not_modified = True
+            return
+        if response.status_code >= 400:
+            # 服务端错误和限流可以重试，其余客户端错误直接失败
+            retryable = response.status_code >= 500 or response.status_code == 429
+            raise SourceFetchError(f"HTTP {response.status_code}", retryable=retryable)
+        result.etag = response.headers.get('ETag')
+        result.last_modified = response.headers.get('Last-Modified')
+
+        def iter_chunks():
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if time.monotonic() - started > source.deadline:
+                    raise SourceFetchError(f"下载超过 {source.deadline} 秒")
+                yield chunk
+
+        _spool_text(iter_chunks(), spool, result)
+
+def fetch_source(session, source, spool_size=4 * 1024 * 1024, headers=None):
+    """下载单个上游源（带超时、重试和指数退避），失败时在结果中记录错误"""
+    result = FetchResult(source)
+    started = time.monotonic()
+    for attempt in range(source.retries + 1):
+        result.attempts = attempt + 1
+        # newline='' 保证读写时不转换 \r，与原始内容完全一致
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_size, mode='w+', encoding='utf-8', newline='')
+        try:
+            _download_source(session, source, spool, result, headers=headers)
+            result.error = None
+            if result.not_modified:
+                spool.close()
+            else:
+                result.spool = spool
+            break
+        except (requests.RequestException, SourceFetchError, OSError) as e:
+            # 任何I/O错误都只记为这个上游源失败，不影响其他上游源
+            spool.close()
+            result.error = str(e)
+            retryable = getattr(e, 'retryable', True)
+            if not retryable or attempt == source.retries:
+                break
+            delay = source.backoff * (2 ** attempt)
+            debug_log(f"[{source.name}] 第{attempt + 1}次获取失败: {e}，{delay:.1f} 秒后重试", level=WARNING)
+            time.sleep(delay)
+    result.elapsed = time.monotonic() - started
+    if result.not_modified:
+        debug_log(f"[{source.name}] 上游未修改 (304)，耗时 {result.elapsed:.2f} 秒")
+    elif result.ok:
+        debug_log(f"[{source.name}] 成功获取数据，长度: {result.length} 字符，耗时 {result.elapsed:.2f} 秒")
     else:
-        debug_log("数据行数不足，未跳过任何行")
-    
-    result = []
+        debug_log(f"[{source.name}] 获取数据失败: {result.error}", level=WARNING)
+    return result
+
+def fetch_sources(sources, max_workers=None, session=None, cache=None):
+    """并发下载所有上游源，结果按配置顺序返回；单个源的快慢不影响其他源
+
+    传入cache时发送条件请求（If-None-Match / If-Modified-Since）。
+    """
+    sources = list(sources)
+    if not sources:
+        return []
+    if max_workers is None:
+        max_workers = min(len(sources), 16)
+    own_session = session is None
+    if own_session:
+        session = create_session(pool_size=max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(fetch_source, session, source,
+                                headers=cache.conditional_headers(source) if cache is not None else None)
+                for source in sources
+            ]
+            return [future.result() for future in futures]
+    finally:
+        if own_session:
+            session.close()
+
+class FetchCache:
+    """上游源的条件请求缓存
+
+    按上游URL保存 ETag、Last-Modified 和内容哈希，另外记录生成输出时的
+    处理规则指纹；规则（脚本本身）变化后即使上游未变也需要重新生成。
+    """
+
+    def __init__(self, path=FETCH_CACHE_FILE):
+        self.path = path
+        self.entries = {}
+        self.pipeline_fingerprint = None
+        self._dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('sources', {})
+            self.pipeline_fingerprint = data.get('pipeline')
+        except FileNotFoundError:
+            pass
+        except (ValueError, AttributeError) as e:
+            debug_log(f"获取缓存 {path} 无效，忽略: {e}")
+
+    def conditional_headers(self, source):
+        """根据缓存生成条件请求头"""
+        entry = self.entries.get(source.url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def is_unchanged(self, result):
+        """上游返回304，或内容哈希与缓存相同"""
+        if result.not_modified:
+            return True
+        entry = self.entries.get(result.source.url)
+        return bool(result.ok and entry and entry.get('content_hash') == result.content_hash)
+
+    def update(self, result):
+        """记录一次成功下载的缓存校验信息"""
+        if result.error is not None or result.content_hash is None:
+            return
+        entry = {
+            'etag': result.etag,
+            'last_modified': result.last_modified,
+            'content_hash': result.content_hash,
+            'length': result.length,
+        }
+        if self.entries.get(result.source.url) != entry:
+            self.entries[result.source.url] = entry
+            self._dirty = True
+
+    def set_pipeline_fingerprint(self, fingerprint):
+        if self.pipeline_fingerprint != fingerprint:
+            self.pipeline_fingerprint = fingerprint
+            self._dirty = True
+
+    def save(self):
+        """有变化时写回缓存文件"""
+        if not self._dirty:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pipeline': self.pipeline_fingerprint, 'sources': self.entries},
+                      f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write('\n')
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+def pipeline_fingerprint(sources, options=None):
+    """处理规则指纹：脚本内容、上游源列表和影响输出的选项，任一变化都需要重新生成输出"""
+    digest = hashlib.sha256()
+    with open(os.path.abspath(__file__), 'rb') as f:
+        digest.update(f.read())
+    for source in sources:
+        digest.update(f"\n{source.name}={source.url}".encode('utf-8'))
+    if options:
+        digest.update(json.dumps(options, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+def iter_text_lines(chunks):
+    """把文本块切分为行，结果与 content.split('\\n') 完全一致"""
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        if '\n' not in chunk:
+            continue
+        parts = pending.split('\n')
+        pending = parts.pop()
+        yield from parts
+    yield pending
+
+def log_leading_lines(lines, count=10):
+    """透传行迭代器，同时记录前count行用于调试"""
+    debug_log("原始数据前%d行:", count, level=DEBUG)
+    for i, line in enumerate(lines):
+        if i < count:
+            debug_log("行 %d: %r", i + 1, line, level=DEBUG)
+        yield line
+
+def should_filter_region(region):
+    """检查地区运营商是否需要过滤（过滤规则来自规则文件）"""
+    return get_rules().region_filter.match(region) is not None
+
+class ChannelRecord(namedtuple('ChannelRecord', ('name', 'url', 'region', 'category', 'source'),
+                               defaults=(None, None))):
+    """在各阶段之间传递的频道记录：频道名称、地址、地区运营商、分类（未分类为None）和来源上游源名称
+
+    来源由 OutputWriter 在缓冲频道时记录，从缓冲读回的记录都带有来源，供各输出格式写出。
+
+    只在写出时才格式化为 频道名称,地址$地区运营商，中间阶段不再用正则重新拆分，
+    地址中含有','或'$'的频道也不会被丢弃。地区运营商和分类是大量重复的短字符串，
+    由产生它们的地方驻留（解析时每个地区块一次、分类索引构建时一次），
+    所有记录共享同一个字符串对象。
+    """
+
+    __slots__ = ()
+
+    def line(self):
+        """格式化为输出行"""
+        return f'{self.name},{self.url}${self.region}'
+
+# 上游在开头放一个 "2025/11/22 15:46更新,#genre#" 之类的更新时间分段，其中的频道只是示例
+UPDATE_MARKER_PATTERN = re.compile(r'更新|^\d{4}[-/.]\d{1,2}[-/.]\d{1,2}')
+
+# 宽松的地址校验：包含任一协议或扩展名即可
+STREAM_URL_MARKERS = ('http', 'rtmp', 'rtsp', 'm3u8', 'udp', 'tcp', '.ts', '.m3u8')
+
+def looks_like_stream_url(url):
+    url_lower = url.lower()
+    return any(marker in url_lower for marker in STREAM_URL_MARKERS)
+
+def iter_parsed_channels(lines, region_filter=None):
+    """逐行解析 genre 格式的原始数据，过滤特定地区运营商，产出 ChannelRecord
+
+    第一个 #genre# 行之前的内容没有地区，更新时间分段中的频道也会跳过。
+    """
+    if region_filter is None:
+        region_filter = get_rules().region_filter
+    metrics = get_metrics()
     current_region = ""
+    # 地区只在 #genre# 行变化，过滤结果按地区块计算一次
+    drop_rule = region_filter.match(current_region)
+    skip_block = False
     line_count = 0
     valid_channels = 0
     filtered_count = 0
+    drop_counts = Counter()
     
     for line in lines:
         line_count += 1
@@ -80,28 +592,34 @@ def parse_original_data_skip_first_two_lines(content):
                     parts = line.split(',', 1)
                     if len(parts) >= 1:
                         current_region = parts[0].strip('"')
-                        debug_log(f"发现地区分类: {current_region}")
+                        debug_log("发现地区分类: %s", current_region, level=DEBUG)
                 else:
                     # 格式: 地区运营商,#genre#
                     parts = line.split(',', 1)
                     if len(parts) >= 1:
                         current_region = parts[0].strip().strip('"')
-                        debug_log(f"发现地区分类: {current_region}")
+                        debug_log("发现地区分类: %s", current_region, level=DEBUG)
             except Exception as e:
-                debug_log(f"解析地区行失败 (第{line_count}行): {e}")
+                debug_log("解析地区行失败 (第%d行): %s", line_count, e, level=DEBUG)
+            # 移除所有双引号；整个地区块的频道共享同一个驻留的地区字符串
+            current_region = sys.intern(current_region.replace('"', ''))
+            with metrics.stage('filter'):
+                drop_rule = region_filter.match(current_region)
+            skip_block = UPDATE_MARKER_PATTERN.search(current_region) is not None
+            if skip_block:
+                debug_log("跳过更新时间分段: %s", current_region, level=DEBUG)
             continue
             
         # 多种可能的频道行格式
         try:
             # 跳过明显不是频道行的内容
-            if not line or '#genre#' in line.lower() or len(line) < 5:
+            if not line or '#genre#' in line.lower() or len(line) < 5 or skip_block:
                 continue
                 
-            # 检查是否需要过滤该地区（包含过滤关键词）
-            if should_filter_region(current_region):
+            # 当前地区块被过滤规则命中时跳过
+            if drop_rule is not None:
                 filtered_count += 1
-                if filtered_count <= 5:  # 只记录前5个被过滤的频道用于调试
-                    debug_log(f"过滤频道 (地区: {current_region}): {line.split(',')[0] if ',' in line else line}")
+                drop_counts[drop_rule] += 1
                 continue
                 
             # 尝试多种频道行格式
@@ -128,492 +646,3378 @@ def parse_original_data_skip_first_two_lines(content):
                 not channel_name.endswith('#genre#')):
                 
                 # 更宽松的URL验证
-                url_lower = channel_url.lower()
-                if any(proto in url_lower for proto in ['http', 'rtmp', 'rtsp', 'm3u8', 'udp', 'tcp', '.ts', '.m3u8']):
+                if looks_like_stream_url(channel_url):
                     # 移除所有双引号
                     channel_name = channel_name.replace('"', '')
                     channel_url = channel_url.replace('"', '')
-                    current_region = current_region.replace('"', '')
                     
-                    new_line = f'{channel_name},{channel_url}${current_region}'
-                    result.append(new_line)
+                    yield ChannelRecord(channel_name, channel_url, current_region)
                     valid_channels += 1
                     
                     if valid_channels <= 3:  # 只记录前3个成功解析的频道用于调试
-                        debug_log(f"成功解析频道: {channel_name}")
+                        debug_log("成功解析频道: %s", channel_name, level=DEBUG)
                     
         except Exception as e:
-            debug_log(f"解析频道行失败 (第{line_count}行): {e}")
+            debug_log("解析频道行失败 (第%d行): %s", line_count, e, level=DEBUG)
             continue
     
-    debug_log(f"解析完成，共找到 {len(result)} 个频道，过滤了 {filtered_count} 个频道")
-    return result
+    debug_log(f"解析完成，共找到 {valid_channels} 个频道，过滤了 {filtered_count} 个频道")
+    for rule, count in drop_counts.most_common():
+        debug_log(f"  过滤规则 {rule}: {count} 个")
+        metrics.count(f'filtered:{rule}', count)
+    metrics.count('lines', line_count)
+    metrics.count('channels_parsed', valid_channels)
+    metrics.count('channels_filtered', filtered_count)
 
-# 完整的分类映射（按照您要求的顺序）
-CATEGORY_MAPPING = {
-"央视频道,#genre#":[
-"CCTV-1综合","CCTV-2财经","CCTV-3综艺","CCTV-4中文国际","CCTV-5体育","CCTV-5+体育赛事","CCTV-6电影","CCTV-7国防军事","CCTV-8电视剧","CCTV-9纪录","CCTV-10科教","CCTV-11戏曲","CCTV-12社会与法","CCTV-13新闻","CCTV-14少儿","CCTV-15音乐","CCTV-16奥林匹克","CCTV-16奥林匹克4K","CCTV-17农业农村","CCTV-4欧洲","CCTV-4美洲","CCTV-4K","CCTV-8K","中央新影-中学生","中央新影-老故事","中央新影-发现之旅","CGTN","CGTN-纪录","CGTN-法语","CGTN-俄语","CGTN-西班牙语","CGTN-阿拉伯语","中国教育1台","中国教育2台","中国教育4台","早期教育"
-],
-"付费频道,#genre#":[
-"CCTV风云剧场","CCTV怀旧剧场","CCTV第一剧场","CCTV风云足球","CCTV央视台球","CCTV高尔夫·网球","CCTV风云音乐","CCTV央视文化精品","CCTV卫生健康","CCTV电视指南","CCTV兵器科技","CCTV女性时尚","CCTV世界地理","CHC家庭影院","CHC动作电影","CHC影迷电影"
-],
-"卫视频道,#genre#":[
-"山东卫视","北京卫视","东方卫视","重庆卫视","江苏卫视","浙江卫视","江西卫视","安徽卫视","湖南卫视","湖北卫视","河南卫视","河北卫视","广东卫视","广西卫视","深圳卫视","大湾区卫视","东南卫视","海南卫视","四川卫视","贵州卫视","云南卫视","天津卫视","辽宁卫视","黑龙江卫视","吉林卫视","内蒙古卫视","宁夏卫视","山西卫视","陕西卫视","甘肃卫视","青海卫视","新疆卫视","西藏卫视","三沙卫视","兵团卫视","延边卫视","安多卫视","康巴卫视","农林卫视","海峡卫视","山东教育卫视","西藏卫视藏语","安多卫视藏语","康巴卫视藏语","内蒙古卫视蒙语",
-"北京卫视4K","广东卫视4K","深圳卫视4K","山东卫视4K","湖南卫视4K","浙江卫视4K","江苏卫视4K","东方卫视4K","四川卫视4K"
-],
-"国际频道,#genre#":[
-"凤凰卫视","凤凰资讯","凤凰香港","凤凰电影","星空卫视","Channel[V]"
-],
-"山东频道,#genre#":[
-"山东齐鲁频道","山东体育频道","山东农科频道","山东新闻频道","山东少儿频道","山东文旅频道","山东综艺频道","山东生活频道","山东居家购物","济南新闻综合","济南教育频道","济南娱乐","济南少儿","济南影视","济南生活","济南都市","济南鲁中","济宁综合频道","宁阳综合频道","潍坊新闻综合","潍坊经济生活","东平综合频道","乳山综合频道","兖州新闻频道","兰陵综合频道","夏津公共频道","夏津综合频道","宁津综合频道","安丘综合频道","烟台影视频道","烟台新闻综合","烟台经济科技","禹城综合频道","禹城综艺频道","聊城民生频道","聊城综合频道","茌平综合频道","荣成综合频道","莘县综合频道","莱西综合频道","定陶TV-1","文登TV-1","邹城综合频道","郓城综合频道","阳信新闻综合","陵城综合频道","青州文化旅游","青州综合频道","齐河新闻频道","巨野新闻频道","平原综合频道","平度新闻综合","平阴综合频道","德州经济生活","德州新闻综合","新泰乡村频道","新泰综合频道","昌乐综合频道","昌邑综合频道","曲阜综合频道","梁山综合频道","武城综艺影视","武城综合频道","沾化综合频道","淄博影视频道","淄博新闻综合","新闻综合","无棣综合频道","日照岚山频道","蒙阴综合频道","单县综合频道","济阳综合频道","滨州综合频道","青岛1","青岛2","青岛3","青岛4","青岛5","青岛6","烟台公共","宁阳2","菏泽2","济宁公共","济宁生活","沂源新闻","淄博生活","淄博都市","东明1","东营公共","东营新闻","冠县综合","寿光蔬菜","惠民综合","日照新闻","日照科教","栖霞综合","桓台综合","滨州公共","滨州新闻","潍坊寿光新闻","牟平新闻","牟平生活","菏泽1","诸城新闻","长清新闻"
-],
-"北京频道,#genre#":[
-"北京IPTV4K超清","北京IPTV淘电影","北京IPTV淘剧场","北京IPTV淘精彩","北京IPTV淘娱乐","北京IPTV淘BABY","北京IPTV萌宠TV","北京IPTV重温经典","北京纪实科教","北京卡酷少儿","北京体育休闲","北京文艺频道","北京影视频道","北京财经频道","北京生活频道","北京新闻频道","北京青年","北京国际频道","朝阳区","通州区","门头沟区","房山区","密云区","延庆区"
-],
-"上海频道,#genre#":[
-"新视觉","上海新闻综合","上海第一财经","上海东方财经","上海东方影视","上海哈哈炫动","上海五星体育","上海劲爆体育","上海都市频道","上海教育教育","上海纪实人文","上海都市剧场","上海都市剧场4K","上海欢笑剧场","上海欢笑剧场4K","上海动漫秀场","上海动漫秀场4K","上海乐游频道","上海法治天地","上海金色学堂","上海游戏风云","上海生活时尚"
-],
-"广东频道,#genre#":[
-"广东体育频道","广东珠江频道","广东新闻频道","广东民生频道","广东经济科教","广东影视频道","广东少儿频道","广东嘉佳卡通","广东综艺4K","广东4K超高清","广东岭南戏曲","广州综合频道","广州新闻频道","广州影视频道","广州法治频道","南国都市4K","深圳都市频道","深圳电视剧频道","深圳财经生活","深圳体育健康","深圳少儿频道","宝安频道","深圳龙岗频道","佛山公共频道","佛山南海频道","佛山顺德频道","佛山影视频道","佛山综合频道","东莞新闻综合","东莞生活资讯","韶关新闻综合","湛江新闻综合","湛江公共频道","揭阳综合频道","揭阳生活频道","汕尾新闻综合","汕尾文化生活","江门综合频道","江门侨乡生活","潮州综合频道","潮州民生频道","惠州综合频道","惠州公共频道","珠海-1","肇庆综合频道","肇庆生活服务","河源综合频道","河源公共频道","清远新闻综合","清远文旅生活","云浮综合频道","云浮文旅频道","茂名综合频道","茂名文化生活","汕头综合频道","汕头经济生活","中山综合频道","香山文化频道","广东现代教育","广东南方购物","河源生活频道"
-],
-"内蒙古频道,#genre#":[
-"内蒙古蒙语频道","内蒙古经济生活","内蒙古新闻综合","内蒙古文体娱乐","内蒙古农牧频道","内蒙古少儿频道","呼市新闻综合","呼市新闻综合","包头经济频道","包头生活服务","包头新闻综合","乌海新闻综合","乌海都市生活","赤峰新闻综合","赤峰经济服务","赤峰影视娱乐","通辽城市服务","通辽新闻综合","通辽蒙语频道","呼伦贝尔新闻综合","呼伦贝尔文化旅游","呼伦贝尔生活资讯","巴彦淖尔新闻综合","巴彦淖尔经济生活","巴彦淖尔影视娱乐","鄂尔多斯新闻综合","鄂尔多斯经济服务","鄂尔多斯蒙语频道","锡林郭勒1","锡林郭勒2","杭后电视台","达茂电视台","库伦电视台","丰镇电视台","突泉电视台","阿尔山电视台","托克托电视台","额济纳新闻综合","西乌电视台","准格尔综合频道","伊金霍洛旗综合","苏尼特左旗","苏尼特右旗","乌拉特前旗","乌拉特中旗","乌拉特后旗","乌盟经济生活","乌盟新闻综合","兴安新闻综合","兴安文化旅游","兴安影视娱乐","阿拉善新闻综合","XHTV","ELTV","五原","磴口","武川","扎兰屯","阿巴嘎","翁牛特","满洲里","阿右旗","正蓝旗","东乌旗","土左旗","太仆寺旗","科右中旗","正镶白旗","扎赉特旗","察右中旗","喀喇沁县","额尔古纳","和林格尔","克什克腾旗","内蒙古购物"
-],
-"云南频道,#genre#":[
-"云南都市频道","云南娱乐频道","云南影视频道","云南康旅频道","云南少儿频道","澜湄国际频道","云南4K频道","楚雄新闻频道","禄丰市电视台"
-],
-"吉林频道,#genre#":[
-"长影频道","吉林教育","吉林篮球","扶余电视台","延边TV1","延边TV2","TTV洮南1","农安综合","吉林科教","辽源新闻综合","辽源民生社会","松原综合频道","松原生活频道","白山新闻综合1","白山旅游生活2","四平1","四平2","TTV1","TTV2","TTV3","磐石综合频道","图门电视台","双辽","梅河口电视台","DFTV综合","乾安综合"
-],
-"四川频道,#genre#":[
-"四川经济频道","四川文化旅游","四川新闻频道","四川影视文艺","四川星空购物","四川妇女儿童","四川科教频道","四川乡村频道","四川峨眉电影","成都综合频道","成都经济频道","成都生活频道","成都影视频道","成都公共频道","成都少儿频道","蓉城先锋"
-],
-"天津频道,#genre#":[
-"天津新闻频道","天津文艺频道","天津影视频道","天津都市频道","天津体育频道","天津教育频道","天津少儿频道","天津文旅频道","天津购物频道","蓟州电视台","滨海1","滨海2","静海电视台","河东频道","河西频道","保定电视台","大港油田企业"
-],
-"宁夏频道,#genre#":[
-"宁夏公共频道","宁夏教育频道","宁夏经济频道","宁夏少儿频道","宁夏文旅频道","银川公共频道","银川生活频道","银川文体频道"
-],
-"安徽频道,#genre#":[
-"安徽经济生活","安徽影视频道","安徽农业科教","安徽国际频道","安徽公共频道","安徽综艺体育","合肥新闻频道","肥西新闻综合","黄山新闻综合","黄山文旅频道","旌德新闻综合","霍邱新闻综合","六安综合频道","六安社会生活","淮北新闻综合","淮北经济生活","淮南新闻综合","淮南民生频道","滁州新闻综合","滁州科教频道","滁州公共频道","蒙城新闻频道","南陵新闻综合","祁门综合频道","湾沚综合频道","繁昌新闻综合","桐城综合频道","太湖新闻综合","池州新闻综合","池州文教生活","义安新闻综合","阜阳新闻综合","阜阳生活频道","阜阳教育频道","阜阳都市文艺","泗县新闻频道","临泉新闻频道","阜南新闻综合","亳州综合频道","亳州农村频道","徽州新闻频道","蚌埠新闻综合","蚌埠生活频道","寿县新闻综合","屯溪融媒频道","芜湖新闻综合","芜湖生活频道","无为新闻频道","马鞍山新闻综合","马鞍山科教生活","安庆新闻综合","安庆经济生活","潜山综合频道","黄山区融媒","歙县综合频道","休宁新闻综合","黟县新闻综合","宣城综合频道","宣城文旅生活","广德新闻综合","广德生活频道","郎溪新闻频道","宁国新闻综合","铜陵新闻综合","铜陵教育科技","枞阳电视台","霍山综合频道","金寨综合频道","濉溪新闻频道","宿州新闻综合","宿州公共频道","宿州科教频道","萧县新闻综合","五河新闻综合","固镇新闻综合","界首综合频道","利辛新闻综合","涡阳新闻综合"
-],
-"山西频道,#genre#":[
-"黄河电视台","山西经济与科技","山西影视","山西社会与法治","山西文体生活","晋中综合频道","晋中公共频道","运城1台","运城2台","盐湖频道","清徐","朔州-1","朔州-2","孝义电视台","古交电视台","阳曲","太原1","太原2","太原3","太原4","太原5","太原教育","晋能控股","大同教育","阳泉-1新闻综合","阳泉-2科教"
-],
-"广西频道,#genre#":[
-"广西综艺旅游","广西影视频道","广西新闻频道","广西都市频道","广西国际频道","广西移动电视","南宁新闻综合","南宁影视娱乐","南宁公共频道","南宁文旅生活","柳州新闻","北海新闻","玉林新闻","贺州新闻","桂林新闻"
-],
-"新疆频道,#genre#":[
-"XJTV-1","XJTV-2","XJTV-3","XJTV-4","XJTV-5","XJTV-6","XJTV-7","XJTV-8","包头TV1","包头TV2","包头TV3","乌鲁木齐1","阿克苏1","阿克苏2","阿拉尔","阿勒泰1","克孜勒苏柯尔克孜1","克孜勒苏柯尔克孜2","克孜勒苏柯尔克孜3","伊犁哈萨克1","伊犁哈萨克2","伊犁哈萨克3","伊犁哈萨克4","喀什1","喀什2","喀什3","巴音郭楞1","巴音郭楞2","巴音郭楞3","巴音郭楞4","昌吉市电视台","霍城1","呼图壁1","玛纳斯1","竹山1","竹山2","奎屯1","奎屯3","哈密TV1","哈密TV3"
-],
-"江苏频道,#genre#":[
-"江苏城市频道","江苏综艺频道","江苏体育休闲","江苏影视频道","江苏优漫卡通","江苏新闻频道","江苏教育频道","江苏国际频道","江苏财富天下","南京新闻综合","南京科教频道","南京生活频道"
-],
-"江西频道,#genre#":[
-"江西都市频道","江西经济生活","江西影视旅游","江西公共农业","江西少儿频道","江西新闻频道","江西教育频道"
-],
-"河北频道,#genre#":[
-"河北经济生活","河北都市频道","河北影视剧频道","河北少儿科教","河北文旅公共","河北农民","睛彩河北","河北杂技频道","河北三佳购物","石家庄新闻综合","石家庄文化娱乐","石家庄城市服务","承德新闻综合","承德旅游文化","秦皇岛新闻综合","秦皇岛公共频道","秦皇岛影视","唐山新闻综合","唐山生活服务","唐山影视频道","唐山公共频道","廊坊新闻综合","廊坊生活频道","保定新闻综合","保定公共频道","保定生活健康","衡水新闻综合","衡水经济科教","邢台综合频道","邢台城市生活","邯郸新闻综合","邯郸公共频道","邯郸科技教育","高邑融媒","井陉矿区电视台","深泽综合频道","赵县综合频道","晋州综合频道","井陉综合频道","平泉综合频道","兴隆综合频道","隆化综合频道","崇礼电视台","康保综合频道","遵化综合频道","三河综合频道","永清综合频道","成安综合频道","魏县综合新闻","滦南综合频道","玉田综合频道","吴桥综合频道","阜平电视台","涞水综合频道","黄骅电视台","定州新闻综合","雄县电视台","涞源综合频道","高碑店综合频道","涿州综合频道","唐县综合频道","曲阳综合频道","柏乡综合频道","徐水电视台","景县综合频道","饶阳电视台","深州新闻综合","涉县综合频道","鸡泽新闻综合","武安新闻综合","枣强综合频道","清河电视台","大厂融媒体中心","顺平电视","赤城电视","邯山电视","任县电视","双滦电视","滦平电视","赞皇电视","栾城电视","张家口新闻综合","张家口公共","沧州新闻综合","沧州公共频道","沧州影视娱乐","昌黎电视","抚宁电视","卢龙电视","丰南电视","迁西电视","滦州电视","香河电视","大城电视","固安电视","霸州电视","孟村电视","东光电视","青县电视","盐山电视","南皮电视","肃宁电视","丰宁电视","定兴电视","满城电视","望都电视","高阳电视","安新电视","容城电视","涿鹿电视","大名电视","冀州电视","安平电视","阜城电视","故城电视","广宗电视","宁晋电视","平乡电视","隆尧电视","广平电视","南和电视","临漳电视台","内丘电视台","迁安电视","馆陶电视","乐亭电视","沙河电视","南宫电视","丰润电视"
-],
-"河南频道,#genre#":[
-"河南都市频道","河南民生频道","河南法治频道","河南电视剧频道","河南新闻频道","河南乡村频道","河南戏曲频道","河南收藏天下","河南中华功夫","河南移动电视","河南欢腾购物","河南调解剧场","河南移动戏曲","河南睛彩中原","河南IPTV导视","郑州1新闻综合","郑州2商都频道","郑州3文体旅游","郑州4豫剧频道","郑州5妇女儿童","郑州6都市生活","洛阳-1新闻综合","洛阳-2科教频道","洛阳-3文旅频道","南阳1新闻综合","南阳2公共频道","南阳3科教频道","周口公共频道","周口教育频道","周口新闻综合","开封1新闻综合","开封2文化旅游","新乡公共频道","新乡新闻综合","焦作公共频道","焦作综合频道","漯河新闻综合","信阳新闻综合","信阳文旅频道","封丘1新闻综合","叶县电视台-1","新密综合频道","登封综合频道","巩义综合频道","新郑TV-1","渑池新闻综合","淅川电视台-1","新蔡TV","镇平新闻综合","宝丰TV-1","义马综合频道","鹤壁新闻综合","安阳新闻综合","三门峡新闻综合","卫辉综合频道","孟津综合综合","安阳文旅频道","淇县电视台","宜阳综合频道","汝阳综合频道","原阳电视台","宝丰-1","内黄综合频道","郏县综合频道","禹州电视台","杞县新闻综合","永城新闻联播","光山综合频道","商丘1新闻综合","商丘2公共频道","商丘3文体科教","许昌农业科教","许昌综合频道","平顶山新闻综合","平顶山城市频道","平顶山公共频道","平顶山教育台","新乡综合频道","邓州综合频道","获嘉综合频道","平煤安全环保","荥阳综合频道","健康河南融媒","灵宝综合频道","渑池新闻综合","济源-1","濮阳新闻综合","濮阳公共频道","新县综合频道","延津电视台","大象新闻","大剧院","舞钢电视台-1","嵩县综合新闻","浉河广电中心","平桥广电中心","郸城","唐河TV-1","上蔡-1","舞阳新闻综合","临颍综合频道","项城电视台"
-],
-"浙江频道,#genre#":[
-"浙江钱江频道","浙江经济生活","浙江教育频道","浙江民生休闲","浙江新闻频道","浙江少儿频道","浙江之江纪录","杭州综合","杭州明珠","杭州生活","杭州影视","杭州青少","杭州导视","宁波新闻综合","宁波生活频道","宁波文体频道","宁波影视频道","温州新闻综合","绍兴新闻综合","衢州新闻综合","衢州公共频道","温州新闻综合","绍兴新闻综合","湖州新闻","金华新闻","丽水新闻","嘉兴新闻","桐乡新闻","中国蓝直播"
-],
-"海南频道,#genre#":[
-"海南公共频道","海南少儿频道","海南文旅频道","海南新闻频道","海南自贸频道","海口1台","海口2台","海口3台","白沙TV","保亭TV","澄迈TV","儋州TV","定安TV","东方TV","临高","陵水TV","琼海TV","琼中TV","三亚1台","乐东TV","屯昌TV","昌江TV","万宁综合","文昌TV","五指山TV"
-],
-"湖北频道,#genre#":[
-"湖北公共新闻","湖北经视频道","湖北综合频道","湖北垄上频道","湖北影视频道","湖北生活频道","湖北教育频道","武汉新闻综合","武汉电视剧","武汉科技生活","武汉文体频道","武汉教育频道","阳新综合","房县综合","蔡甸综合"
-],
-"湖南频道,#genre#":[
-"湖南卫视FHD","金鹰卡通FHD","金鹰纪实FHD","快乐垂钓FHD","湖南经视FHD","湖南都市FHD","湖南国际FHD","湖南公共FHD","湖南娱乐FHD","湖南电影FHD","湖南电视剧FHD","湖南经视频道","湖南都市频道","湖南国际频道","湖南公共频道","湖南娱乐频道","湖南电影频道","湖南电视剧频道","长沙新闻综合","长沙政法频道","长沙文旅频道","益阳新闻综合","益阳公共频道","岳阳新闻综合","岳阳文旅都市","张家界1新闻综合","张家界2公共频道","湘西新闻综合","湘西文化旅游","株洲新闻综合","永州新闻综合","永州经济生活","湘潭新闻综合","湘潭县电视台","衡阳新闻综合","衡阳文旅法治","衡阳县电视台","邵阳新闻综合","邵阳文旅民生","郴州综合频道","郴州公共频道","怀化新闻综合","常德新闻综合","常德公共频道","娄底综合频道","娄底公共频道","娄底教育频道","东安新闻综合","桃源综合频道","双牌新闻综合","麻阳综合频道","宁远综合频道","汨罗综合频道","新化电视台","津市电视台","武冈综合频道","江永新闻频道","洪江新闻频道","涟源综合频道","溆浦综合频道","蓝山综合频道","新田综合频道","道县综合频道","中方台","桂东融媒"
-],
-"甘肃频道,#genre#":[
-"甘肃文化影视","甘肃公共频道","甘肃科教频道","甘肃经济频道","甘肃少儿频道","陇尚生活","临夏新闻综合","临夏文旅频道","皋兰电视台"
-],
-"福建频道,#genre#":[
-"福建综合频道,","福建公共频道","福建新闻频道","福建电视剧频道","福建经济频道","福建文体频道","福建少儿频道","福建教育频道","福建旅游频道","厦门一套","平潭卫视","龙岩综合频道","福州新闻","泉州一套","莆田新闻"
-],
-"贵州频道,#genre#":[
-"贵州公共频道","贵州影视文艺","贵州大众生活","贵州法制频道","贵州科教健康","贵州经济频道","贵州移动电视","贵阳-1","贵阳-2","贵阳-3","六盘水-1","六盘水-2","黔南-1","黔南-2","黔西南综合频道","黔西南公共频道","黔西-1","黔东南综合频道","遵义综合频道","遵义公共频道","遵义都市频道","铜仁-1","铜仁-2","毕节-1","毕节-2","安顺新闻综合","安顺公共频道","瓮安电视台","思南综合频道","凯里TV","雷山综合频道","贵州直播频道"
-],
-"辽宁频道,#genre#":[
-"辽宁都市频道","辽宁影视剧频道","辽宁体育休闲","辽宁生活频道","辽宁教育青少","辽宁北方频道","辽宁公共频道","辽宁经济频道","沈阳新闻综合","辽河新闻综合","辽河文化生活"
-],
-"重庆频道,#genre#":[
-"重庆新闻频道","重庆影视剧频道","重庆社会与法","重庆红岩文化","重庆文体娱乐","重庆新农村","重庆融媒","重庆少儿频道","重庆红叶频道","重庆汽摩频道","重庆移动频道","开州综合"
-],
-"陕西频道,#genre#":[
-"陕西新闻资讯","陕西都市青春","陕西体育休闲","陕西西部电影","陕西秦腔频道","陕西银铃频道","西安新闻综合","西安都市频道","西安商务资讯","西安戏剧影视","西安丝路频道","西安教育频道","西安乐购购物"
-],
-"青海频道,#genre#":[
-"青海都市","青海经视","西宁新闻综合","西宁生活服务","海东综合频道","海北电视台","海西电视台","久治","青海油田","矿区生活"
-],
-"黑龙江频道,#genre#":[
-"黑龙江影视频道","黑龙江新闻法治","黑龙江少儿频道","黑龙江文体频道","黑龙江农业科教","黑龙江都市频道","哈尔滨新闻综合","哈尔滨生活频道","哈尔滨影视频道","齐齐哈尔新闻综合","齐齐哈尔经济法治","佳木斯新闻综合"
-]
-}
-# 简化的频道名称映射
-CHANNEL_NAME_MAPPING = {
-"CCTV-1综合": ["CCTV-1综合"],
-"CCTV-2财经": ["CCTV-2财经"],
-"CCTV-3综艺": ["CCTV-3综艺"],
-"CCTV-4中文国际": ["CCTV-4中文国际"],
-"CCTV-5体育": ["CCTV-5体育"],
-"CCTV-5+体育赛事": ["CCTV-5+体育赛事","CCTV5+体育赛事"],
-"CCTV-6电影": ["CCTV-6电影"],
-"CCTV-7国防军事": ["CCTV-7国防军事"],
-"CCTV-8电视剧": ["CCTV-8电视剧"],
-"CCTV-9纪录": ["CCTV-9纪录"],
-"CCTV-10科教": ["CCTV-10科教"],
-"CCTV-11戏曲": ["CCTV-11戏曲"],
-"CCTV-12社会与法": ["CCTV-12社会与法"],
-"CCTV-13新闻": ["CCTV-13新闻"],
-"CCTV-14少儿": ["CCTV-14少儿"],
-"CCTV-15音乐": ["CCTV-15音乐"],
-"CCTV-16奥林匹克": ["CCTV-16奥林匹克"],
-"CCTV-16奥林匹克4K": ["CCTV-16奥林匹克4K"],
-"CCTV-17农业农村": ["CCTV-17农业农村"],
-"CCTV-4欧洲": ["CCTV4欧洲","CCTV-4欧洲","CCTV4欧洲 HD","CCTV-4 欧洲","CCTV-4中文国际欧洲","CCTV-4中文国际 欧洲"],
-"CCTV-4美洲": ["CCTV4美洲","CCTV-4北美","CCTV4美洲 HD","CCTV-4 美洲","CCTV-4中文国际美洲","CCTV-4中文国际 美洲"],
-"CCTV-4K": ["CCTV4K超高清","CCTV4K","CCTV-4K超高清","CCTV 4K","CCTV4K超"],
-"CCTV-8K": ["CCTV8K超高清","CCTV8K","CCTV-8K超高清","CCTV 8K"],
-"CCTV兵器科技": ["CCTV-兵器科技","CCTV兵器科技","兵器科技"],
-"CCTV风云音乐": ["CCTV-风云音乐","CCTV风云音乐","风云音乐"],
-"CCTV第一剧场": ["CCTV-第一剧场","CCTV第一剧场","第一剧场"],
-"CCTV风云足球": ["CCTV-风云足球","CCTV风云足球","风云足球"],
-"CCTV风云剧场": ["CCTV-风云剧场","CCTV风云剧场","风云剧场"],
-"CCTV怀旧剧场": ["CCTV-怀旧剧场","CCTV怀旧剧场","怀旧剧场"],
-"CCTV女性时尚": ["CCTV-女性时尚","CCTV女性时尚","女性时尚"],
-"CCTV世界地理": ["CCTV-世界地理","CCTV世界地理","世界地理"],
-"CCTV央视台球": ["CCTV-央视台球","CCTV央视台球","央视台球"],
-"CCTV高尔夫·网球": ["CCTV-高尔夫网球","CCTV高尔夫网球","CCTV央视高网","CCTV-高尔夫·网球","央视高网","高尔夫网球"],
-"CCTV央视文化精品": ["CCTV-央视文化精品","CCTV央视文化精品","CCTV文化精品","CCTV-文化精品","文化精品","央视文化精品"],
-"CCTV卫生健康": ["CCTV-卫生健康","CCTV卫生健康","卫生健康"],
-"CCTV电视指南": ["CCTV-电视指南","CCTV电视指南","电视指南"],
-"中国教育1台": ["CETV1","中国教育一台","中国教育1","CETV-1 综合教育","CETV-1"],
-"中国教育2台": ["CETV2","中国教育二台","中国教育2","CETV-2 空中课堂","CETV-2"],
-"中国教育3台": ["CETV3","中国教育三台","中国教育3","CETV-3 教育服务","CETV-3"],
-"中国教育4台": ["CETV4","中国教育四台","中国教育4","CETV-4 职业教育","CETV-4"],
-"早期教育": ["中国教育5台","中国教育5","中国教育五台","CETV早期教育","早期教育","CETV 早期教育","CETV-5","CETV5"],
-"CGTN": ["CGTN英语","CGTN-英语"],
-"CGTN-纪录": ["CGTN纪录","CGTN-纪录","CGTN记录","CGTN记录片"],
-"CGTN-西班牙语": ["CGTN-西班牙语","CGTN西班牙语","CGTN西语"],
-"CGTN-法语": ["CGTN-法语","CGTN法语"],
-"CGTN-俄语": ["CGTN-俄语","CGTN俄语"],
-"CGTN-阿拉伯语": ["CGTN-阿拉伯语","CGTN阿拉伯语"],
-"湖南卫视4K": ["湖南卫视4K"],
-"北京卫视4K": ["北京卫视4K","北京卫视4K超高清","北京卫视4K超"],
-"东方卫视4K": ["东方卫视4K"],
-"广东卫视4K": ["广东卫视4K"],
-"深圳卫视4K": ["深圳卫视4K"],
-"山东卫视4K": ["山东卫视4K"],
-"四川卫视4K": ["四川卫视4K"],
-"浙江卫视4K": ["浙江卫视4K"],
-"山东卫视": ["山东卫视"],
-"北京卫视": ["北京卫视"],
-"东方卫视": ["东方卫视"],
-"重庆卫视": ["重庆卫视"],
-"江苏卫视": ["江苏卫视"],
-"浙江卫视": ["浙江卫视"],
-"江西卫视": ["江西卫视"],
-"安徽卫视": ["安徽卫视"],
-"湖南卫视": ["湖南卫视"],
-"湖北卫视": ["湖北卫视"],
-"河南卫视": ["河南卫视"],
-"河北卫视": ["河北卫视"],
-"广东卫视": ["广东卫视"],
-"广西卫视": ["广西卫视"],
-"深圳卫视": ["深圳卫视"],
-"大湾区卫视": ["大湾区卫视"],
-"东南卫视": ["东南卫视"],
-"海南卫视": ["海南卫视"],
-"四川卫视": ["四川卫视"],
-"贵州卫视": ["贵州卫视"],
-"云南卫视": ["云南卫视"],
-"天津卫视": ["天津卫视"],
-"辽宁卫视": ["辽宁卫视"],
-"黑龙江卫视": ["黑龙江卫视"],
-"吉林卫视": ["吉林卫视"],
-"内蒙古卫视": ["内蒙古卫视"],
-"宁夏卫视": ["宁夏卫视"],
-"山西卫视": ["山西卫视"],
-"陕西卫视": ["陕西卫视"],
-"甘肃卫视": ["甘肃卫视"],
-"青海卫视": ["青海卫视"],
-"青海卫视": ["青海卫视"],
-"西藏卫视": ["西藏卫视"],
-"三沙卫视": ["三沙卫视","海南三沙卫视"],
-"兵团卫视": ["兵团卫视","新疆兵团卫视"],
-"延边卫视": ["延边卫视","吉林延边卫视"],
-"海峡卫视": ["海峡卫视","福建海峡卫视"],
-"农林卫视": ["农林卫视","陕西农林卫视"],
-"安多卫视": ["安多卫视","青海安多卫视"],
-"康巴卫视": ["康巴卫视","四川康巴卫视"],
-"西藏卫视藏语": ["西藏卫视（藏语）","西藏卫视藏语","西藏藏语频道"],
-"安多卫视藏语": ["安多藏语综合"],
-"康巴卫视藏语": ["康巴藏语综合"],
-"内蒙古卫视蒙语": ["内蒙古卫视（蒙语）"],
-"山东教育卫视": ["山东教育", "教育卫视"],
-"CHC影迷电影": ["CHC高清电影", "CHC-影迷电影", "影迷电影", "chc高清电影"],
-"CHC动作电影": ["CHC动作电影","CHC-动作电影"],
-"CHC家庭影院": ["CHC家庭影院","CHC-家庭影院"],
-"星空卫视": ["星空卫视", "星空衛视", "星空衛視"],
-"CHANNEL[V]": ["CHANNEL-V", "Channel[V]"],
-"凤凰卫视": ["凤凰卫视中文台", "凤凰中文", "凤凰卫视中文", "凤凰卫视"],
-"凤凰资讯": ["凤凰卫视资讯台", "凤凰资讯", "凤凰卫视资讯"],
-"凤凰香港": ["凤凰香港台", "凤凰卫视香港", "凤凰香港"],
-"凤凰电影": ["凤凰电影", "凤凰电影台", "凤凰卫视电影", "凤凰卫视电影台", " 凤凰电影"],
-"北京IPTV4K超清": ["IPTV淘4K", "北京IPTV4K超清", "北京淘4K", "淘4K", "淘 4K"],
-"北京IPTV淘电影": ["IPTV淘电影", "淘电影", "北京淘电影"],
-"北京IPTV淘精彩": ["IPTV淘精彩", "淘精彩", "北京淘精彩"],
-"北京IPTV淘剧场": ["IPTV淘剧场", "淘剧场", "北京淘剧场"],
-"北京IPTV淘娱乐": ["IPTV淘娱乐", "淘娱乐", "北京淘娱乐"],
-"北京IPTV淘BABY": ["IPTV淘BABY", "淘BABY", "北京淘BABY", "IPTV淘baby", "北京IPTV淘baby", "北京淘baby"],
-"北京IPTV萌宠TV": ["IPTV淘萌宠", "北京IPTV萌宠TV", "北京淘萌宠","淘萌宠"],
-"北京卡酷少儿": ["卡酷少儿", "北京卡酷少儿", "卡酷动画","北京KAKU少儿","BRTV卡酷少儿"],
-"北京纪实科教": ["纪实科教", "北京纪实科教", "BRTV纪实科教", "纪实科教8K"],
-"朝阳区": ["朝阳融媒"],
-"通州区": ["通州融媒"],
-"房山区": ["房山电视台"],
-"密云区": ["密云电视台"],
-"延庆区": ["延庆电视台"],
-"广东岭南戏曲": ["岭南戏曲", "广东岭南戏曲"],
-"广东现代教育": ["现代教育", "广东现代教育"],
-"广东南方购物": ["南方购物", "广东南方购物"],
-"惠州综合频道": ["HZTV-1", "惠州综合频道"],
-"惠州公共频道": ["HZTV-2", "惠州公共频道"],
-"广东嘉佳卡通": ["嘉佳卡通", "广东嘉佳卡通"],
-"江苏优漫卡通": ["优漫卡通", "江苏优漫卡通"],
-"湖南金鹰纪实": ["金鹰纪实", "湖南金鹰纪实"],
-"湖南金鹰卡通": ["金鹰卡通","湖南金鹰卡通"],
-"湖南快乐垂钓": ["快乐垂钓","湖南快乐垂钓"],
-"湖南茶频道": ["茶频道","湖南茶频道"],
-"湖南先锋乒羽": ["先锋乒羽","湖南先锋乒羽"],
-"上海新闻综合": ["新闻综合"],
-"上海都市频道": ["都市频道"],
-"上海东方影视": ["东方影视"],
-"上海教育频道": ["上海教育"],
-"上海第一财经": ["第一财经", "上海第一财经"],
-"上海动漫秀场": ["动漫秀场", "上海动漫秀场"],
-"上海动漫秀场4K": ["动漫秀场4K"],
-"上海都市剧场": ["都市剧场", "上海都市剧场"],
-"上海都市剧场4K": ["都市剧场4K"],
-"上海东方财经": ["东方财经", "上海东方财经"],
-"上海法治天地": ["法治天地", "上海法治天地"],
-"上海游戏风云": ["游戏风云", "上海游戏风云"],
-"上海生活时尚": ["生活时尚", "上海生活时尚"],
-"上海金色学堂": ["金色学堂", "上海金色学堂"],
-"上海乐游频道": ["乐游","乐游频道", "上海乐游","上海乐游纪实"],
-"上海欢笑剧场": ["欢笑剧场", "上海欢笑剧场"],
-"上海欢笑剧场4K": ["欢笑剧场4K", "上海欢笑剧场4K"],
-"上海哈哈炫动": ["哈哈炫动","炫动卡通", "上海哈哈炫动"],
-"河南梨园频道": ["梨园","河南梨园频道"],
-"河南文物宝库": ["文物宝库","河南文物宝库"],
-"河南武术世界": ["武术世界","河南武术世界"],
-"河北农民": ["河北三农频道"],
-"魅力足球": ["魅力足球"],
-"天元围棋": ["天元围棋"],
-"中国天气": ["中国天气"],
-"中国交通": ["中国交通","中国交通频道"],
-"睛彩青少": ["睛彩羽毛球"],
-"睛彩竞技": ["睛彩竞技"],
-"睛彩篮球": ["睛彩篮球"],
-"睛彩广场舞": ["睛彩广场舞"],
-"求索纪录": ["求索记录"],
-"求索纪录4K": ["求索纪录4K", "求索记录4K", "求索纪录 4K", "求索记录 4K"],
-"成都综合频道": ["CDTV1综合"],
-"成都经济频道": ["CDTV2经济"],
-"成都生活频道": ["CDTV3生活"],
-"成都影视频道": ["CDTV4影视"],
-"成都公共频道": ["CDTV5公共"],
-"成都少儿频道": ["CDTV6少儿"],
-"黄河电视台": ["山西黄河频道"],
-"山西影视": ["山西影视频道"],
-"XJTV-1": ["新疆卫视"],
-"XJTV-2": ["新疆卫视2"],
-"XJTV-3": ["新疆卫视3"],
-"XJTV-4": ["新疆卫视4"],
-"XJTV-5": ["新疆卫视5"],
-"XJTV-6": ["新疆卫视6"],
-"XJTV-7": ["新疆卫视10"],
-"XJTV-8": ["新疆卫视12"],
-"海南公共频道": ["海南公共"],
-"海南少儿频道": ["海南少儿"],
-"海南文旅频道": ["海南文旅"],
-"海南新闻频道": ["海南新闻"],
-"海南自贸频道": ["海南自贸"],
-"海口1台": ["海口1"],
-"三亚1台": ["三亚1"],
-"澄迈TV": ["澄迈"],
-"贵州公共频道": ["贵州卫视2"],
-"贵州影视文艺": ["贵州卫视3"],
-"贵州大众生活": ["贵州卫视4"],
-"贵州法制频道": ["贵州卫视5"],
-"贵州科教健康": ["贵州卫视6"],
-"贵州经济频道": ["贵州卫视7"],
-"重庆新闻频道": ["重庆新闻频道"],
-"重庆影视剧频道": ["重庆影视剧频道"],
-"重庆社会与法": ["重庆社会与法"],
-"重庆红岩文化": ["重庆红岩文化","重庆时红岩文化"],
-"重庆文体娱乐": ["重庆文体娱乐"],
-"重庆新农村": ["重庆新农村","重庆新农村频道"],
-"重庆融媒": ["重广融媒"],
-"重庆少儿频道": ["重庆少儿频道"],
-"重庆红叶频道": ["重庆红叶频道"],
-"重庆汽摩频道": ["汽摩","汽摩频道","重庆汽摩","重庆汽摩频道"],
-"重庆移动频道": ["重庆移动频道"],
-"开州综合": ["开州综合"]
-# 更多映射规则...（需要补充完整）
+# 字段中的控制字符（包括 \r 和 \n）
+CONTROL_CHARS_PATTERN = re.compile(r'[\x00-\x1f\x7f]+')
+
+def _filter_channel_entries(entries, source_format, region_filter=None):
+    """M3U/JSON解析器的公共部分：校验字段、去掉双引号、按地区过滤，产出 ChannelRecord
+
+    entries 为 (频道名称, 地址, 地区运营商) 的迭代器，过滤规则按地区缓存，统计方式与 genre 格式相同。
+    """
+    if region_filter is None:
+        region_filter = get_rules().region_filter
+    metrics = get_metrics()
+    drop_rules = {}
+    valid_channels = 0
+    filtered_count = 0
+    drop_counts = Counter()
+    for name, url, region in entries:
+        # 输出和缓冲都按行组织，字段中不能出现换行等控制字符：地址含控制字符时丢弃，名称和地区替换为空格
+        if CONTROL_CHARS_PATTERN.search(url):
+            continue
+        name = CONTROL_CHARS_PATTERN.sub(' ', name.replace('"', '')).strip()
+        url = url.replace('"', '').strip()
+        region = CONTROL_CHARS_PATTERN.sub(' ', region.replace('"', '')).strip()
+        if not name or not url or not looks_like_stream_url(url):
+            continue
+        if region not in drop_rules:
+            with metrics.stage('filter'):
+                drop_rules[region] = region_filter.match(region)
+            if UPDATE_MARKER_PATTERN.search(region):
+                drop_rules[region] = '更新时间分段'
+            region = sys.intern(region)
+        drop_rule = drop_rules[region]
+        if drop_rule is not None:
+            filtered_count += 1
+            drop_counts[drop_rule] += 1
+            continue
+        yield ChannelRecord(name, url, region)
+        valid_channels += 1
+
+    debug_log(f"解析完成（{source_format}），共找到 {valid_channels} 个频道，过滤了 {filtered_count} 个频道")
+    for rule, count in drop_counts.most_common():
+        debug_log(f"  过滤规则 {rule}: {count} 个")
+        metrics.count(f'filtered:{rule}', count)
+    metrics.count('channels_parsed', valid_channels)
+    metrics.count('channels_filtered', filtered_count)
+
+# 扩展M3U #EXTINF 行中的属性，如 tvg-name="CCTV1" group-title="央视"
+M3U_ATTRIBUTE_PATTERN = re.compile(r'([A-Za-z0-9_-]+)="([^"]*)"')
+
+def iter_m3u_entries(lines):
+    """解析扩展M3U：#EXTINF 行之后的第一个非注释行是地址
+
+    地区取 region 属性（本脚本生成的M3U），其次是 group-title，再次是 #EXTGRP；
+    频道名称取 #EXTINF 属性之后的显示名称，没有时用 tvg-name。
+    """
+    extinf = None
+    group = ''
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            if line.startswith('#EXTINF'):
+                extinf = line
+            elif line.startswith('#EXTGRP:'):
+                group = line[8:]
+            continue
+        if extinf is None:
+            continue
+        attributes = dict(M3U_ATTRIBUTE_PATTERN.findall(extinf))
+        # 显示名称在最后一个属性之后的逗号后面
+        _, _, title = extinf[extinf.rfind('"') + 1:].partition(',')
+        name = title.strip() or attributes.get('tvg-name', '')
+        region = attributes.get('region') or attributes.get('group-title') or group
+        yield name, line, region
+        extinf = None
+        group = ''
+
+# JSON频道对象中依次尝试的字段名
+JSON_NAME_KEYS = ('name', 'title', 'tvg-name', 'tvg_name', 'channel')
+JSON_URL_KEYS = ('url', 'uri', 'link', 'src')
+JSON_REGION_KEYS = ('region', 'group-title', 'group_title', 'group', 'category')
+JSON_SKIP_PATTERN = re.compile(r'[\s\ufeff]*')
+JSON_ARRAY_SKIP_PATTERN = re.compile(r'[\s\ufeff,]*')
+
+class _JSONStream:
+    """在文本块上按需解码JSON值的游标，缓冲区只保留尚未解码的部分"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+
+    def _fill(self):
+        """丢掉已解码的部分并追加下一块，没有更多数据时返回False"""
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self, skip=JSON_SKIP_PATTERN):
+        """跳过空白（以及skip匹配的分隔符），返回下一个字符；数据结束时返回空字符串"""
+        while True:
+            self.position = skip.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return ''
+
+    def decode(self):
+        """跳过空白后解码一个值；值被文本块截断时补上下一块再解析"""
+        if not self.peek():
+            raise self.error("缺少值")
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # 恰好在块末尾结束的值（如数字）可能还没读完
+            if end < len(self.buffer) or not self._fill():
+                self.position = end
+                return value
+
+    def error(self, message):
+        return json.JSONDecodeError(message, self.buffer, self.position)
+
+def _iter_json_array(stream):
+    """逐个产出数组元素（开头的 '[' 已读过）"""
+    while True:
+        char = stream.peek(JSON_ARRAY_SKIP_PATTERN)
+        if char == ']':
+            stream.position += 1
+            return
+        if not char:
+            raise stream.error("数组不完整")
+        yield stream.decode()
+
+def _iter_json_object(stream):
+    """逐个键读取对象：channels 数组的元素逐个产出，不把整个数组读入内存；
+    对象中没有 channels 数组时把整个对象作为一个频道产出"""
+    stream.position += 1
+    fields = {}
+    streamed = False
+    while True:
+        char = stream.peek(JSON_ARRAY_SKIP_PATTERN)
+        if char == '}':
+            stream.position += 1
+            break
+        if char != '"':
+            raise stream.error("对象不完整" if not char else "对象的键必须是字符串")
+        key = stream.decode()
+        if stream.peek() != ':':
+            raise stream.error("缺少 ':'")
+        stream.position += 1
+        if key == 'channels' and stream.peek() == '[':
+            stream.position += 1
+            yield from _iter_json_array(stream)
+            streamed = True
+        else:
+            fields[key] = stream.decode()
+    if not streamed:
+        yield fields
+
+def iter_json_values(chunks):
+    """从文本块中流式读出频道值：顶层数组的每个元素、JSON Lines 中的每个值，
+    或顶层对象 {"channels": [...]} 中数组的每个元素；内存中只保留当前元素"""
+    stream = _JSONStream(chunks)
+    char = stream.peek()
+    if char == '[':
+        stream.position += 1
+        yield from _iter_json_array(stream)
+        return
+    while char:
+        if char == '{':
+            yield from _iter_json_object(stream)
+        else:
+            yield stream.decode()
+        char = stream.peek()
+
+def _first_field(item, keys):
+    for key in keys:
+        value = item.get(key)
+        if isinstance(value, str) and value:
+            return value
+    return ''
+
+def iter_json_entries(chunks):
+    """解析JSON：频道对象的数组、JSON Lines 或 {"channels": [...]}；数组元素本身是带 channels 的对象时也展开"""
+    for value in iter_json_values(chunks):
+        items = value.get('channels', ()) if isinstance(value, dict) and 'channels' in value else (value,)
+        for item in items:
+            if isinstance(item, dict):
+                yield (_first_field(item, JSON_NAME_KEYS), _first_field(item, JSON_URL_KEYS),
+                       _first_field(item, JSON_REGION_KEYS))
+
+def parse_genre_text(chunks, region_filter=None):
+    """genre 格式：地区运营商,#genre# 分段，每行 频道名称,地址"""
+    return iter_parsed_channels(iter_text_lines(chunks), region_filter)
+
+def parse_m3u(chunks, region_filter=None):
+    return _filter_channel_entries(iter_m3u_entries(iter_text_lines(chunks)), 'm3u', region_filter)
+
+def parse_json(chunks, region_filter=None):
+    return _filter_channel_entries(iter_json_entries(chunks), 'json', region_filter)
+
+# 上游源格式 → 流式解析器；所有解析器都接收文本块迭代器，产出 ChannelRecord
+SOURCE_PARSERS = {
+    'txt': parse_genre_text,
+    'm3u': parse_m3u,
+    'json': parse_json,
 }
-def normalize_channel_name(channel_name):
+
+# 识别格式时最多查看的字符数
+SNIFF_CHARS = 4096
+# JSON的开头：数组后面紧跟对象、数组或 ']'，对象后面紧跟键或 '}'；
+# "[央视],#genre#" 这样以方括号开头的 genre 格式地区行不会被当作JSON
+JSON_START_PATTERN = re.compile(r'\[\s*[\[{\]]|\{\s*["}]')
+
+def sniff_source_format(chunks):
+    """根据开头的内容识别上游源格式，返回 (格式, 包含已读内容的文本块迭代器)"""
+    chunks = iter(chunks)
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= SNIFF_CHARS or (chunk and not chunk.isspace()):
+            break
+    start = ''.join(head)[:SNIFF_CHARS].lstrip('\ufeff \t\r\n')
+    if start.startswith(('#EXTM3U', '#EXTINF')):
+        source_format = 'm3u'
+    elif JSON_START_PATTERN.match(start):
+        source_format = 'json'
+    else:
+        source_format = 'txt'
+    return source_format, itertools.chain(head, chunks)
+
+def check_source_content(result):
+    """解析前检查上游源的正文；JSON格式需要完整读一遍，无效时把该上游源记为获取失败
+
+    JSON 解析器是流式的，中途出错时已经产出了部分频道，因此先完整校验一遍，
+    无效的上游源与下载失败一样整体跳过，不影响其他上游源。
+    """
+    source_format, chunks = sniff_source_format(result.iter_text())
+    if source_format != 'json':
+        return
+    try:
+        for _ in iter_json_values(chunks):
+            pass
+    except ValueError as e:
+        result.error = f"JSON无效: {e}"
+        result.close()
+
+def parse_source_content(content):
+    """识别格式并解析一个上游源的完整内容，返回 ChannelRecord 列表"""
+    source_format, chunks = sniff_source_format([content])
+    debug_log(f"开始解析原始数据（{source_format}）...")
+    return list(SOURCE_PARSERS[source_format](chunks))
+
+class _VariantAutomaton:
+    """Aho-Corasick多模式匹配自动机：一次扫描找出名称中包含的所有变体"""
+
+    def __init__(self, patterns):
+        # patterns: [(小写变体, 顺序号)]，同一变体只保留最小顺序号
+        self.goto = [{}]
+        self.fail = [0]
+        self.best = [None]  # 每个状态（含失败链）命中的最小顺序号
+        self.empty_order = None
+        for pattern, order in patterns:
+            if not pattern:
+                if self.empty_order is None or order < self.empty_order:
+                    self.empty_order = order
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.best.append(None)
+                state = nxt
+            if self.best[state] is None or order < self.best[state]:
+                self.best[state] = order
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        """按BFS顺序建立失败指针，并把失败链上的最小顺序号合并到当前状态"""
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                inherited = self.best[self.fail[nxt]]
+                if inherited is not None and (self.best[nxt] is None or inherited < self.best[nxt]):
+                    self.best[nxt] = inherited
+
+    def min_order_in(self, text):
+        """返回text中出现的变体的最小顺序号，没有则返回None"""
+        best = self.empty_order
+        goto = self.goto
+        fail = self.fail
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            found = self.best[state]
+            if found is not None and (best is None or found < best):
+                best = found
+        return best
+
+
+class _VariantSuffixAutomaton:
+    """广义后缀自动机：查询名称是哪些变体的子串，返回最小顺序号"""
+
+    def __init__(self, patterns):
+        self.next = [{}]
+        self.link = [-1]
+        self.length = [0]
+        self.best = [None]
+        last = 0
+        for pattern, order in patterns:
+            # 用不会出现在频道名中的分隔符把所有变体串起来
+            for ch in pattern + '\x00':
+                last = self._extend(last, ch)
+                if ch != '\x00':
+                    if self.best[last] is None or order < self.best[last]:
+                        self.best[last] = order
+        # 沿后缀链接向上传播最小顺序号（endpos集合的并）
+        for state in sorted(range(1, len(self.next)), key=self.length.__getitem__, reverse=True):
+            parent = self.link[state]
+            found = self.best[state]
+            if found is not None and (self.best[parent] is None or found < self.best[parent]):
+                self.best[parent] = found
+        # 空串是任何变体的子串
+        orders = [order for _, order in patterns]
+        self.best[0] = min(orders) if orders else None
+
+    def _extend(self, last, ch):
+        cur = len(self.next)
+        self.next.append({})
+        self.length.append(self.length[last] + 1)
+        self.link.append(0)
+        self.best.append(None)
+        state = last
+        while state != -1 and ch not in self.next[state]:
+            self.next[state][ch] = cur
+            state = self.link[state]
+        if state == -1:
+            return cur
+        target = self.next[state][ch]
+        if self.length[state] + 1 == self.length[target]:
+            self.link[cur] = target
+            return cur
+        clone = len(self.next)
+        self.next.append(dict(self.next[target]))
+        self.length.append(self.length[state] + 1)
+        self.link.append(self.link[target])
+        self.best.append(None)
+        while state != -1 and self.next[state].get(ch) == target:
+            self.next[state][ch] = clone
+            state = self.link[state]
+        self.link[target] = clone
+        self.link[cur] = clone
+        return cur
+
+    def min_order_containing(self, text):
+        """返回包含text的变体的最小顺序号，没有则返回None"""
+        state = 0
+        for ch in text:
+            state = self.next[state].get(ch)
+            if state is None:
+                return None
+        return self.best[state]
+
+
+class ChannelNameNormalizer:
+    """预编译的频道名称标准化器
+
+    精确匹配使用变体到标准名的哈希索引；模糊匹配使用两个自动机分别处理
+    "变体是名称的子串"和"名称是变体的子串"两个方向，取映射表中最靠前的命中，
+    结果与逐项线性扫描完全一致。
+    """
+
+    def __init__(self, name_mapping):
+        self.exact_index = {}
+        self.standard_names = []
+        patterns = []
+        for standard_name, variants in name_mapping.items():
+            for variant in variants:
+                # 精确匹配：同一变体出现在多个标准名下时，保留第一个
+                self.exact_index.setdefault(variant, standard_name)
+                patterns.append((variant.lower(), len(self.standard_names)))
+                self.standard_names.append(standard_name)
+        self.contained_matcher = _VariantAutomaton(patterns)
+        self.containing_matcher = _VariantSuffixAutomaton(patterns)
+
+    def normalize(self, channel_name, substring=True):
+        """标准化频道名称；substring为False时只做精确匹配，其余交给模糊匹配器决定"""
+        channel_name_clean = channel_name.strip()
+
+        # 先精确匹配
+        standard_name = self.exact_index.get(channel_name_clean)
+        if standard_name is not None or not substring:
+            return standard_name or channel_name_clean
+
+        # 然后模糊匹配：变体包含于名称，或名称包含于变体
+        name_lower = channel_name_clean.lower()
+        order = self.contained_matcher.min_order_in(name_lower)
+        containing = self.containing_matcher.min_order_containing(name_lower)
+        if containing is not None and (order is None or containing < order):
+            order = containing
+        if order is not None:
+            return self.standard_names[order]
+
+        return channel_name_clean
+
+
+def get_channel_name_normalizer():
+    """获取全局频道名称标准化器（来自当前规则）"""
+    return get_rules().normalizer
+
+def normalize_channel_name(channel_name, substring=True):
     """标准化频道名称"""
-    channel_name_clean = channel_name.strip()
-    
-    # 先精确匹配
-    for standard_name, variants in CHANNEL_NAME_MAPPING.items():
-        if channel_name_clean in variants:
-            return standard_name
-    
-    # 然后模糊匹配
-    for standard_name, variants in CHANNEL_NAME_MAPPING.items():
-        for variant in variants:
-            if variant.lower() in channel_name_clean.lower() or channel_name_clean.lower() in variant.lower():
-                return standard_name
-                
-    return channel_name_clean
+    return get_channel_name_normalizer().normalize(channel_name, substring)
+
+# 模糊匹配时忽略的画质和"频道"后缀（4K/8K是不同的频道，不在其中）
+FUZZY_STRIP_SUFFIXES = ('fhd', 'uhd', 'hd', 'sd', '高清', '超清', '标清', '蓝光', '频道')
+# 模糊匹配结果缓存的名称数上限；守护模式下匹配器跨轮复用，缓存不能无限增长
+FUZZY_CACHE_SIZE = 16384
+FUZZY_DIGITS_PATTERN = re.compile(r'\d+')
+
+def fuzzy_key(name):
+    """模糊匹配用的键：全角转半角、转小写、去掉空白和标点（保留'+'，CCTV-5与CCTV-5+是不同频道）"""
+    key = unicodedata.normalize('NFKC', name).lower()
+    return ''.join(ch for ch in key if unicodedata.category(ch)[0] not in 'PZC')
+
+def strip_fuzzy_suffixes(key, suffixes=FUZZY_STRIP_SUFFIXES):
+    """反复去掉结尾的画质/频道后缀，至少保留一个字符"""
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in suffixes:
+            if key.endswith(suffix) and len(key) > len(suffix):
+                key = key[:-len(suffix)]
+                stripped = True
+    return key
+
+class FuzzyNameMatcher:
+    """未分类频道名到标准频道名的模糊匹配
+
+    依次尝试：规范化键精确匹配（忽略全半角、大小写、标点）→ 去掉画质/频道后缀后精确匹配
+    → 二元组（bigram）倒排索引上的Dice相似度搜索。相似度搜索只访问与查询共享二元组的候选，
+    与标准名总数无关；名称中的数字必须完全一致（避免CCTV-1匹配到CCTV-10），
+    过短的名称不做相似度搜索。同一名称的结果放在LRU缓存中，最多cache_size个。
+    aliases 为 (别名, 标准名)，来自频道名称映射，与标准名一样参与匹配，匹配到时返回对应的标准名；
+    标准名优先于别名，标准名不在 canonical_names 中的别名被忽略。
+    """
+
+    def __init__(self, canonical_names, aliases=(), threshold=0.8, min_length=3, suffixes=FUZZY_STRIP_SUFFIXES,
+                 cache_size=FUZZY_CACHE_SIZE):
+        self.threshold = threshold
+        self.min_length = min_length
+        self.suffixes = tuple(suffixes)
+        # 含','或'$'的标准名写出后无法被正确解析，不作为匹配目标
+        targets = dict.fromkeys((name, name) for name in canonical_names)
+        canonical = {name for _, name in targets}
+        # 标准名本身不是匹配目标（没有分类）的别名会挡住其他写法的匹配，跳过
+        targets.update(dict.fromkeys(alias for alias in aliases if alias[1] in canonical))
+        targets = [(text, name) for text, name in targets if ',' not in name and '$' not in name]
+        # names[i] 是第i个匹配目标对应的标准名
+        self.names = [name for _, name in targets]
+        self._exact = {}
+        self._stripped = {}
+        self._grams = []
+        self._digits = []
+        self._postings = defaultdict(list)
+        for name_id, (text, name) in enumerate(targets):
+            key = fuzzy_key(text)
+            stripped = strip_fuzzy_suffixes(key, self.suffixes)
+            # 多个标准名规范化后相同时，保留规则中靠前的
+            self._exact.setdefault(key, name)
+            self._stripped.setdefault(stripped, name)
+            grams = self._bigrams(stripped)
+            self._grams.append(len(grams))
+            self._digits.append(FUZZY_DIGITS_PATTERN.findall(stripped))
+            for gram in grams:
+                self._postings[gram].append(name_id)
+        self._cached_match = functools.lru_cache(maxsize=cache_size)(self._match)
+
+    @staticmethod
+    def _bigrams(key):
+        if len(key) < 2:
+            return {key}
+        return {key[i:i + 2] for i in range(len(key) - 1)}
+
+    def match(self, name):
+        """返回匹配的标准频道名，没有足够相似的返回None"""
+        return self._cached_match(name)
+
+    def _match(self, name):
+        key = fuzzy_key(name)
+        if not key:
+            return None
+        found = self._exact.get(key)
+        if found is not None:
+            return found
+        stripped = strip_fuzzy_suffixes(key, self.suffixes)
+        found = self._stripped.get(stripped)
+        if found is not None:
+            return found
+        if len(stripped) < self.min_length:
+            return None
+        grams = self._bigrams(stripped)
+        shared = Counter()
+        for gram in grams:
+            for name_id in self._postings.get(gram, ()):
+                shared[name_id] += 1
+        digits = FUZZY_DIGITS_PATTERN.findall(stripped)
+        best_id = None
+        best_score = self.threshold
+        for name_id, common in shared.items():
+            score = 2.0 * common / (len(grams) + self._grams[name_id])
+            if score < best_score or (score == best_score and best_id is not None and name_id > best_id):
+                continue
+            if self._digits[name_id] != digits:
+                continue
+            best_id, best_score = name_id, score
+        return self.names[best_id] if best_id is not None else None
+
+class CategoryIndex:
+    """频道名到分类的只读反向索引
+
+    由规则文件中的 category_mapping 一次性构建：每个频道名映射到 (分类, 在分类中的位置)。
+    同一频道名出现在多个分类时，沿用原来"第一个匹配的分类生效"的规则，
+    并在 duplicates 中记录它出现过的全部分类。
+    fuzzy 为 FuzzyNameMatcher 时，精确查不到的名称再做一次模糊匹配。
+    """
+
+    def __init__(self, category_mapping, fuzzy=None):
+        self.fuzzy = fuzzy
+        # 分类名会出现在每条已分类的 ChannelRecord 中，驻留后共享
+        category_mapping = {sys.intern(category): channels for category, channels in category_mapping.items()}
+        self.categories = tuple(category_mapping.keys())
+        self._category_order = {category: order for order, category in enumerate(self.categories)}
+        index = {}
+        seen_in = defaultdict(list)
+        for category, channels in category_mapping.items():
+            for position, channel in enumerate(channels):
+                if category not in seen_in[channel]:
+                    seen_in[channel].append(category)
+                index.setdefault(channel, (category, position))
+        self._index = MappingProxyType(index)
+        self.duplicates = MappingProxyType({
+            channel: tuple(categories)
+            for channel, categories in seen_in.items()
+            if len(categories) > 1
+        })
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, channel_name):
+        return channel_name in self._index
+
+    def lookup(self, channel_name):
+        """返回 (分类, 位置)，未分类返回None"""
+        return self._index.get(channel_name)
+
+    def category_of(self, channel_name):
+        """返回频道所属分类，未分类返回None"""
+        entry = self._index.get(channel_name)
+        return entry[0] if entry else None
+
+    def sort_key(self, channel_name):
+        """按 category_mapping 中的分类顺序和频道顺序排序的键，未分类的排在最后"""
+        entry = self._index.get(channel_name)
+        if entry is None:
+            return (len(self.categories), 0)
+        return (self._category_order[entry[0]], entry[1])
+
+
+# 分类、频道名称映射和过滤规则放在脚本旁的规则文件中，修改规则不需要改代码
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'live_rules.json')
+RULES_FORMAT_VERSION = 1
+
+class RulesError(ValueError):
+    """规则文件缺失、无法解析或内容不合法"""
+
+def _load_rules_document(path, raw):
+    """按扩展名解析规则文件：.json 总是可用，.yaml/.yml 需要PyYAML，.toml 需要Python 3.11+"""
+    extension = os.path.splitext(path)[1].lower()
+    text = raw.decode('utf-8-sig')
+    if extension in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise RulesError(f"规则文件 {path} 是YAML格式，需要先安装PyYAML（pip install pyyaml）")
+        try:
+            return yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise RulesError(f"规则文件 {path} 不是有效的YAML: {e}")
+    if extension == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            raise RulesError(f"规则文件 {path} 是TOML格式，需要Python 3.11及以上版本")
+        try:
+            return tomllib.loads(text)
+        except tomllib.TOMLDecodeError as e:
+            raise RulesError(f"规则文件 {path} 不是有效的TOML: {e}")
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        raise RulesError(f"规则文件 {path} 不是有效的JSON: {e}")
+
+def _require_string_lists(path, section, mapping):
+    """校验 {字符串: [字符串, ...]} 形式的映射"""
+    if not isinstance(mapping, dict):
+        raise RulesError(f"规则文件 {path}: {section} 必须是对象")
+    for key, values in mapping.items():
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise RulesError(f"规则文件 {path}: {section}[{key!r}] 必须是字符串列表")
+
+def validate_rules(document, path):
+    """校验规则文件内容，返回 (分类映射, 频道名称映射, 编译后的地区过滤器, 模糊匹配参数)"""
+    if not isinstance(document, dict):
+        raise RulesError(f"规则文件 {path}: 顶层必须是对象")
+    version = document.get('version', RULES_FORMAT_VERSION)
+    if version != RULES_FORMAT_VERSION:
+        raise RulesError(f"规则文件 {path}: 不支持的版本 {version!r}，当前支持 {RULES_FORMAT_VERSION}")
+    for section in ('category_mapping', 'channel_name_mapping'):
+        if section not in document:
+            raise RulesError(f"规则文件 {path}: 缺少 {section}")
+    category_mapping = document['category_mapping']
+    channel_name_mapping = document['channel_name_mapping']
+    _require_string_lists(path, 'category_mapping', category_mapping)
+    _require_string_lists(path, 'channel_name_mapping', channel_name_mapping)
+    for category in category_mapping:
+        if not category.endswith(',#genre#'):
+            raise RulesError(f"规则文件 {path}: 分类名 {category!r} 必须以 ',#genre#' 结尾")
+    filters = document.get('filters', {})
+    if not isinstance(filters, dict):
+        raise RulesError(f"规则文件 {path}: filters 必须是对象")
+    region = filters.get('region', {})
+    if not isinstance(region, dict):
+        raise RulesError(f"规则文件 {path}: filters.region 必须是对象")
+    try:
+        region_filter = RegionFilter(include=region.get('include', ()), exclude=region.get('exclude', ()))
+    except RulesError as e:
+        raise RulesError(f"规则文件 {path}: filters.region {e}")
+    return category_mapping, channel_name_mapping, region_filter, _validate_fuzzy(document.get('fuzzy', {}), path)
+
+def _validate_fuzzy(fuzzy, path):
+    """校验模糊匹配设置，返回 FuzzyNameMatcher 的参数，未启用时返回None"""
+    if not isinstance(fuzzy, dict):
+        raise RulesError(f"规则文件 {path}: fuzzy 必须是对象")
+    if not fuzzy.get('enabled', False):
+        return None
+    threshold = fuzzy.get('threshold', 0.8)
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 < threshold <= 1:
+        raise RulesError(f"规则文件 {path}: fuzzy.threshold 必须是 (0, 1] 之间的数")
+    min_length = fuzzy.get('min_length', 3)
+    if isinstance(min_length, bool) or not isinstance(min_length, int) or min_length < 1:
+        raise RulesError(f"规则文件 {path}: fuzzy.min_length 必须是正整数")
+    suffixes = fuzzy.get('strip_suffixes', list(FUZZY_STRIP_SUFFIXES))
+    if not isinstance(suffixes, list) or not all(isinstance(item, str) and item for item in suffixes):
+        raise RulesError(f"规则文件 {path}: fuzzy.strip_suffixes 必须是非空字符串列表")
+    return {'threshold': float(threshold), 'min_length': min_length,
+            'suffixes': tuple(fuzzy_key(item) for item in suffixes)}
+
+# 地区过滤规则支持的匹配方式
+REGION_PATTERN_TYPES = ('substring', 'glob', 'regex')
+
+def compile_region_pattern(pattern, pattern_type='substring'):
+    """把子串、通配符或正则模式统一编译为正则：子串和正则在任意位置匹配，通配符匹配整个地区名"""
+    if not isinstance(pattern, str) or not pattern:
+        raise RulesError(f"模式必须是非空字符串: {pattern!r}")
+    if pattern_type == 'substring':
+        return re.compile(re.escape(pattern))
+    if pattern_type == 'glob':
+        return re.compile(fnmatch.translate(pattern))
+    if pattern_type == 'regex':
+        try:
+            return re.compile(pattern)
+        except re.error as e:
+            raise RulesError(f"无效的正则 {pattern!r}: {e}")
+    raise RulesError(f"未知的匹配方式 {pattern_type!r}，可选 {', '.join(REGION_PATTERN_TYPES)}")
+
+class RegionRule:
+    """一条编译后的地区规则：命中 pattern 且不命中任何 except 模式时生效"""
+
+    __slots__ = ('action', 'label', 'pattern', 'exceptions')
+
+    def __init__(self, action, spec):
+        if isinstance(spec, str):
+            spec = {'match': spec}
+        if not isinstance(spec, dict) or 'match' not in spec:
+            raise RulesError(f"{action} 规则必须是字符串或包含 match 的对象: {spec!r}")
+        pattern_type = spec.get('type', 'substring')
+        exceptions = spec.get('except', [])
+        if isinstance(exceptions, str):
+            exceptions = [exceptions]
+        if not isinstance(exceptions, list):
+            raise RulesError(f"{action} 规则的 except 必须是字符串列表: {spec!r}")
+        self.action = action
+        self.pattern = compile_region_pattern(spec['match'], pattern_type)
+        self.exceptions = tuple(compile_region_pattern(item, pattern_type) for item in exceptions)
+        label = spec.get('name')
+        if not label:
+            label = f"{action}:{spec['match']}"
+            if exceptions:
+                label += f" (除{'、'.join(exceptions)})"
+        self.label = label
+
+    def matches(self, region):
+        if self.pattern.search(region) is None:
+            return False
+        return not any(exception.search(region) for exception in self.exceptions)
+
+class RegionFilter:
+    """地区运营商过滤器
+
+    规则写在规则文件的 filters.region 中：
+      include: 非空时地区必须命中其中一条才保留
+      exclude: 命中任何一条即过滤
+    每条规则可以是子串，或 {"match": 模式, "type": "substring|glob|regex", "except": [例外模式], "name": 名称}，
+    例如 {"match": "移动", "except": ["广东"]} 表示过滤除广东以外的移动线路。
+    每个地区的判断结果只计算一次并缓存。
+    """
+
+    INCLUDE_MISS = 'include:未命中任何保留规则'
+
+    def __init__(self, include=(), exclude=()):
+        for action, specs in (('include', include), ('exclude', exclude)):
+            if not isinstance(specs, (list, tuple)):
+                raise RulesError(f"{action} 必须是列表")
+        self.include = tuple(RegionRule('include', spec) for spec in include)
+        self.exclude = tuple(RegionRule('exclude', spec) for spec in exclude)
+        self._decisions = {}
+
+    def match(self, region):
+        """返回过滤该地区的规则名称，保留时返回None"""
+        try:
+            return self._decisions[region]
+        except KeyError:
+            pass
+        decision = None
+        if self.include and not any(rule.matches(region) for rule in self.include):
+            decision = self.INCLUDE_MISS
+        else:
+            for rule in self.exclude:
+                if rule.matches(region):
+                    decision = rule.label
+                    break
+        self._decisions[region] = decision
+        return decision
+
+class LiveRules:
+    """编译后的处理规则：分类反向索引、频道名称标准化自动机和地区过滤器"""
+
+    def __init__(self, category_mapping, channel_name_mapping, region_filter=None,
+                 path=None, digest=None, fuzzy_options=None):
+        self.path = path
+        self.digest = digest
+        self.category_mapping = category_mapping
+        self.channel_name_mapping = channel_name_mapping
+        self.region_filter = region_filter or RegionFilter()
+        fuzzy = None
+        if fuzzy_options is not None:
+            fuzzy = FuzzyNameMatcher((name for channels in category_mapping.values() for name in channels),
+                                     aliases=((variant, standard) for standard, variants in channel_name_mapping.items()
+                                              for variant in variants),
+                                     **fuzzy_options)
+        self.category_index = CategoryIndex(category_mapping, fuzzy=fuzzy)
+        self.normalizer = ChannelNameNormalizer(channel_name_mapping)
+
+def load_rules(path=RULES_FILE, fuzzy=True):
+    """加载并编译规则文件；fuzzy为False时忽略规则文件中的模糊匹配设置。
+
+    编译只需几毫秒，不写磁盘缓存；守护模式在内存中复用编译结果，规则文件变化时才重新编译。
+    """
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read()
+    except OSError as e:
+        raise RulesError(f"无法读取规则文件 {path}: {e}")
+    digest = hashlib.sha256(raw).hexdigest()
+    category_mapping, channel_name_mapping, region_filter, fuzzy_options = validate_rules(
+        _load_rules_document(path, raw), path)
+    rules = LiveRules(category_mapping, channel_name_mapping, region_filter, path=path, digest=digest,
+                      fuzzy_options=fuzzy_options if fuzzy else None)
+    debug_log(f"已编译规则文件 {path}")
+    for channel, categories in rules.category_index.duplicates.items():
+        debug_log(f"频道 {channel} 出现在多个分类中: {', '.join(categories)}，使用第一个")
+    return rules
+
+_rules = None
+
+def set_rules(rules):
+    """替换当前生效的规则"""
+    global _rules
+    _rules = rules
+
+def get_rules():
+    """获取当前规则；首次调用时加载默认规则文件"""
+    if _rules is None:
+        set_rules(load_rules())
+    return _rules
+
+def get_category_index():
+    """获取全局分类反向索引（来自当前规则）"""
+    return get_rules().category_index
 
 def clean_region(region):
     """清洗地区运营商，去掉'-组播'字段"""
     return region.replace("-组播", "")
 
-def categorize_channels(formatted_channels):
-    """根据分类规则重新分类频道"""
-    if not formatted_channels:
+@functools.lru_cache(maxsize=4096)
+def _cleaned_region(region):
+    """清洗并驻留地区运营商，同一地区的频道共享清洗结果"""
+    return sys.intern(clean_region(region))
+
+def categorize_channel(channel, category_index=None):
+    """对单个频道分类，返回新的 ChannelRecord：已分类的使用标准名称，未分类的分类为None并保留原始名称"""
+    if category_index is None:
+        category_index = get_category_index()
+    channel_name = channel.name
+    # 开启模糊匹配时标准化只查精确映射：双向子串匹配对短名称不可靠（如"卫视"、"新闻综合"），
+    # 其余名称都交给模糊匹配器；关闭时保持原来的子串匹配
+    substring = category_index.fuzzy is None
+
+    if _metrics.enabled:
+        with _metrics.stage('normalize'):
+            normalized_name = normalize_channel_name(channel_name, substring)
+    else:
+        normalized_name = normalize_channel_name(channel_name, substring)
+    # 清洗地区运营商
+    cleaned_region = _cleaned_region(channel.region)
+    # 查找分类
+    category = category_index.category_of(normalized_name)
+    if category is None and category_index.fuzzy is not None:
+        # 拼写不同的频道名：先用原始名称，再用标准化后的名称做模糊匹配
+        matched = category_index.fuzzy.match(channel_name)
+        if matched is None and normalized_name != channel_name:
+            matched = category_index.fuzzy.match(normalized_name)
+        if matched is not None:
+            normalized_name = matched
+            category = category_index.category_of(matched)
+            _metrics.count('fuzzy_matched')
+    if category is not None:
+        return ChannelRecord(normalized_name, channel.url, cleaned_region, category)
+    # 未分类的频道保留原始名称
+    return ChannelRecord(channel_name, channel.url, cleaned_region)
+
+def categorize_channels(channels):
+    """根据分类规则重新分类频道，返回 ({分类: [ChannelRecord]}, [未分类的ChannelRecord])"""
+    if not channels:
         debug_log("没有频道需要分类")
         return {}, []
         
     debug_log("开始分类频道...")
     categorized = defaultdict(list)
     uncategorized = []
-    
-    for channel_line in formatted_channels:
-        # 解析频道行 - 格式是: 频道名称,地址$地区运营商
-        match = re.match(r'^([^,]+),([^$]+)\$([^$]+)$', channel_line)
-        if not match:
-            continue
-            
-        channel_name, channel_url, region = match.groups()
-        normalized_name = normalize_channel_name(channel_name)
-        
-        # 查找分类
-        categorized_flag = False
-        for category, channels in CATEGORY_MAPPING.items():
-            if normalized_name in channels:
-                # 清洗地区运营商
-                cleaned_region = clean_region(region)
-                # 存储完整格式：频道名称,地址$地区运营商
-                categorized[category].append(f'{normalized_name},{channel_url}${cleaned_region}')
-                categorized_flag = True
-                break
-        
-        if not categorized_flag:
-            # 对于未分类的频道也清洗地区运营商
-            cleaned_region = clean_region(region)
-            uncategorized.append(f'{channel_name},{channel_url}${cleaned_region}')
+    category_index = get_category_index()
+
+    for channel in channels:
+        channel = categorize_channel(channel, category_index=category_index)
+        if channel.category is not None:
+            categorized[channel.category].append(channel)
+        else:
+            uncategorized.append(channel)
     
     debug_log(f"分类完成: 已分类 {sum(len(channels) for channels in categorized.values())}, 未分类 {len(uncategorized)}")
     return categorized, uncategorized
 
-def generate_output_files(categorized_channels, uncategorized_channels, all_channels):
-    """生成输出文件"""
-    debug_log("开始生成输出文件...")
-    # 使用北京时间
-    timestamp = datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S")
-    
-    try:
-        # 生成重新分类的文件 - 按照CATEGORY_MAPPING的顺序排列
-        with open('reclassified_live_sources.txt', 'w', encoding='utf-8') as f:
-            f.write(f"# 直播源重新分类结果\n")
-            f.write(f"# 生成时间: {timestamp} (北京时间)\n")
-            f.write(f"# 数据来源: https://github.com/q1017673817/iptvz/blob/main/zubo_all.txt\n\n")
-            
-            # 按照CATEGORY_MAPPING的顺序输出分类
-            for category in CATEGORY_MAPPING.keys():
-                if category in categorized_channels and categorized_channels[category]:
-                    f.write(f"{category}\n")
-                    for channel in categorized_channels[category]:
-                        f.write(f"{channel}\n")
-                    f.write("\n")
-            
-            # 添加未分类的频道
-            if uncategorized_channels:
-                f.write('其他频道,#genre#\n')
-                for channel in uncategorized_channels:
-                    f.write(f"{channel}\n")
-        
-        debug_log("reclassified_live_sources.txt 生成成功")
-        
-        # 生成格式化的原始文件（不分类）- 确保没有双引号
-        with open('formatted_live_sources.txt', 'w', encoding='utf-8') as f:
-            f.write(f"# 格式化直播源（未分类）\n")
-            f.write(f"# 生成时间: {timestamp} (北京时间)\n")
-            f.write(f"# 数据来源: https://github.com/q1017673817/iptvz/blob/main/zubo_all.txt\n\n")
-            for channel_line in all_channels:
-                # 确保行中没有双引号
-                channel_line_clean = channel_line.replace('"', '')
-                f.write(f"{channel_line_clean}\n")
-        
-        debug_log("formatted_live_sources.txt 生成成功")
-        
-    except Exception as e:
-        debug_log(f"生成文件失败: {e}")
-        raise
+class ProbeResult:
+    """单个直播地址的探测结果"""
 
-def main():
-    """主函数"""
-    try:
-        debug_log("脚本开始执行")
-        
-        github_url = "https://github.com/q1017673817/iptvz/blob/main/zubo_all.txt"
-        
-        debug_log("正在获取原始数据...")
-        original_content = fetch_original_data(github_url)
-        if not original_content:
-            debug_log("无法获取数据，程序退出")
-            return 1
+    __slots__ = ('url', 'host', 'port', 'reachable', 'ttfb', 'status', 'error', 'throughput', 'from_cache',
+                 'container', 'codec', 'bandwidth', 'width', 'height')
+
+    def __init__(self, url, host=None, port=None, reachable=None, ttfb=None, status=None, error=None,
+                 throughput=None, from_cache=False, container=None, codec=None, bandwidth=None,
+                 width=None, height=None):
+        self.url = url
+        self.host = host
+        self.port = port
+        self.reachable = reachable  # True/False；None表示该协议无法探测
+        self.ttfb = ttfb            # 首字节时间（秒）
+        self.status = status        # HTTP/RTSP状态码
+        self.error = error
+        self.throughput = throughput  # 吞吐量采样（字节/秒），未采样为None
+        self.from_cache = from_cache
+        # 格式指纹：未识别时 container 为 'unknown'，没有做指纹识别为None
+        self.container = container  # mpegts / hls / flv / unknown
+        self.codec = codec          # 视频编码（TS取自PMT，HLS取自CODECS）
+        self.bandwidth = bandwidth  # HLS主播放列表中最高码率（比特/秒）
+        # 分辨率：HLS取自主播放列表的最高分辨率，TS取自预算内读到的H.264/H.265序列参数集或MPEG-2序列头，
+        # 没有读到时为None（HLS分片列表、FLV以及预算内没有关键帧的TS）
+        self.width = width
+        self.height = height
+
+    @property
+    def host_key(self):
+        return f"{self.host}:{self.port}"
+
+    @property
+    def resolution(self):
+        if self.width is None or self.height is None:
+            return None
+        return f"{self.width}x{self.height}"
+
+    @property
+    def is_uhd(self):
+        """是否为4K及以上；没有分辨率信息时为None"""
+        if self.width is None or self.height is None:
+            return None
+        return self.width >= 3840 or self.height >= 2160
+
+    def __repr__(self):
+        return f"ProbeResult({self.url!r}, reachable={self.reachable}, ttfb={self.ttfb}, status={self.status})"
+
+
+# 探测结果缓存文件
+PROBE_CACHE_FILE = 'probe_cache.json'
+
+# 默认端口（仅用于可以通过TCP探测的协议）；去重时规范化地址也按此省略默认端口
+PROBE_DEFAULT_PORTS = {'http': 80, 'https': 443, 'rtsp': 554, 'rtmp': 1935}
+
+# --drop-fake-4k 默认读取的字节数：足够放下HLS主播放列表
+FINGERPRINT_DEFAULT_BYTES = 16 * 1024
+
+TS_PACKET_SIZE = 188
+# PMT中的stream_type对应的视频编码
+TS_VIDEO_STREAM_TYPES = {0x01: 'mpeg1', 0x02: 'mpeg2', 0x10: 'mpeg4', 0x1b: 'h264', 0x24: 'hevc',
+                         0x42: 'avs', 0xd2: 'avs2', 0xd4: 'avs3'}
+HLS_ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+# 频道名称中声称是4K/8K的标记
+UHD_NAME_PATTERN = re.compile(r'4K|8K|UHD|超高清', re.IGNORECASE)
+
+def ts_sync_offset(data):
+    """返回MPEG-TS同步字节(0x47)以188字节间隔重复出现的起始位置，不是TS时返回None"""
+    for offset in range(min(TS_PACKET_SIZE, len(data))):
+        if data[offset] != 0x47:
+            continue
+        # 至少连续三个包（数据不足时检查已有的包）都以同步字节开头
+        checks = range(offset, min(len(data), offset + 3 * TS_PACKET_SIZE), TS_PACKET_SIZE)
+        if len(checks) >= 2 and all(data[position] == 0x47 for position in checks):
+            return offset
+    return None
+
+def ts_video_stream(data, offset=0):
+    """从TS数据的PAT/PMT中找出视频流，返回 (编码, PID)；预算内没有出现PAT/PMT时返回 (None, None)
+
+    只处理在单个TS包内完整的表，这是PAT/PMT的常见情况。
+    """
+    pmt_pids = set()
+    for position in range(offset, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        packet = data[position:position + TS_PACKET_SIZE]
+        if packet[0] != 0x47 or not packet[1] & 0x40:
+            continue
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        if pid != 0 and pid not in pmt_pids:
+            continue
+        start = 4
+        if packet[3] & 0x20:
+            start += 1 + packet[4]
+        if start >= TS_PACKET_SIZE:
+            continue
+        section = packet[start + 1 + packet[start]:]
+        if len(section) < 12:
+            continue
+        end = min(len(section), 3 + (((section[1] & 0x0f) << 8) | section[2]) - 4)
+        if pid == 0 and section[0] == 0x00:
+            for entry in range(8, end - 3, 4):
+                if section[entry] or section[entry + 1]:
+                    pmt_pids.add(((section[entry + 2] & 0x1f) << 8) | section[entry + 3])
+        elif section[0] == 0x02:
+            entry = 12 + (((section[10] & 0x0f) << 8) | section[11])
+            while entry + 5 <= end:
+                codec = TS_VIDEO_STREAM_TYPES.get(section[entry])
+                if codec is not None:
+                    return codec, ((section[entry + 1] & 0x1f) << 8) | section[entry + 2]
+                entry += 5 + (((section[entry + 3] & 0x0f) << 8) | section[entry + 4])
+    return None, None
+
+def ts_pes_payload(data, offset, pid):
+    """拼接TS数据中某个PID的负载，去掉PES包头，得到视频基本流"""
+    payload = bytearray()
+    for position in range(offset, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        packet = data[position:position + TS_PACKET_SIZE]
+        if packet[0] != 0x47 or (((packet[1] & 0x1f) << 8) | packet[2]) != pid or not packet[3] & 0x10:
+            continue
+        start = 4
+        if packet[3] & 0x20:
+            start += 1 + packet[4]
+        # 包开头是PES包头：00 00 01 流ID 长度(2) 标志(2) 包头数据长度
+        if packet[1] & 0x40 and packet[start:start + 3] == b'\x00\x00\x01' and start + 9 <= TS_PACKET_SIZE:
+            start += 9 + packet[start + 8]
+        payload += packet[start:]
+    return bytes(payload)
+
+class _BitReader:
+    """按位读取视频参数集，数据不足时抛出IndexError"""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def u(self, bits):
+        value = 0
+        for _ in range(bits):
+            byte = self.data[self.position >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.position & 7))) & 1)
+            self.position += 1
+        return value
+
+    def ue(self):
+        """无符号指数哥伦布码"""
+        zeros = 0
+        while self.u(1) == 0:
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("指数哥伦布码过长")
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+def _rbsp(nal):
+    """去掉防竞争字节 00 00 03 中的 03"""
+    return nal.replace(b'\x00\x00\x03', b'\x00\x00')
+
+# H.264中带有色度格式等扩展字段的profile
+H264_HIGH_PROFILES = {100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135}
+
+def _crop_units(chroma_format, frame_mbs_only=1):
+    """裁剪偏移的单位 (水平, 垂直)：4:2:0 为 2x2，4:2:2 为 2x1，单色和4:4:4 为 1x1"""
+    unit_x = 2 if chroma_format in (1, 2) else 1
+    unit_y = 2 if chroma_format == 1 else 1
+    return unit_x, unit_y * (2 - frame_mbs_only)
+
+def h264_sps_resolution(rbsp):
+    """从H.264序列参数集（不含NAL头）算出显示分辨率 (宽, 高)"""
+    bits = _BitReader(rbsp)
+    profile = bits.u(8)
+    bits.u(16)  # constraint_set标志和level_idc
+    bits.ue()   # seq_parameter_set_id
+    chroma_format = 1
+    if profile in H264_HIGH_PROFILES:
+        chroma_format = bits.ue()
+        if chroma_format == 3 and bits.u(1):
+            chroma_format = 0  # 分离色彩平面按单色计算裁剪单位
+        bits.ue()
+        bits.ue()
+        bits.u(1)
+        if bits.u(1):
+            # 缩放矩阵：只需跳过
+            for i in range(8 if chroma_format != 3 else 12):
+                if not bits.u(1):
+                    continue
+                last = following = 8
+                for _ in range(16 if i < 6 else 64):
+                    if following:
+                        following = (last + bits.se() + 256) % 256
+                    last = following or last
+    bits.ue()  # log2_max_frame_num_minus4
+    poc_type = bits.ue()
+    if poc_type == 0:
+        bits.ue()
+    elif poc_type == 1:
+        bits.u(1)
+        bits.se()
+        bits.se()
+        for _ in range(bits.ue()):
+            bits.se()
+    bits.ue()  # max_num_ref_frames
+    bits.u(1)
+    width_mbs = bits.ue() + 1
+    height_units = bits.ue() + 1
+    frame_mbs_only = bits.u(1)
+    if not frame_mbs_only:
+        bits.u(1)
+    bits.u(1)
+    width = width_mbs * 16
+    height = height_units * 16 * (2 - frame_mbs_only)
+    if bits.u(1):
+        unit_x, unit_y = _crop_units(chroma_format, frame_mbs_only)
+        left, right, top, bottom = bits.ue(), bits.ue(), bits.ue(), bits.ue()
+        width -= (left + right) * unit_x
+        height -= (top + bottom) * unit_y
+    return width, height
+
+def hevc_sps_resolution(rbsp):
+    """从H.265序列参数集（不含2字节NAL头）算出显示分辨率 (宽, 高)"""
+    bits = _BitReader(rbsp)
+    bits.u(4)  # sps_video_parameter_set_id
+    sub_layers = bits.u(3)
+    bits.u(1)
+    # profile_tier_level：通用部分96位，之后是各子层的标志和参数
+    bits.u(32)
+    bits.u(32)
+    bits.u(32)
+    flags = [(bits.u(1), bits.u(1)) for _ in range(sub_layers)]
+    if sub_layers:
+        bits.u(2 * (8 - sub_layers))
+    for profile_present, level_present in flags:
+        if profile_present:
+            bits.u(32)
+            bits.u(32)
+            bits.u(24)
+        if level_present:
+            bits.u(8)
+    bits.ue()  # sps_seq_parameter_set_id
+    chroma_format = bits.ue()
+    if chroma_format == 3 and bits.u(1):
+        chroma_format = 0
+    width = bits.ue()
+    height = bits.ue()
+    if bits.u(1):
+        unit_x, unit_y = _crop_units(chroma_format)
+        left, right, top, bottom = bits.ue(), bits.ue(), bits.ue(), bits.ue()
+        width -= (left + right) * unit_x
+        height -= (top + bottom) * unit_y
+    return width, height
+
+def video_resolution(stream, codec):
+    """在视频基本流中找序列参数集（H.264/H.265）或序列头（MPEG-2），返回 (宽, 高)，找不到时返回None"""
+    position = stream.find(b'\x00\x00\x01')
+    while position >= 0 and position + 3 < len(stream):
+        start = position + 3
+        position = stream.find(b'\x00\x00\x01', start)
+        nal = stream[start:position] if position >= 0 else stream[start:]
+        try:
+            if codec == 'h264' and nal[0] & 0x1f == 7:
+                return h264_sps_resolution(_rbsp(nal[1:]))
+            if codec == 'hevc' and (nal[0] >> 1) & 0x3f == 33:
+                return hevc_sps_resolution(_rbsp(nal[2:]))
+            if codec in ('mpeg1', 'mpeg2') and nal[0] == 0xb3 and len(nal) >= 4:
+                return (nal[1] << 4) | (nal[2] >> 4), ((nal[2] & 0x0f) << 8) | nal[3]
+        except (IndexError, ValueError):
+            # 参数集被预算截断或内容异常
+            return None
+    return None
+
+def parse_hls_master(text):
+    """解析HLS主播放列表中的 #EXT-X-STREAM-INF，返回码率最高的变体 (带宽, 宽, 高, 编码)
+
+    不是主播放列表（例如直接是分片列表）时返回None。
+    """
+    best = None
+    for line in text.splitlines():
+        if not line.startswith('#EXT-X-STREAM-INF:'):
+            continue
+        attributes = {key: value.strip('"') for key, value in HLS_ATTRIBUTE_PATTERN.findall(line[18:])}
+        bandwidth = int(attributes['BANDWIDTH']) if attributes.get('BANDWIDTH', '').isdigit() else None
+        width = height = None
+        resolution = attributes.get('RESOLUTION', '').lower().split('x')
+        if len(resolution) == 2 and all(part.isdigit() for part in resolution):
+            width, height = int(resolution[0]), int(resolution[1])
+        codec = None
+        for item in attributes.get('CODECS', '').split(','):
+            item = item.strip().lower()
+            if item.startswith(('avc1', 'avc3')):
+                codec = 'h264'
+            elif item.startswith(('hvc1', 'hev1')):
+                codec = 'hevc'
+        variant = (bandwidth, width, height, codec)
+        if best is None or ((height or 0), (bandwidth or 0)) > ((best[2] or 0), (best[0] or 0)):
+            best = variant
+    return best
+
+def dechunk(data):
+    """解开HTTP分块传输编码；数据被预算截断时返回已读到的部分（包括不完整的最后一块）"""
+    body = bytearray()
+    position = 0
+    while True:
+        line_end = data.find(b'\r\n', position)
+        if line_end < 0:
+            break
+        try:
+            size = int(data[position:line_end].split(b';', 1)[0], 16)
+        except ValueError:
+            break
+        if size == 0:
+            break
+        chunk = data[line_end + 2:line_end + 2 + size]
+        body += chunk
+        if len(chunk) < size:
+            break
+        position = line_end + 2 + size + 2
+    return bytes(body)
+
+def fingerprint_stream(head, content_type=''):
+    """根据流开头的字节识别格式，返回 {'container', 'codec', 'bandwidth', 'width', 'height'}"""
+    info = {'container': 'unknown', 'codec': None, 'bandwidth': None, 'width': None, 'height': None}
+    text_head = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+    content_type = (content_type or '').lower()
+    if text_head.startswith(b'#EXTM3U') or 'mpegurl' in content_type:
+        info['container'] = 'hls'
+        variant = parse_hls_master(text_head.decode('utf-8', 'replace'))
+        if variant is not None:
+            info['bandwidth'], info['width'], info['height'], info['codec'] = variant
+        return info
+    if head.startswith(b'FLV'):
+        info['container'] = 'flv'
+        return info
+    offset = ts_sync_offset(head)
+    if offset is not None or 'mp2t' in content_type:
+        info['container'] = 'mpegts'
+        info['codec'], pid = ts_video_stream(head, offset or 0)
+        # 分辨率只在序列参数集中，中继一般从任意位置开始转发，参数集要等到下一个关键帧才出现，
+        # 预算内没有读到时分辨率未知；AVS等其他编码也不解析分辨率
+        if pid is not None:
+            resolution = video_resolution(ts_pes_payload(head, offset or 0, pid), info['codec'])
+            if resolution is not None:
+                info['width'], info['height'] = resolution
+    return info
+
+class StreamProber:
+    """基于asyncio的并发直播地址存活探测
+
+    HTTP/HTTPS发送GET请求，RTSP发送OPTIONS请求，读取到第一个字节即视为
+    有响应并记录首字节时间；RTMP只检查TCP连接。udp/rtp等组播地址无法
+    从这里探测，结果的reachable为None。总并发和每个主机的并发分别限制。
+    fingerprint_bytes大于0时，HTTP/HTTPS地址再读取最多这么多字节的正文识别格式。
+    """
+
+    def __init__(self, concurrency=200, per_host=4, connect_timeout=3.0, first_byte_timeout=5.0,
+                 sample_bytes=0, sample_seconds=1.0, fingerprint_bytes=0):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        # 吞吐量采样：收到响应后最多再读取sample_bytes字节或sample_seconds秒，0表示不采样
+        self.sample_bytes = sample_bytes
+        self.sample_seconds = sample_seconds
+        # 格式指纹：每个地址最多读取的正文字节数，0表示不识别
+        self.fingerprint_bytes = fingerprint_bytes
+
+    def run(self, urls, cache=None):
+        """探测一组地址，返回 {url: ProbeResult}"""
+        return asyncio.run(self.probe_all(urls, cache=cache))
+
+    async def probe_all(self, urls, cache=None):
+        """探测一组地址；传入ProbeCache时先确认中继主机是否存活，
+        已知不可用的主机上的地址不再逐个探测，未过期的地址结果直接复用"""
+        unique_urls = list(dict.fromkeys(urls))
+        self._global_limit = asyncio.Semaphore(self.concurrency)
+        self._host_limits = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        if cache is None:
+            results = await asyncio.gather(*(self.probe_url(url) for url in unique_urls))
+            return dict(zip(unique_urls, results))
+
+        targets = {url: self._parse_target(url) for url in unique_urls}
+        hosts = {}
+        for target in targets.values():
+            if isinstance(target, tuple):
+                hosts.setdefault(target[2].host_key, target[2])
+        host_alive = {}
+        unknown_hosts = []
+        for host_key, template in hosts.items():
+            alive = cache.get_host(host_key)
+            if alive is None:
+                unknown_hosts.append(template)
+            else:
+                host_alive[host_key] = alive
+        checked = await asyncio.gather(*(self.check_host(template.host, template.port) for template in unknown_hosts))
+        checked_hosts = set()
+        for template, alive in zip(unknown_hosts, checked):
+            host_alive[template.host_key] = alive
+            checked_hosts.add(template.host_key)
+            cache.put_host(template.host_key, alive)
+
+        results = {}
+        pending = []
+        for url, target in targets.items():
+            if not isinstance(target, tuple):
+                results[url] = target
+                continue
+            template = target[2]
+            if not host_alive[template.host_key]:
+                # 主机状态来自缓存时，这个地址本次并没有被探测，标记为缓存结果，不计入可靠性历史
+                results[url] = ProbeResult(url, host=template.host, port=template.port,
+                                           reachable=False, error="主机不可用",
+                                           from_cache=template.host_key not in checked_hosts)
+                continue
+            cached = cache.get_url(url)
+            # 缓存的结果没有做过指纹识别时重新探测
+            if cached is not None and self.fingerprint_bytes > 0 and cached.reachable and cached.container is None:
+                cached = None
+            if cached is not None:
+                results[url] = cached
+            else:
+                pending.append(url)
+        probed = await asyncio.gather(*(self._probe_target(*targets[url]) for url in pending))
+        for url, result in zip(pending, probed):
+            cache.put_url(result)
+            results[url] = result
+        return {url: results[url] for url in unique_urls}
+
+    def _parse_target(self, url):
+        """解析地址，可探测时返回 (parts, scheme, ProbeResult)，否则直接返回ProbeResult"""
+        try:
+            parts = urlsplit(url)
+            scheme = parts.scheme.lower()
+            host = parts.hostname
+            port = parts.port or PROBE_DEFAULT_PORTS.get(scheme)
+        except ValueError as e:
+            return ProbeResult(url, error=f"地址无效: {e}")
+        if scheme not in PROBE_DEFAULT_PORTS or not host:
+            return ProbeResult(url, host=host, port=port)
+        return parts, scheme, ProbeResult(url, host=host, port=port)
+
+    async def probe_url(self, url):
+        """探测单个地址"""
+        target = self._parse_target(url)
+        if not isinstance(target, tuple):
+            return target
+        return await self._probe_target(*target)
+
+    async def _probe_target(self, parts, scheme, result):
+        # 先占用主机名额再占用全局名额，避免排队等待同一主机的任务占满全局并发
+        async with self._host_limits[result.host_key], self._global_limit:
+            await self._probe(parts, scheme, result)
+        return result
+
+    async def check_host(self, host, port):
+        """检查中继主机的端口能否建立TCP连接"""
+        async with self._host_limits[f"{host}:{port}"], self._global_limit:
+            writer = None
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(host, port),
+                                                   timeout=self.connect_timeout)
+                return True
+            except (asyncio.TimeoutError, OSError):
+                return False
+            finally:
+                if writer is not None:
+                    writer.close()
+                    try:
+                        await writer.wait_closed()
+                    except OSError:
+                        pass
+
+    async def _probe(self, parts, scheme, result):
+        started = time.monotonic()
+        writer = None
+        try:
+            ssl_context = None
+            if scheme == 'https':
+                # 只判断是否有响应，不校验证书
+                ssl_context = ssl.create_default_context()
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(result.host, result.port, ssl=ssl_context),
+                timeout=self.connect_timeout)
+            if scheme == 'rtmp':
+                result.ttfb = time.monotonic() - started
+                result.reachable = True
+                return
+
+            writer.write(self._build_request(parts, scheme, result))
+            await writer.drain()
+            first = await asyncio.wait_for(reader.read(1), timeout=self.first_byte_timeout)
+            if not first:
+                result.reachable = False
+                result.error = "连接被关闭"
+                return
+            result.ttfb = time.monotonic() - started
+            status_line = first + await asyncio.wait_for(reader.readline(), timeout=self.first_byte_timeout)
+            result.status = self._parse_status(status_line)
+            result.reachable = result.status is None or result.status < 400
+            if not result.reachable:
+                result.error = f"状态码 {result.status}"
+                return
+            if scheme == 'rtsp':
+                return
+            if self.fingerprint_bytes > 0:
+                await self._fingerprint(reader, result)
+            if self.sample_bytes > 0:
+                result.throughput = await self._sample_throughput(reader)
+        except asyncio.TimeoutError:
+            result.reachable = False
+            result.error = "超时"
+        except (OSError, asyncio.IncompleteReadError) as e:
+            result.reachable = False
+            result.error = str(e) or e.__class__.__name__
+        finally:
+            if writer is not None:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (OSError, ssl.SSLError):
+                    pass
+
+    async def _fingerprint(self, reader, result):
+        """读取响应头和最多fingerprint_bytes字节的正文，识别流格式；超时时按已读到的数据识别"""
+        deadline = time.monotonic() + self.first_byte_timeout
+        headers = {}
+        head = b''
+        try:
+            for _ in range(100):
+                line = await asyncio.wait_for(reader.readline(), timeout=max(0.0, deadline - time.monotonic()))
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            while len(head) < self.fingerprint_bytes:
+                chunk = await asyncio.wait_for(reader.read(self.fingerprint_bytes - len(head)),
+                                               timeout=max(0.0, deadline - time.monotonic()))
+                if not chunk:
+                    break
+                head += chunk
+        except asyncio.TimeoutError:
+            pass
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            head = dechunk(head)
+        info = fingerprint_stream(head, headers.get('content-type'))
+        for key, value in info.items():
+            setattr(result, key, value)
+
+    async def _sample_throughput(self, reader):
+        """在限定的字节数和时长内读取数据，返回字节/秒"""
+        started = time.monotonic()
+        received = 0
+        while received < self.sample_bytes:
+            remaining = self.sample_seconds - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(reader.read(min(65536, self.sample_bytes - received)),
+                                               timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            received += len(chunk)
+        elapsed = time.monotonic() - started
+        return received / elapsed if elapsed > 0 else None
+
+    def _build_request(self, parts, scheme, result):
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        host_header = result.host if ':' not in result.host else f"[{result.host}]"
+        if parts.port:
+            host_header += f":{parts.port}"
+        if scheme == 'rtsp':
+            return (f"OPTIONS {parts.geturl()} RTSP/1.0\r\nCSeq: 1\r\n"
+                    f"User-Agent: {REQUEST_HEADERS['User-Agent']}\r\n\r\n").encode('utf-8')
+        return (f"GET {path} HTTP/1.1\r\nHost: {host_header}\r\n"
+                f"User-Agent: {REQUEST_HEADERS['User-Agent']}\r\n"
+                f"Accept: */*\r\nConnection: close\r\n\r\n").encode('utf-8')
+
+    @staticmethod
+    def _parse_status(status_line):
+        """解析 HTTP/1.1 200 OK、RTSP/1.0 200 OK、ICY 200 OK 等状态行"""
+        parts = status_line.split(None, 2)
+        if len(parts) >= 2 and parts[1].isdigit():
+            return int(parts[1])
+        return None
+
+class ProbeCache:
+    """持久化的探测结果缓存
+
+    分别按 host:port 和完整地址保存探测结果，带TTL过期和LRU淘汰。
+    主机的TTL较短（每次连接检查很便宜），地址的TTL较长，这样每天两次
+    运行时只需重新探测过期的地址。
+    """
+
+    def __init__(self, path=PROBE_CACHE_FILE, url_ttl=24 * 3600, host_ttl=6 * 3600,
+                 max_urls=200000, max_hosts=20000, clock=time.time):
+        self.path = path
+        self.url_ttl = url_ttl
+        self.host_ttl = host_ttl
+        self.max_urls = max_urls
+        self.max_hosts = max_hosts
+        self.clock = clock
+        self.urls = OrderedDict()
+        self.hosts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # 文件中按最近使用从旧到新排列
+            self.urls.update((entry['url'], entry) for entry in data.get('urls', []))
+            self.hosts.update((entry['host'], entry) for entry in data.get('hosts', []))
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            debug_log(f"探测缓存 {path} 无效，忽略: {e}")
+
+    def get_host(self, host_key):
+        """返回未过期的主机存活状态，没有则返回None"""
+        entry = self.hosts.get(host_key)
+        if entry is None or self.clock() - entry['checked_at'] > self.host_ttl:
+            return None
+        self.hosts.move_to_end(host_key)
+        return entry['alive']
+
+    def put_host(self, host_key, alive):
+        self.hosts[host_key] = {'host': host_key, 'alive': alive, 'checked_at': self.clock()}
+        self.hosts.move_to_end(host_key)
+
+    def get_url(self, url):
+        """返回未过期的地址探测结果，没有则返回None"""
+        entry = self.urls.get(url)
+        if entry is None or self.clock() - entry['checked_at'] > self.url_ttl:
+            self.misses += 1
+            return None
+        self.urls.move_to_end(url)
+        self.hits += 1
+        return ProbeResult(url, host=entry.get('host'), port=entry.get('port'), reachable=entry.get('reachable'),
+                           ttfb=entry.get('ttfb'), status=entry.get('status'), error=entry.get('error'),
+                           throughput=entry.get('throughput'), from_cache=True, container=entry.get('container'),
+                           codec=entry.get('codec'), bandwidth=entry.get('bandwidth'), width=entry.get('width'),
+                           height=entry.get('height'))
+
+    def put_url(self, result):
+        self.urls[result.url] = {
+            'url': result.url, 'host': result.host, 'port': result.port, 'reachable': result.reachable,
+            'ttfb': result.ttfb, 'status': result.status, 'error': result.error,
+            'throughput': result.throughput, 'container': result.container, 'codec': result.codec,
+            'bandwidth': result.bandwidth, 'width': result.width, 'height': result.height,
+            'checked_at': self.clock(),
+        }
+        self.urls.move_to_end(result.url)
+
+    def _evict(self):
+        """删除过期条目，再按LRU淘汰超出容量的条目"""
+        now = self.clock()
+        for entries, ttl, limit in ((self.urls, self.url_ttl, self.max_urls),
+                                    (self.hosts, self.host_ttl, self.max_hosts)):
+            for key in [key for key, entry in entries.items() if now - entry['checked_at'] > ttl]:
+                del entries[key]
+            while len(entries) > limit:
+                entries.popitem(last=False)
+
+    def save(self):
+        self._evict()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'hosts': list(self.hosts.values()), 'urls': list(self.urls.values())},
+                      f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+def probe_channel_urls(urls, cache=None, **options):
+    """探测一组直播地址并记录统计信息"""
+    prober = StreamProber(**options)
+    started = time.monotonic()
+    results = prober.run(urls, cache=cache)
+    reachable = sum(1 for result in results.values() if result.reachable)
+    dead = sum(1 for result in results.values() if result.reachable is False)
+    debug_log(f"探测完成: {len(results)} 个地址，可用 {reachable}，失效 {dead}，"
+              f"无法探测 {len(results) - reachable - dead}，耗时 {time.monotonic() - started:.2f} 秒")
+    if cache is not None:
+        debug_log(f"探测缓存: 命中 {cache.hits}，重新探测 {cache.misses}")
+    containers = Counter(result.container for result in results.values() if result.container is not None)
+    if containers:
+        debug_log("格式识别: " + "，".join(f"{container} {count}" for container, count in containers.most_common()))
+        for container, count in containers.items():
+            get_metrics().count(f'container:{container}', count)
+    return results
+
+def is_fake_uhd(channel_name, result):
+    """名称标注为4K/8K，但格式指纹显示分辨率低于4K；分辨率未知的地址不算"""
+    return (result is not None and result.is_uhd is False
+            and UHD_NAME_PATTERN.search(channel_name) is not None)
+
+def url_host_key(url):
+    """地址所在的 主机:端口（省略端口时使用协议默认端口），无法解析时返回空字符串"""
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname
+        port = parts.port or PROBE_DEFAULT_PORTS.get(parts.scheme.lower())
+    except ValueError:
+        return ''
+    return f"{host}:{port}" if host else ''
+
+class Reliability(namedtuple('Reliability', ('runs_seen', 'probes', 'successes', 'ttfb_p50', 'ttfb_p95'))):
+    """一个地址或中继主机在保留期内的历史统计"""
+
+    __slots__ = ()
+
+    @property
+    def uptime(self):
+        """探测成功率（0~1），从未探测过为None"""
+        return self.successes / self.probes if self.probes else None
+
+class ReliabilitySnapshot:
+    """运行开始时从历史库读出的统计，供排序和过滤使用
+
+    地址本身没有探测记录时退回到所在中继主机的统计。
+    """
+
+    def __init__(self, urls=None, hosts=None):
+        self.urls = urls or {}
+        self.hosts = hosts or {}
+
+    def url_uptime(self, url, min_probes=1):
+        """地址自身的成功率，探测次数不足min_probes时为None"""
+        stats = self.urls.get(url)
+        if stats is None or stats.probes < min_probes:
+            return None
+        return stats.uptime
+
+    def uptime(self, url):
+        uptime = self.url_uptime(url)
+        if uptime is None:
+            stats = self.hosts.get(url_host_key(url))
+            uptime = stats.uptime if stats is not None else None
+        return uptime
+
+# 可靠性历史库的表结构；observations 用 (地址, 运行) 作主键并且不带rowid，每行只有几十字节
+RELIABILITY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs(started_at);
+CREATE TABLE IF NOT EXISTS hosts (
+    id INTEGER PRIMARY KEY,
+    host TEXT NOT NULL UNIQUE,
+    first_seen REAL,
+    last_seen REAL,
+    runs_seen INTEGER NOT NULL DEFAULT 0,
+    probes INTEGER NOT NULL DEFAULT 0,
+    successes INTEGER NOT NULL DEFAULT 0,
+    ttfb_p50 REAL,
+    ttfb_p95 REAL
+);
+CREATE TABLE IF NOT EXISTS urls (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    host_id INTEGER NOT NULL REFERENCES hosts(id),
+    first_seen REAL,
+    last_seen REAL,
+    runs_seen INTEGER NOT NULL DEFAULT 0,
+    probes INTEGER NOT NULL DEFAULT 0,
+    successes INTEGER NOT NULL DEFAULT 0,
+    ttfb_p50 REAL,
+    ttfb_p95 REAL
+);
+CREATE INDEX IF NOT EXISTS urls_host_id ON urls(host_id);
+CREATE TABLE IF NOT EXISTS observations (
+    url_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    reachable INTEGER,
+    ttfb REAL,
+    PRIMARY KEY (url_id, run_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS observations_run_id ON observations(run_id);
+"""
+
+# 对本次运行中出现的地址或主机，汇总保留期内的出现次数、探测成功率和首字节时间的p50/p95（最近秩法）
+RELIABILITY_AGGREGATE_SQL = """
+WITH scoped AS (
+    SELECT {key} AS key, o.run_id, o.reachable, o.ttfb
+    FROM observations o JOIN urls u ON u.id = o.url_id
+    WHERE {key} IN (SELECT {key} FROM observations o JOIN urls u ON u.id = o.url_id WHERE o.run_id = :run_id)
+),
+ranked AS (
+    SELECT key, ttfb,
+           ROW_NUMBER() OVER (PARTITION BY key ORDER BY ttfb) AS position,
+           COUNT(*) OVER (PARTITION BY key) AS total
+    FROM scoped WHERE ttfb IS NOT NULL
+),
+percentiles AS (
+    SELECT key,
+           MIN(CASE WHEN position * 2 >= total THEN ttfb END) AS p50,
+           MIN(CASE WHEN position * 100 >= total * 95 THEN ttfb END) AS p95
+    FROM ranked GROUP BY key
+)
+SELECT s.key, MIN(r.started_at), MAX(r.started_at), COUNT(DISTINCT s.run_id), COUNT(s.reachable),
+       COALESCE(SUM(s.reachable = 1), 0), p.p50, p.p95
+FROM scoped s JOIN runs r ON r.id = s.run_id LEFT JOIN percentiles p ON p.key = s.key
+GROUP BY s.key
+"""
+
+class ReliabilityStore:
+    """地址和中继主机可靠性的本地历史库（SQLite）
+
+    每次运行记录上游中出现的每个地址（去重后）及其探测结果和首字节时间，
+    并为本次出现的地址和主机重新汇总保留期内的统计（出现次数、成功率、p50/p95）。
+    超过保留期的运行记录被删除，空闲页过多时整理数据库文件。
+    """
+
+    # 空闲页超过总页数的这个比例时执行VACUUM
+    VACUUM_FREE_RATIO = 0.25
+
+    def __init__(self, path, retention_days=30, clock=time.time):
+        self.path = path
+        self.retention = retention_days * 24 * 3600
+        self.clock = clock
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(RELIABILITY_SCHEMA)
+        self._observations = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def snapshot(self):
+        """读出全部地址和主机的统计"""
+        columns = 'runs_seen, probes, successes, ttfb_p50, ttfb_p95'
+        urls = {row[0]: Reliability(*row[1:])
+                for row in self.connection.execute(f'SELECT url, {columns} FROM urls')}
+        hosts = {row[0]: Reliability(*row[1:])
+                 for row in self.connection.execute(f'SELECT host, {columns} FROM hosts')}
+        return ReliabilitySnapshot(urls, hosts)
+
+    def observe(self, url, probe_result=None):
+        """记录本次运行中出现的地址；复用缓存的探测结果不算作本次的探测"""
+        reachable = ttfb = None
+        if probe_result is not None and not probe_result.from_cache and probe_result.reachable is not None:
+            reachable = int(probe_result.reachable)
+            ttfb = probe_result.ttfb
+        self._observations[url] = (reachable, ttfb)
+
+    def commit_run(self):
+        """写入本次运行的观测、更新统计并清理过期记录，返回本次记录的地址数"""
+        now = self.clock()
+        observations = self._observations
+        self._observations = {}
+        with self.connection:
+            run_id = self.connection.execute('INSERT INTO runs (started_at) VALUES (?)', (now,)).lastrowid
+            hosts = {url: url_host_key(url) for url in observations}
+            self.connection.executemany('INSERT OR IGNORE INTO hosts (host) VALUES (?)',
+                                        ((host,) for host in set(hosts.values())))
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO urls (url, host_id) SELECT ?, id FROM hosts WHERE host = ?',
+                hosts.items())
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO observations (url_id, run_id, reachable, ttfb) '
+                'SELECT id, ?, ?, ? FROM urls WHERE url = ?',
+                ((run_id, reachable, ttfb, url) for url, (reachable, ttfb) in observations.items()))
+            self._expire(now - self.retention, run_id)
+            self._refresh('urls', 'o.url_id', run_id)
+            self._refresh('hosts', 'u.host_id', run_id)
+        self._compact()
+        return len(observations)
+
+    def _refresh(self, table, key, run_id):
+        """重新汇总本次运行中出现的地址（或主机）的统计"""
+        rows = self.connection.execute(RELIABILITY_AGGREGATE_SQL.format(key=key), {'run_id': run_id}).fetchall()
+        self.connection.executemany(
+            f'UPDATE {table} SET first_seen = ?, last_seen = ?, runs_seen = ?, probes = ?, successes = ?, '
+            f'ttfb_p50 = ?, ttfb_p95 = ? WHERE id = ?',
+            (row[1:] + (row[0],) for row in rows))
+
+    def _expire(self, cutoff, run_id):
+        """删除保留期以前的运行、观测，以及之后再没出现过的地址和主机
+
+        在重新汇总之前执行，统计中不含过期的运行；本次运行出现的地址的 last_seen 还没更新，
+        按本次的观测排除在外，地址仍在使用的主机同样保留。
+        """
+        expired = 'SELECT id FROM runs WHERE started_at < ?'
+        self.connection.execute(f'DELETE FROM observations WHERE run_id IN ({expired})', (cutoff,))
+        self.connection.execute('DELETE FROM runs WHERE started_at < ?', (cutoff,))
+        self.connection.execute('DELETE FROM urls WHERE last_seen < ? '
+                                'AND id NOT IN (SELECT url_id FROM observations WHERE run_id = ?)',
+                                (cutoff, run_id))
+        self.connection.execute('DELETE FROM hosts WHERE last_seen < ? AND id NOT IN (SELECT host_id FROM urls)',
+                                (cutoff,))
+
+    def _compact(self):
+        page_count = self.connection.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = self.connection.execute('PRAGMA freelist_count').fetchone()[0]
+        if page_count and free_pages > page_count * self.VACUUM_FREE_RATIO:
+            self.connection.execute('VACUUM')
+            debug_log(f"可靠性历史库已整理，释放 {free_pages} 页")
+
+# 组播转发地址中的组播目标，如 http://中继:端口/udp/239.77.1.19:5146
+MULTICAST_PATH_PATTERN = re.compile(r'/(?:udp|rtp)/@?([^/?#]+)', re.IGNORECASE)
+
+def canonicalize_url(url):
+    """规范化直播地址用于去重：协议和主机小写，省略默认端口和片段，统一组播目标写法"""
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        port = parts.port
+    except ValueError:
+        return url
+    if not scheme or not host:
+        return url
+    if ':' in host:
+        host = f"[{host}]"
+    if port is not None and port != PROBE_DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    path = parts.path
+    match = MULTICAST_PATH_PATTERN.search(path)
+    if match:
+        # /UDP/@239.1.1.1:5000/ 与 /udp/239.1.1.1:5000 是同一个地址
+        path = f"{path[:match.start()]}/{match.group(0)[1:4].lower()}/{match.group(1)}"
+    elif len(path) > 1:
+        path = path.rstrip('/')
+    if parts.query:
+        path += '?' + parts.query
+    return f"{scheme}://{host}{path}"
+
+def multicast_target(url):
+    """返回地址对应的组播组（ip:端口），不是组播地址时返回None"""
+    match = MULTICAST_PATH_PATTERN.search(url)
+    if match:
+        return match.group(1)
+    scheme, sep, rest = url.partition('://')
+    if sep and scheme.lower() in ('udp', 'rtp'):
+        return rest.lstrip('@').split('/', 1)[0] or None
+    return None
+
+class ChannelDeduplicator:
+    """按规范化地址去重的哈希索引，同一地址只保留第一次出现的频道"""
+
+    def __init__(self):
+        self._seen = set()
+        self.duplicate_count = 0
+
+    def is_duplicate(self, url):
+        key = canonicalize_url(url)
+        if key in self._seen:
+            self.duplicate_count += 1
+            return True
+        self._seen.add(key)
+        return False
+
+def iter_deduplicated(channels, deduplicator):
+    """过滤掉地址重复的 (频道, 上游源, 分类结果)"""
+    for item in channels:
+        if not deduplicator.is_duplicate(item[0].url):
+            yield item
+
+# 归并组播备用地址时每次读入内存的频道数上限；实际数据中最大的分类只有几千个地址，
+# 窗口覆盖整个分类，结果与整体归并相同
+ALTERNATE_GROUP_WINDOW = 50000
+
+def group_alternates(channels):
+    """把同一频道、同一组播组经不同中继转发的地址排在一起，作为该频道的备用地址
+
+    每组放在该组第一次出现的位置，返回 (新的 ChannelRecord 列表, 包含多个地址的组数)。
+    """
+    groups = {}
+    for position, channel in enumerate(channels):
+        target = multicast_target(channel.url)
+        key = (channel.name, target) if target else position
+        groups.setdefault(key, []).append(channel)
+    ordered = [channel for members in groups.values() for channel in members]
+    return ordered, sum(1 for members in groups.values() if len(members) > 1)
+
+REGION_OPERATORS = ('电信', '联通', '移动', '广电')
+
+def region_operator(region):
+    """地区运营商中的运营商，没有时返回空字符串"""
+    for operator in REGION_OPERATORS:
+        if operator in region:
+            return operator
+    return ''
+
+# 与已选地址重复时的惩罚：同一中继主机 > 同一地区运营商 > 同一运营商
+DIVERSITY_WEIGHTS = (4, 2, 1)
+
+def diversity_keys(channel):
+    """(中继主机, 地区运营商, 运营商)；地区运营商去掉末尾的编号，如 广东电信3 → 广东电信"""
+    region = channel.region.rstrip('0123456789')
+    return url_host_key(channel.url), region, region_operator(region)
+
+def select_diverse(channels, count, tier=None):
+    """从同一频道按优先级排好的地址中选出count个，尽量分散在不同的中继主机、地区和运营商上
+
+    tier(channel) 给出不可跨越的等级（如 可用 < 无法探测），小者优先。每次选出
+    (等级, 与已选地址重复的惩罚, 原顺序) 最小的地址；惩罚只会增加，所以用堆做惰性
+    更新：弹出的地址惩罚已经变化时带着新惩罚重新入堆，否则它就是当前最优。
+    """
+    if len(channels) <= count:
+        return list(channels)
+    keys = [diversity_keys(channel) for channel in channels]
+    used = tuple(Counter() for _ in DIVERSITY_WEIGHTS)
+    heap = [(tier(channel) if tier is not None else 0, 0, position) for position, channel in enumerate(channels)]
+    heapq.heapify(heap)
+    selected = []
+    while heap and len(selected) < count:
+        level, penalty, position = heapq.heappop(heap)
+        current = sum(weight * counter[key] for weight, counter, key in zip(DIVERSITY_WEIGHTS, used, keys[position])
+                      if key)
+        if current != penalty:
+            heapq.heappush(heap, (level, current, position))
+            continue
+        selected.append(channels[position])
+        for counter, key in zip(used, keys[position]):
+            counter[key] += 1
+    return selected
+
+class ChannelRanker:
+    """按健康度排序同一频道的多个地址，并可限制每个频道保留的地址数
+
+    排序依据依次为：可用 > 无法探测 > 失效，历史成功率越高越靠前（传入
+    ReliabilitySnapshot时；没有历史记录的地址排在有记录的之后），格式指纹识别出的
+    分辨率越高越靠前，首字节时间越短越靠前，吞吐量越高越靠前；条件相同时保持上游原有顺序。频道之间按分类
+    映射中的顺序排列，未在映射中的频道保持首次出现的顺序。
+    限制每个频道的地址数时，在同一健康等级内优先保留不同中继主机、地区和运营商的地址。
+    """
+
+    def __init__(self, probe_results=None, max_urls_per_channel=None, category_index=None, reliability=None):
+        self.probe_results = probe_results or {}
+        self.max_urls_per_channel = max_urls_per_channel
+        self.category_index = category_index or get_category_index()
+        self.reliability = reliability
+        self.dropped_count = 0
+
+    def url_key(self, url):
+        uptime = self.reliability.uptime(url) if self.reliability is not None else None
+        # 成功率取负值使高者靠前；没有记录时为1，排在所有有记录的地址之后
+        uptime = -uptime if uptime is not None else 1.0
+        result = self.probe_results.get(url)
+        if result is None or result.reachable is None:
+            return (1, uptime, 0, float('inf'), 0.0)
+        if not result.reachable:
+            return (2, uptime, 0, float('inf'), 0.0)
+        ttfb = result.ttfb if result.ttfb is not None else float('inf')
+        return (0, uptime, -(result.height or 0), ttfb, -(result.throughput or 0.0))
+
+    def health_tier(self, channel):
+        """可用 0，无法探测 1，失效 2"""
+        return self.url_key(channel.url)[0]
+
+    def order(self, channels):
+        """对一个分类中的 ChannelRecord 重新排序，返回新的列表"""
+        groups = {}
+        for channel in channels:
+            groups.setdefault(channel.name, []).append(channel)
+
+        ordered = []
+        for name in sorted(groups, key=self.category_index.sort_key):
+            entries = sorted(groups[name], key=lambda channel: self.url_key(channel.url))
+            if self.max_urls_per_channel is not None and len(entries) > self.max_urls_per_channel:
+                self.dropped_count += len(entries) - self.max_urls_per_channel
+                entries = select_diverse(entries, self.max_urls_per_channel, tier=self.health_tier)
+            ordered.extend(entries)
+        return ordered
+
+def read_output_blocks(path):
+    """读取输出文件，按 "分类,#genre#" 分段，返回 {分段标题: [行]}（不含注释和空行）"""
+    blocks = OrderedDict()
+    current = blocks.setdefault('', [])
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            if line.endswith(',#genre#'):
+                current = blocks.setdefault(line, [])
+            else:
+                current.append(line)
+    if not blocks['']:
+        del blocks['']
+    return blocks
+
+def block_hash(lines):
+    """分段内容哈希"""
+    return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+def diff_output_blocks(old_blocks, new_blocks):
+    """按分段哈希比较新旧输出，返回 [(分段标题, 新增行, 移除行)]，只包含有变化的分段"""
+    def surplus_lines(lines, surplus):
+        # 按原顺序取出多出来的行，重复行按出现次数计算
+        result = []
+        for line in lines:
+            if surplus[line] > 0:
+                surplus[line] -= 1
+                result.append(line)
+        return result
+
+    changes = []
+    for header in list(new_blocks) + [header for header in old_blocks if header not in new_blocks]:
+        old_lines = old_blocks.get(header, [])
+        new_lines = new_blocks.get(header, [])
+        if block_hash(old_lines) == block_hash(new_lines):
+            continue
+        old_counter = Counter(old_lines)
+        new_counter = Counter(new_lines)
+        added = surplus_lines(new_lines, new_counter - old_counter)
+        removed = surplus_lines(old_lines, old_counter - new_counter)
+        changes.append((header, added, removed))
+    return changes
+
+def read_without_timestamp(path):
+    """读取输出文件内容，去掉生成时间行，用于判断除时间戳外是否有变化"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return ''.join(line for line in f if not line.startswith('# 生成时间:'))
+
+# 未分类频道和失效频道的分段标题
+UNCATEGORIZED_HEADER = '其他频道,#genre#'
+DEAD_HEADER = '失效频道,#genre#'
+
+class PlaylistOutput:
+    """分类输出格式插件的基类
+
+    OutputWriter在提交时按分类顺序逐段调用 start_section / write_channel /
+    end_section，所有格式在同一遍中生成；close返回写好的正式文件路径，
+    内容先写在"路径.tmp"中，由OutputWriter统一替换。
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def _open_tmp(self, path):
+        self.writer._pending_outputs.append(path)
+        return open(path + '.tmp', 'w', encoding='utf-8')
+
+    def open(self):
+        pass
+
+    def start_section(self, header):
+        pass
+
+    def write_channel(self, header, channel):
+        """写出一个 ChannelRecord"""
+        raise NotImplementedError
+
+    def end_section(self, header):
+        pass
+
+    def close(self):
+        return []
+
+class ReclassifiedTextOutput(PlaylistOutput):
+    """重新分类的txt文件：分类,#genre# 分段，每行 频道名称,地址$地区运营商"""
+
+    def open(self):
+        self.path = self.writer.RECLASSIFIED_FILE
+        self.file = self._open_tmp(self.path)
+        self.file.write(f"# 直播源重新分类结果\n")
+        self.file.write(f"# 生成时间: {self.writer.timestamp} (北京时间)\n")
+        self.file.write(self.writer._source_header())
+        self.has_uncategorized = False
+
+    def start_section(self, header):
+        self.file.write(f"{header}\n")
+        if header == UNCATEGORIZED_HEADER:
+            self.has_uncategorized = True
+
+    def write_channel(self, header, channel):
+        self.file.write(f"{channel.line()}\n")
+
+    def end_section(self, header):
+        # 未分类频道是最后一段，后面不留空行
+        if header != UNCATEGORIZED_HEADER:
+            self.file.write("\n")
+
+    def close(self):
+        # 探测失效的频道只出现在txt文件末尾
+        dead_channels = self.writer.iter_dead_channels()
+        first = next(dead_channels, None)
+        if first is not None:
+            if self.has_uncategorized:
+                self.file.write("\n")
+            self.file.write(f"{DEAD_HEADER}\n{first.line()}\n")
+            for channel in dead_channels:
+                self.file.write(f"{channel.line()}\n")
+        self.file.close()
+        return [self.path]
+
+class LiteTextOutput(PlaylistOutput):
+    """精简版分类txt文件，供低端机顶盒快速加载
+
+    格式与重新分类的txt文件相同；每个频道最多保留per_channel个地址（按健康等级和
+    中继主机/地区/运营商分散选择），per_category不为None时每个分类最多保留这么多个地址，
+    按轮次分配：先给每个频道一个地址，再给第二个，依此类推。不包含失效频道段。
+    """
+
+    PATH = 'reclassified_live_sources_lite.txt'
+
+    def __init__(self, writer, per_channel=3, per_category=None):
+        super().__init__(writer)
+        self.per_channel = per_channel
+        self.per_category = per_category
+
+    def open(self):
+        self.file = self._open_tmp(self.PATH)
+        self.file.write(f"# 直播源重新分类结果（精简版）\n")
+        self.file.write(f"# 生成时间: {self.writer.timestamp} (北京时间)\n")
+        self.file.write(self.writer._source_header())
+        self.category_index = get_category_index()
+        self.section = None
+
+    def start_section(self, header):
+        self.section = {}
+
+    def write_channel(self, header, channel):
+        self.section.setdefault(channel.name, []).append(channel)
+
+    def end_section(self, header):
+        ranker = self.writer.ranker
+        tier = ranker.health_tier if ranker is not None else None
+        names = sorted(self.section, key=self.category_index.sort_key)
+        selected = [select_diverse(self.section[name], self.per_channel, tier=tier) for name in names]
+        if self.per_category is not None and sum(len(urls) for urls in selected) > self.per_category:
+            # (轮次, 频道位置) 最小的per_category个地址
+            kept = set(heapq.nsmallest(self.per_category, ((rank, position)
+                                                           for position, urls in enumerate(selected)
+                                                           for rank in range(len(urls)))))
+            selected = [[channel for rank, channel in enumerate(urls) if (rank, position) in kept]
+                        for position, urls in enumerate(selected)]
+        self.file.write(f"{header}\n")
+        for urls in selected:
+            for channel in urls:
+                self.file.write(f"{channel.line()}\n")
+        if header != UNCATEGORIZED_HEADER:
+            self.file.write("\n")
+        self.section = None
+
+    def close(self):
+        self.file.close()
+        return [self.PATH]
+
+class M3UOutput(PlaylistOutput):
+    """扩展M3U（M3U8）播放列表，带 tvg-name / group-title / 地区 / 来源上游源属性
+
+    split为True时额外为每个分类生成单独的播放列表，客户端可以只下载需要的分组。
+    """
+
+    PATH = 'reclassified_live_sources.m3u8'
+    SPLIT_DIR = 'playlists'
+
+    def __init__(self, writer, split=False):
+        super().__init__(writer)
+        self.split = split
+
+    def _write_header(self, f):
+        f.write("#EXTM3U\n")
+        f.write(f"# 生成时间: {self.writer.timestamp} (北京时间)\n")
+
+    def open(self):
+        self.file = self._open_tmp(self.PATH)
+        self._write_header(self.file)
+        self.paths = [self.PATH]
+        self.section_file = None
+        if self.split:
+            os.makedirs(self.SPLIT_DIR, exist_ok=True)
+
+    def start_section(self, header):
+        if self.split:
+            path = os.path.join(self.SPLIT_DIR, f"{safe_filename(header.split(',', 1)[0])}.m3u8")
+            self.section_file = self._open_tmp(path)
+            self._write_header(self.section_file)
+            self.paths.append(path)
+
+    def write_channel(self, header, channel):
+        name = channel.name
+        source = f' source="{channel.source}"' if channel.source else ''
+        entry = (f'#EXTINF:-1 tvg-name="{name}" group-title="{header.split(",", 1)[0]}" '
+                 f'region="{channel.region}"{source},{name}\n{channel.url}\n')
+        self.file.write(entry)
+        if self.section_file is not None:
+            self.section_file.write(entry)
+
+    def end_section(self, header):
+        if self.section_file is not None:
+            self.section_file.close()
+            self.section_file = None
+
+    def close(self):
+        self.file.close()
+        if self.split:
+            # 删除本次已不存在的分类留下的旧文件
+            current = {os.path.normpath(path) for path in self.paths}
+            for filename in os.listdir(self.SPLIT_DIR):
+                path = os.path.normpath(os.path.join(self.SPLIT_DIR, filename))
+                if filename.endswith('.m3u8') and path not in current:
+                    os.remove(path)
+        return self.paths
+
+class _StringTable:
+    """字符串驻留表：相同字符串只保存一次，用下标引用"""
+
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+
+    def intern(self, value):
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return string_id
+
+# 把地址拆成 协议://主机:端口 和其余部分，主机部分进入字符串表
+URL_HOST_PATTERN = re.compile(r'^([A-Za-z][A-Za-z0-9+.-]*://[^/?#]*)(.*)$', re.DOTALL)
+
+class JSONIndexOutput(PlaylistOutput):
+    """供客户端快速查询的紧凑索引（live_sources_index.json）
+
+    频道名、地区运营商、主机和分类都放在驻留字符串表中，其余数组只保存下标：
+    channels.url_offsets[i]:channels.url_offsets[i+1] 是第i个频道在urls数组中的
+    地址范围（已按输出顺序/健康度排好），categories 记录每个分类的频道范围，
+    urls.source 是每个地址来自的上游源（strings.sources 中的下标，来源未知为-1）。
+    一次 json.load 即可按频道名取出地址，不需要扫描整个播放列表。
+    """
+
+    PATH = 'live_sources_index.json'
+    VERSION = 1
+
+    def open(self):
+        self.names = _StringTable()
+        self.regions = _StringTable()
+        self.hosts = _StringTable()
+        self.category_names = _StringTable()
+        self.source_names = _StringTable()
+        self.categories = []
+        self.channel_names = []
+        self.channel_categories = []
+        self.url_offsets = [0]
+        self.url_hosts = []
+        self.url_paths = []
+        self.url_regions = []
+        self.url_sources = []
+        self._section_channels = None
+
+    def start_section(self, header):
+        self._section_channels = {}
+
+    def write_channel(self, header, channel):
+        url_match = URL_HOST_PATTERN.match(channel.url)
+        host, path = url_match.groups() if url_match else ('', channel.url)
+        # 同一频道的地址归到一起，保持在分段中出现的先后顺序
+        source_id = self.source_names.intern(channel.source) if channel.source else -1
+        self._section_channels.setdefault(channel.name, []).append(
+            (self.hosts.intern(host), path, self.regions.intern(channel.region), source_id))
+
+    def end_section(self, header):
+        category_id = self.category_names.intern(header.split(',', 1)[0])
+        self.categories.append([category_id, len(self.channel_names), len(self._section_channels)])
+        for name, urls in self._section_channels.items():
+            self.channel_names.append(self.names.intern(name))
+            self.channel_categories.append(category_id)
+            for host_id, path, region_id, source_id in urls:
+                self.url_hosts.append(host_id)
+                self.url_paths.append(path)
+                self.url_regions.append(region_id)
+                self.url_sources.append(source_id)
+            self.url_offsets.append(len(self.url_paths))
+        self._section_channels = None
+
+    def close(self):
+        index = {
+            'format': 'live-sources-index',
+            'version': self.VERSION,
+            'sources': [source.url for source in self.writer.sources],
+            'strings': {
+                'names': self.names.values,
+                'regions': self.regions.values,
+                'hosts': self.hosts.values,
+                'categories': self.category_names.values,
+                'sources': self.source_names.values,
+            },
+            'categories': self.categories,
+            'channels': {
+                'name': self.channel_names,
+                'category': self.channel_categories,
+                'url_offsets': self.url_offsets,
+            },
+            'urls': {
+                'host': self.url_hosts,
+                'path': self.url_paths,
+                'region': self.url_regions,
+                'source': self.url_sources,
+            },
+        }
+        with self._open_tmp(self.PATH) as f:
+            json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        return [self.PATH]
+
+class LiveSourcesIndex:
+    """读取 live_sources_index.json 并按频道名查询地址"""
+
+    def __init__(self, data):
+        if data.get('format') != 'live-sources-index' or data.get('version') != JSONIndexOutput.VERSION:
+            raise ValueError(f"不支持的索引格式: {data.get('format')} v{data.get('version')}")
+        self.data = data
+        self.strings = data['strings']
+        self.channels = data['channels']
+        self.urls = data['urls']
+        self._by_name = defaultdict(list)
+        for channel_id, name_id in enumerate(self.channels['name']):
+            self._by_name[self.strings['names'][name_id]].append(channel_id)
+
+    @classmethod
+    def load(cls, path=JSONIndexOutput.PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def channel_urls(self, channel_id):
+        """返回频道的 [(地址, 地区运营商)]，顺序即输出中的排序"""
+        offsets = self.channels['url_offsets']
+        hosts, paths, regions = self.strings['hosts'], self.urls['path'], self.strings['regions']
+        return [(hosts[self.urls['host'][i]] + paths[i], regions[self.urls['region'][i]])
+                for i in range(offsets[channel_id], offsets[channel_id + 1])]
+
+    def url_sources(self, channel_id):
+        """返回频道每个地址来自的上游源名称（与 channel_urls 顺序相同），来源未知为None"""
+        offsets = self.channels['url_offsets']
+        names = self.strings.get('sources', [])
+        sources = self.urls.get('source')
+        if sources is None:
+            return [None] * (offsets[channel_id + 1] - offsets[channel_id])
+        return [names[sources[i]] if sources[i] >= 0 else None
+                for i in range(offsets[channel_id], offsets[channel_id + 1])]
+
+    def lookup(self, channel_name):
+        """按频道名查询地址，频道不存在时返回空列表"""
+        result = []
+        for channel_id in self._by_name.get(channel_name, ()):
+            result.extend(self.channel_urls(channel_id))
+        return result
+
+    def category_of(self, channel_name):
+        channel_ids = self._by_name.get(channel_name)
+        if not channel_ids:
+            return None
+        return self.strings['categories'][self.channels['category'][channel_ids[0]]]
+
+# 可选的分类输出格式
+OUTPUT_FORMATS = {
+    'm3u': M3UOutput,
+    'index': JSONIndexOutput,
+    'lite': LiteTextOutput,
+}
+
+def write_output_manifest(paths, manifest_path=None):
+    """记录本次运行生成的输出文件；之前运行留下、本次没有生成的文件不在其中"""
+    manifest_path = manifest_path or OutputWriter.MANIFEST_FILE
+    files = sorted(path.replace(os.sep, '/') for path in paths)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'files': files}, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def read_output_manifest(manifest_path=None):
+    """读取本次运行生成的输出文件列表；没有清单（旧版本生成的输出）时只有两个主要文件"""
+    manifest_path = manifest_path or OutputWriter.MANIFEST_FILE
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            files = json.load(f)['files']
+        return [os.path.normpath(path) for path in files if isinstance(path, str)]
+    except (OSError, ValueError, KeyError, TypeError):
+        return [OutputWriter.RECLASSIFIED_FILE, OutputWriter.FORMATTED_FILE]
+
+def safe_filename(name):
+    """把分类名转换为安全的文件名"""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', name).strip('_') or 'unnamed'
+
+class OutputWriter:
+    """增量写出两个输出文件
+
+    格式化文件按到达顺序直接写入临时文件；分类文件需要按分类分组，
+    每个分类先写入各自的缓冲（超过spool_size后落盘），最后按分类顺序拼接。
+    全部完成后用临时文件原子替换正式文件，中途失败不会破坏已有输出。
+    增量模式下除生成时间外没有变化的文件保持不动，避免无意义的提交。
+    """
+
+    RECLASSIFIED_FILE = 'reclassified_live_sources.txt'
+    FORMATTED_FILE = 'formatted_live_sources.txt'
+    CHANGELOG_FILE = 'live_sources_changes.txt'
+    # 本次运行生成的输出文件列表，HTTP服务只提供其中的文件
+    MANIFEST_FILE = 'live_sources_manifest.json'
+
+    def __init__(self, sources=None, timestamp=None, spool_size=1024 * 1024, ranker=None,
+                 group_alternates=False, incremental=False, output_formats=(),
+                 alternate_window=ALTERNATE_GROUP_WINDOW):
+        if sources is None:
+            sources = UPSTREAM_SOURCES
+        if timestamp is None:
+            # 使用北京时间
+            timestamp = datetime.now(timezone(timedelta(hours=8))).strftime("%Y-%m-%d %H:%M:%S")
+        self.sources = list(sources)
+        self.timestamp = timestamp
+        self.spool_size = spool_size
+        self.ranker = ranker
+        self.group_alternates = group_alternates
+        self.alternate_window = alternate_window
+        self.alternate_groups = 0
+        # 增量模式：按分段哈希比较新旧输出，只有内容变化时才替换文件并写变更记录
+        self.incremental = incremental
+        self.changes = None
+        self.unchanged_files = []
+        # 额外的分类输出格式：[(输出类, 参数)]
+        self.output_formats = list(output_formats)
+        self._pending_outputs = []
+        self.channel_count = 0
+        self.categorized_count = 0
+        self.uncategorized_count = 0
+        # 每个上游源贡献的频道数
+        self.source_counts = defaultdict(int)
+        self._category_spools = {}
+        self._uncategorized_spool = None
+        self._dead_spool = None
+        self.dead_count = 0
+        self._closed = False
+        self._formatted = open(self.FORMATTED_FILE + '.tmp', 'w', encoding='utf-8')
+        self._formatted.write(f"# 格式化直播源（未分类）\n")
+        self._formatted.write(f"# 生成时间: {timestamp} (北京时间)\n")
+        self._formatted.write(self._source_header())
+
+    def _source_header(self):
+        """每个上游源一行数据来源说明"""
+        return ''.join(f"# 数据来源: {source.url}\n" for source in self.sources) + "\n"
+
+    def _new_spool(self):
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_size, mode='w+', encoding='utf-8', newline='')
+
+    @staticmethod
+    def _spool_channel(spool, channel, source=None):
+        # 字段来自按'\n'切分的行或已去掉控制字符的M3U/JSON字段，不会含有'\n'，每个字段占一行即可无歧义地读回
+        spool.write(f"{channel.name}\n{channel.url}\n{channel.region}\n{source.name if source is not None else channel.source or ''}\n")
+
+    def add_channel(self, channel, source=None):
+        """把解析出的频道写入格式化文件（解析时已去掉双引号），并记录频道来自哪个上游源"""
+        self._formatted.write(f"{channel.line()}\n")
+        self.channel_count += 1
+        if source is not None:
+            self.source_counts[source.name] += 1
+
+    def add_categorized(self, channel, source=None):
+        """追加一个已分类频道（按 channel.category 分段），source为频道来自的上游源"""
+        spool = self._category_spools.get(channel.category)
+        if spool is None:
+            spool = self._category_spools[channel.category] = self._new_spool()
+        self._spool_channel(spool, channel, source)
+        self.categorized_count += 1
+
+    def add_uncategorized(self, channel, source=None):
+        """追加一个未分类频道"""
+        if self._uncategorized_spool is None:
+            self._uncategorized_spool = self._new_spool()
+        self._spool_channel(self._uncategorized_spool, channel, source)
+        self.uncategorized_count += 1
+
+    def add_dead(self, channel, source=None):
+        """追加一个探测失效的频道，单独放在分类文件末尾"""
+        if self._dead_spool is None:
+            self._dead_spool = self._new_spool()
+        self._spool_channel(self._dead_spool, channel, source)
+        self.dead_count += 1
+
+    def commit(self, categories=None):
+        """按分类顺序把各分段写给所有分类输出格式，并原子替换输出文件"""
+        if categories is None:
+            categories = get_category_index().categories
+        self._formatted.close()
+
+        # 重新分类的txt文件始终生成，其他格式按配置追加
+        outputs = [ReclassifiedTextOutput(self)] + [output_class(self, **options)
+                                                    for output_class, options in self.output_formats]
+        for output in outputs:
+            output.open()
+        # 按照规则中分类的顺序输出分类，最后是未分类的频道
+        for header, channels in self._iter_sections(categories):
+            for output in outputs:
+                output.start_section(header)
+            for channel in channels:
+                for output in outputs:
+                    output.write_channel(header, channel)
+            for output in outputs:
+                output.end_section(header)
+        paths = []
+        for output in outputs:
+            paths.extend(output.close())
+
+        if self.incremental:
+            self._write_changelog()
+        for path in paths:
+            self._replace_output(path)
+        self._replace_output(self.FORMATTED_FILE)
+        self._close_spools()
+        paths.append(self.FORMATTED_FILE)
+        if self.incremental and os.path.exists(self.CHANGELOG_FILE):
+            paths.append(self.CHANGELOG_FILE)
+        write_output_manifest(paths)
+
+    def _iter_sections(self, categories):
+        """产出 (分段标题, ChannelRecord迭代器)"""
+        for category in categories:
+            spool = self._category_spools.get(category)
+            if spool is not None:
+                yield category, self._iter_section_channels(spool, category)
+        if self._uncategorized_spool is not None:
+            yield UNCATEGORIZED_HEADER, self._iter_section_channels(self._uncategorized_spool)
+
+    @staticmethod
+    def _iter_spool_channels(spool, category=None):
+        """从缓冲中读回 ChannelRecord"""
+        spool.seek(0)
+        lines = iter_text_lines(iter(lambda: spool.read(64 * 1024), ''))
+        # 来源名称只有少数几种，驻留后所有记录共享
+        sources = {'': None}
+        for name, url, region, source in zip(lines, lines, lines, lines):
+            if source not in sources:
+                sources[source] = sys.intern(source)
+            yield ChannelRecord(name, url, region, category, sources[source])
+
+    def _iter_section_channels(self, spool, category=None):
+        """读出一个分类的缓冲；可选地归并组播备用地址、按频道分组并排序地址
+
+        归并按窗口进行，内存中最多保留 alternate_window 个频道，不需要读入整个分类；
+        排序需要同一频道的全部地址，开启排序时仍读入整个分类（探测本身已经需要全部地址）。
+        """
+        channels = self._iter_spool_channels(spool, category)
+        if self.group_alternates:
+            channels = self._iter_grouped_alternates(channels)
+        if self.ranker is not None:
+            channels = iter(self.ranker.order(list(channels)))
+        return channels
+
+    def _iter_grouped_alternates(self, channels):
+        """逐个窗口归并组播备用地址；同一组的地址跨越窗口边界时不会排在一起"""
+        while True:
+            window = list(itertools.islice(channels, self.alternate_window))
+            if not window:
+                return
+            grouped, groups = group_alternates(window)
+            self.alternate_groups += groups
+            yield from grouped
+
+    def iter_dead_channels(self):
+        """读出探测失效的频道"""
+        if self._dead_spool is None:
+            return iter(())
+        return self._iter_spool_channels(self._dead_spool)
+
+    def _replace_output(self, path):
+        """用临时文件替换正式文件；增量模式下除生成时间外没有变化时保留原文件"""
+        tmp_path = path + '.tmp'
+        if self.incremental and os.path.exists(path) and read_without_timestamp(path) == read_without_timestamp(tmp_path):
+            os.remove(tmp_path)
+            self.unchanged_files.append(path)
+            debug_log(f"{path} 内容没有变化，保留原文件")
+            return
+        os.replace(tmp_path, path)
+        debug_log(f"{path} 生成成功")
+
+    def _write_changelog(self):
+        """比较新旧分类文件的各分段哈希，写出新增/移除频道的变更记录"""
+        if not os.path.exists(self.RECLASSIFIED_FILE):
+            return
+        changes = diff_output_blocks(read_output_blocks(self.RECLASSIFIED_FILE),
+                                     read_output_blocks(self.RECLASSIFIED_FILE + '.tmp'))
+        self.changes = changes
+        if not changes:
+            return
+        added = sum(len(block_added) for _, block_added, _ in changes)
+        removed = sum(len(block_removed) for _, _, block_removed in changes)
+        changed_categories = ', '.join(header.split(',', 1)[0] for header, _, _ in changes)
+        debug_log(f"变化的分段: {changed_categories}；新增 {added} 个，移除 {removed} 个")
+        with open(self.CHANGELOG_FILE + '.tmp', 'w', encoding='utf-8') as f:
+            f.write("# 直播源变更记录\n")
+            f.write(f"# 生成时间: {self.timestamp} (北京时间)\n")
+            f.write(f"# 新增 {added} 个，移除 {removed} 个\n")
+            f.write(f"# 变化的分段: {changed_categories}\n")
+            for header, block_added, block_removed in changes:
+                f.write(f"\n{header}\n")
+                for line in block_added:
+                    f.write(f"+ {line}\n")
+                for line in block_removed:
+                    f.write(f"- {line}\n")
+        os.replace(self.CHANGELOG_FILE + '.tmp', self.CHANGELOG_FILE)
+        debug_log(f"{self.CHANGELOG_FILE} 生成成功")
+
+    def abort(self):
+        """放弃写入，删除临时文件"""
+        if self._closed:
+            return
+        self._formatted.close()
+        for path in (self.FORMATTED_FILE + '.tmp', self.RECLASSIFIED_FILE + '.tmp', self.CHANGELOG_FILE + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+        for path in self._pending_outputs:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+        self._close_spools()
+
+    def _close_spools(self):
+        for spool in self._category_spools.values():
+            spool.close()
+        for spool in (self._uncategorized_spool, self._dead_spool):
+            if spool is not None:
+                spool.close()
+        self._closed = True
+
+def generate_output_files(categorized_channels, uncategorized_channels, all_channels, ranker=None,
+                          output_formats=()):
+    """由 ChannelRecord 生成输出文件；传入ranker时按健康度排序每个频道的地址
+
+    output_formats 为额外的输出格式 [(输出类, 参数)]，如 [(LiteTextOutput, {'per_channel': 3})]。
+    """
+    debug_log("开始生成输出文件...")
+    writer = OutputWriter(ranker=ranker, output_formats=output_formats)
+    try:
+        for channel in all_channels:
+            writer.add_channel(channel)
+        for channels in categorized_channels.values():
+            for channel in channels:
+                writer.add_categorized(channel)
+        for channel in uncategorized_channels:
+            writer.add_uncategorized(channel)
+        writer.commit()
+    except Exception as e:
+        writer.abort()
+        debug_log(f"生成文件失败: {e}")
+        raise
+
+# write_channel 的 result 参数未传入时需要现场分类
+_NOT_CATEGORIZED = object()
+
+def write_channel(writer, channel, source=None, category_index=None, dead=False, result=_NOT_CATEGORIZED):
+    """标准化、分类单个频道并写出；dead为True时放入失效频道段；传入result时使用已算好的分类结果"""
+    metrics = _metrics
+    # 逐频道调用，不计时的时候连空的上下文管理器也省掉
+    if not metrics.enabled:
+        if result is _NOT_CATEGORIZED:
+            result = categorize_channel(channel, category_index=category_index)
+        _add_channel(writer, channel, result, source, dead)
+        return
+    if result is _NOT_CATEGORIZED:
+        with metrics.stage('categorize'):
+            result = categorize_channel(channel, category_index=category_index)
+    with metrics.stage('write'):
+        _add_channel(writer, channel, result, source, dead)
+
+def _add_channel(writer, channel, result, source, dead):
+    writer.add_channel(channel, source=source)
+    if dead:
+        writer.add_dead(result, source)
+    elif result.category is not None:
+        writer.add_categorized(result, source)
+    else:
+        writer.add_uncategorized(result, source)
+
+def run_pipeline(chunks, writer, source=None):
+    """单遍流式处理：文本块 → 识别格式、解析/过滤 → 标准化/分类 → 增量写出"""
+    category_index = get_category_index()
+    source_format, chunks = sniff_source_format(chunks)
+    for channel in SOURCE_PARSERS[source_format](chunks):
+        write_channel(writer, channel, source=source, category_index=category_index)
+
+def iter_categorized(channels, category_index=None):
+    """为每个频道附上分类结果，产出 (解析出的ChannelRecord, 分类后的ChannelRecord)"""
+    if category_index is None:
+        category_index = get_category_index()
+    for channel in channels:
+        yield channel, categorize_channel(channel, category_index=category_index)
+
+def iter_region_chunks(lines, chunk_lines):
+    """在 #genre# 地区行处把行流切成约chunk_lines行的块，除第一块外每块都以地区行开头，保证块内地区上下文完整"""
+    chunk = []
+    for line in lines:
+        if len(chunk) >= chunk_lines and '#genre#' in line.lower():
+            yield chunk
+            chunk = []
+        chunk.append(line)
+    if chunk:
+        yield chunk
+
+def _init_parallel_worker(rules_path, fuzzy):
+    """进程池初始化：加载与主进程相同的规则，不输出逐块的日志"""
+    set_log_level(WARNING)
+    set_rules(load_rules(rules_path, fuzzy=fuzzy))
+
+def _categorize_chunk(lines):
+    """进程池任务：解析、过滤并分类一块数据，返回 ([(频道, 分类结果)], 计数器)"""
+    metrics = RunMetrics(enabled=False)
+    set_metrics(metrics)
+    return list(iter_categorized(iter_parsed_channels(lines))), metrics.counters
+
+class ParallelCategorizer:
+    """多进程解析/过滤/分类
+
+    行数达到阈值的上游源在 #genre# 地区行处切块，交给进程池并行处理，
+    再按块的原始顺序合并，结果与串行处理完全一致；不足阈值时仍在本进程串行处理。
+    同时在途的块数有上限，避免一次性把全部结果堆在内存里。
+    """
+
+    CHUNK_LINES = 20000
+
+    def __init__(self, workers, threshold, rules_path, fuzzy=True, chunk_lines=CHUNK_LINES):
+        self.workers = workers
+        self.threshold = threshold
+        self.rules_path = rules_path
+        self.fuzzy = fuzzy
+        self.chunk_lines = chunk_lines
+        self._executor = None
+
+    def iter_channels(self, lines):
+        """产出 (频道, 分类结果)，与 iter_categorized(iter_parsed_channels(lines)) 相同"""
+        lines = iter(lines)
+        buffered = list(itertools.islice(lines, self.threshold))
+        if len(buffered) < self.threshold:
+            yield from iter_categorized(iter_parsed_channels(buffered))
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_parallel_worker,
+                                                 initargs=(self.rules_path, self.fuzzy))
+        counters = Counter()
+        pending = deque()
+        chunks = 0
+        for chunk in iter_region_chunks(itertools.chain(buffered, lines), self.chunk_lines):
+            if chunks == 0:
+                del buffered
+            chunks += 1
+            pending.append(self._executor.submit(_categorize_chunk, chunk))
+            if len(pending) >= self.workers * 2:
+                yield from self._collect(pending.popleft(), counters)
+        while pending:
+            yield from self._collect(pending.popleft(), counters)
+        debug_log(f"并行解析 {chunks} 块，共找到 {counters['channels_parsed']} 个频道，"
+                  f"过滤了 {counters['channels_filtered']} 个频道")
+        for name, count in counters.most_common():
+            if name.startswith('filtered:'):
+                debug_log(f"  过滤规则 {name[len('filtered:'):]}: {count} 个")
+        get_metrics().counters.update(counters)
+
+    @staticmethod
+    def _collect(future, counters):
+        channels, chunk_counters = future.result()
+        counters.update(chunk_counters)
+        return channels
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+def iter_fetched_channels(fetched, parallel=None):
+    """依次解析已下载的上游源，产出 (频道, 上游源, 分类结果)；第一个上游源的原始数据保存用于调试
+
+    每个上游源按开头的内容识别格式（genre格式txt、扩展M3U、JSON），交给对应的流式解析器；
+    传入 ParallelCategorizer 时，大的genre格式上游源用多进程解析和分类。
+    """
+    metrics = get_metrics()
+    for i, result in enumerate(fetched):
+        debug_log(f"正在处理上游源 {result.source.name} ...")
+        if i == 0:
+            with metrics.stage('read'):
+                # 先写临时文件再替换，读取方不会看到写了一半的文件
+                with open('debug_original_content.txt.tmp', 'w', encoding='utf-8') as debug_file:
+                    result.spool.seek(0)
+                    shutil.copyfileobj(result.spool, debug_file)
+                os.replace('debug_original_content.txt.tmp', 'debug_original_content.txt')
+            debug_log("原始数据已保存到 debug_original_content.txt")
+        source_format, chunks = sniff_source_format(metrics.timed(result.iter_text(), 'read'))
+        debug_log(f"上游源 {result.source.name} 的格式: {source_format}")
+        if source_format == 'txt':
+            lines = iter_text_lines(chunks)
+            if i == 0 and log_enabled(DEBUG):
+                lines = log_leading_lines(lines)
+            if parallel is not None:
+                channels = metrics.timed(parallel.iter_channels(lines), 'parse')
+            else:
+                channels = metrics.timed(iter_categorized(metrics.timed(iter_parsed_channels(lines), 'parse')),
+                                         'categorize')
+        else:
+            channels = metrics.timed(
+                iter_categorized(metrics.timed(SOURCE_PARSERS[source_format](chunks), 'parse')), 'categorize')
+        for channel, categorized in channels:
+            yield channel, result.source, categorized
+        result.close()
+
+def parse_source_argument(value, index):
+    """解析命令行的上游源参数：URL 或 名称=URL，URL也可以是本地文件路径"""
+    name, sep, url = value.partition('=')
+    if not sep or '://' in name:
+        name, url = f"source{index + 1}", value
+    return UpstreamSource(name, url)
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='获取、格式化并重新分类直播源')
+    parser.add_argument('--source', action='append', default=[], metavar='[NAME=]URL',
+                        help='上游直播源（URL或本地文件路径），可重复指定；默认使用内置的上游源列表')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='并发下载上游源的线程数（默认等于上游源数量，最多16）')
+    parser.add_argument('--force', action='store_true',
+                        help='忽略获取缓存，无论上游是否变化都重新生成输出文件')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量模式：只有内容（不含生成时间）变化时才改写输出文件，并写出变更记录')
+    parser.add_argument('--format', action='append', choices=sorted(OUTPUT_FORMATS), default=[],
+                        help='额外生成的分类输出格式，可重复指定（m3u: reclassified_live_sources.m3u8，'
+                             'index: live_sources_index.json 查询索引，'
+                             'lite: reclassified_live_sources_lite.txt 精简版）')
+    parser.add_argument('--lite-urls-per-channel', type=int, default=3, metavar='N',
+                        help='精简版中每个频道保留的地址数，优先选择不同中继主机、地区和运营商的地址')
+    parser.add_argument('--lite-max-per-category', type=int, default=None, metavar='N',
+                        help='精简版中每个分类最多保留的地址数（按轮次在频道间分配），默认不限制')
+    parser.add_argument('--split-categories', action='store_true',
+                        help='为每个分类额外生成单独的播放列表（目前用于m3u格式，写入playlists目录）')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='不去除重复地址，也不归并同一组播组的备用地址')
+    parser.add_argument('--rules', default=RULES_FILE, metavar='PATH',
+                        help='分类、频道名称映射和过滤规则文件（.json，安装PyYAML时也支持.yaml/.yml）')
+    watch = parser.add_argument_group('守护模式')
+    watch.add_argument('--watch', action='store_true',
+                       help='常驻运行：规则、获取缓存和探测缓存保留在内存中，按间隔轮询上游，输入变化时才重新生成')
+    watch.add_argument('--interval', type=float, default=3600,
+                       help='守护模式下轮询上游的间隔（秒）；本地文件源和规则文件变化时立即处理')
+    watch.add_argument('--serve', type=parse_listen_address, metavar='[HOST:]PORT',
+                       help='启动HTTP服务，从内存提供生成的播放列表和 /categories/ 下的分类切片（支持gzip和ETag）；'
+                            '配合 --watch 时每轮处理后刷新')
+    parser.add_argument('--no-fuzzy', action='store_true',
+                        help='不对未分类的频道名做模糊匹配（忽略规则文件中的 fuzzy 设置）')
+    parser.add_argument('--parallel-workers', type=int, default=0, metavar='N',
+                        help='用N个进程并行解析和分类大的上游源（0或1表示串行），结果与串行完全一致')
+    parser.add_argument('--parallel-threshold', type=int, default=200000, metavar='LINES',
+                        help='上游源达到这么多行时才启用并行处理')
+    parser.add_argument('--log-level', choices=tuple(LOG_LEVELS), default='info',
+                        help='日志级别；debug 会输出逐行解析的细节')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='运行结束时把各阶段耗时和计数写入该JSON文件，便于跨运行比较')
+    probe = parser.add_argument_group('存活探测')
+    probe.add_argument('--probe', action='store_true',
+                       help='解析后并发探测每个直播地址是否可用，并记录首字节时间')
+    probe.add_argument('--probe-concurrency', type=int, default=200, help='探测总并发数')
+    probe.add_argument('--probe-per-host', type=int, default=4, help='每个主机（host:port）的探测并发数')
+    probe.add_argument('--probe-connect-timeout', type=float, default=3.0, help='连接超时（秒）')
+    probe.add_argument('--probe-timeout', type=float, default=5.0, help='首字节超时（秒）')
+    probe.add_argument('--probe-dead', choices=('drop', 'separate'), default='drop',
+                       help='失效地址的处理方式：drop 直接丢弃，separate 放到分类文件末尾的"失效频道"段')
+    probe.add_argument('--probe-cache-ttl', type=float, default=24 * 3600,
+                       help='地址探测结果的缓存有效期（秒），0表示不使用探测缓存')
+    probe.add_argument('--probe-host-ttl', type=float, default=6 * 3600,
+                       help='中继主机存活状态的缓存有效期（秒）')
+    probe.add_argument('--probe-sample-bytes', type=int, default=0,
+                       help='吞吐量采样的最大字节数，0表示不采样')
+    probe.add_argument('--probe-sample-seconds', type=float, default=1.0, help='吞吐量采样的最长时间（秒）')
+    probe.add_argument('--probe-fingerprint-bytes', type=int, default=0, metavar='BYTES',
+                       help='识别流格式（MPEG-TS/HLS/FLV、视频编码、HLS码率和分辨率）时每个地址最多读取的正文字节数，'
+                            '0表示不识别；大于0时隐含 --probe')
+    probe.add_argument('--drop-fake-4k', action='store_true',
+                       help='丢弃名称标注4K/8K但识别出的分辨率低于4K的地址；分辨率未知的地址保留（TS流需要在读取的'
+                            '字节内遇到关键帧前的序列参数集）；未指定 --probe-fingerprint-bytes 时使用 %d'
+                            % FINGERPRINT_DEFAULT_BYTES)
+    history = parser.add_argument_group('可靠性历史')
+    history.add_argument('--history', metavar='PATH',
+                         help='把每次运行中出现的地址及探测结果记录到该SQLite文件，按地址和中继主机汇总'
+                              '成功率和首字节时间p50/p95；配合 --rank 时按历史成功率排序')
+    history.add_argument('--history-retention-days', type=float, default=30,
+                         help='历史记录保留的天数，更早的运行记录会被删除')
+    history.add_argument('--min-uptime', type=float, metavar='PERCENT',
+                         help='丢弃历史成功率低于该百分比的地址（需要 --history）')
+    history.add_argument('--history-min-probes', type=int, default=4,
+                         help='地址至少有这么多次探测记录时才按 --min-uptime 过滤')
+    ranking = parser.add_argument_group('地址排序')
+    ranking.add_argument('--rank', action='store_true',
+                         help='按探测到的健康度（可用性、首字节时间、吞吐量）排序每个频道的地址，隐含 --probe')
+    ranking.add_argument('--max-urls-per-channel', type=int, default=None,
+                         help='分类文件中每个频道最多保留的地址数，在同一健康等级内优先保留不同中继主机、地区和运营商的地址')
+    args = parser.parse_args(argv)
+    if args.min_uptime is not None and not args.history:
+        parser.error('--min-uptime 需要同时指定 --history')
+    if args.drop_fake_4k and args.probe_fingerprint_bytes <= 0:
+        args.probe_fingerprint_bytes = FINGERPRINT_DEFAULT_BYTES
+    if args.rank or args.probe_fingerprint_bytes > 0:
+        args.probe = True
+    return args
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    set_log_level(args.log_level)
+    if args.serve:
+        return serve(args)
+    if args.watch:
+        return watch(args)
+    return run_once(args)
+
+class PlaylistStore:
+    """HTTP服务的内存内容：生成的文件及分类切片，附带预压缩的gzip正文和强ETag
+
+    reload() 按输出清单重新读取本次运行生成的文件并整体替换内容表，正在处理的请求不受影响；
+    之前运行用其他格式选项留下的文件不会被提供。
+    """
+
+    CONTENT_TYPES = {
+        '.txt': 'text/plain; charset=utf-8',
+        '.m3u8': 'application/vnd.apple.mpegurl',
+        '.json': 'application/json; charset=utf-8',
+    }
+    CATEGORY_PREFIX = '/categories/'
+
+    def __init__(self):
+        self.entries = {}
+
+    def reload(self):
+        entries = {}
+        for path in read_output_manifest():
+            try:
+                with open(path, 'rb') as f:
+                    body = f.read()
+            except OSError:
+                continue
+            entries['/' + path.replace(os.sep, '/')] = self._entry(path, body)
+        if '/' + OutputWriter.RECLASSIFIED_FILE in entries:
+            # 每个分类单独的 genre 格式切片
+            for header, lines in read_output_blocks(OutputWriter.RECLASSIFIED_FILE).items():
+                if not header:
+                    continue
+                name = safe_filename(header.split(',', 1)[0]) + '.txt'
+                body = '\n'.join([header] + lines).encode('utf-8') + b'\n'
+                entries[self.CATEGORY_PREFIX + name] = self._entry(name, body)
+        listing = '\n'.join(sorted(entries)).encode('utf-8') + b'\n'
+        entries['/'] = self._entry('index.txt', listing)
+        self.entries = entries
+        debug_log(f"HTTP服务内容已刷新: {len(entries)} 个路径")
+
+    def _entry(self, path, body):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        content_type = self.CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream')
+        return {
+            'type': content_type,
+            'identity': (body, f'"{digest}"'),
+            # gzip正文用不同的强ETag；mtime=0 保证相同内容压缩结果一致
+            'gzip': (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"'),
+        }
+
+    def get(self, path):
+        return self.entries.get(path)
+
+def accepts_gzip(header):
+    """Accept-Encoding 中是否接受gzip（q=0表示拒绝）"""
+    for item in (header or '').split(','):
+        coding, _, params = item.partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        return quality > 0
+    return False
+
+class PlaylistRequestHandler(BaseHTTPRequestHandler):
+    """从 PlaylistStore 提供播放列表，支持 If-None-Match / 304 和gzip"""
+
+    server_version = 'LiveSources/1.0'
+    store = None
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        path = unquote(urlsplit(self.path).path)
+        entry = self.store.get(path)
+        if entry is None:
+            self.send_error(404)
+            return
+        body, etag = entry['gzip'] if accepts_gzip(self.headers.get('Accept-Encoding')) else entry['identity']
+        if_none_match = self.headers.get('If-None-Match')
+        not_modified = if_none_match is not None and (
+            if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')])
+        self.send_response(304 if not_modified else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if not not_modified:
+            self.send_header('Content-Type', entry['type'])
+            self.send_header('Content-Length', str(len(body)))
+            if body is entry['gzip'][0]:
+                self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if send_body and not not_modified:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        debug_log("HTTP %s - " + format, self.address_string(), *args, level=DEBUG)
+
+def parse_listen_address(value):
+    """解析 [HOST:]PORT"""
+    host, sep, port = value.rpartition(':')
+    try:
+        return (host or '0.0.0.0') if sep else '0.0.0.0', int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的监听地址: {value}，格式为 [HOST:]PORT")
+
+def serve(args):
+    """HTTP服务模式：从内存提供生成的播放列表；配合 --watch 时每轮处理后刷新内容"""
+    stop = install_stop_handler()
+    store = PlaylistStore()
+    handler = type('Handler', (PlaylistRequestHandler,), {'store': store})
+    server = ThreadingHTTPServer(args.serve, handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='http-server', daemon=True)
+    thread.start()
+    debug_log(f"HTTP服务已启动: http://{args.serve[0]}:{server.server_address[1]}/")
+    try:
+        if args.watch:
+            watch(args, stop=stop, after_cycle=store.reload)
+        else:
+            if run_once(args) != 0 and not os.path.exists(OutputWriter.RECLASSIFIED_FILE):
+                return 1
+            store.reload()
+            stop.wait()
+    finally:
+        server.shutdown()
+        server.server_close()
+    debug_log("HTTP服务已停止")
+    return 0
+
+def run_once(args, state=None):
+    """运行一轮；需要时把本轮的指标写入文件"""
+    # 只有需要输出指标时才对各阶段计时
+    metrics = RunMetrics(enabled=bool(args.metrics))
+    set_metrics(metrics)
+    exit_code = run(args, state)
+    if args.metrics:
+        metrics.write(args.metrics, exit_code=exit_code)
+        debug_log(f"运行指标已写入 {args.metrics}")
+    return exit_code
+
+def configured_sources(args):
+    return [parse_source_argument(value, i) for i, value in enumerate(args.source)] or UPSTREAM_SOURCES
+
+class PipelineState:
+    """守护模式下跨轮次保留的状态：编译好的规则、获取缓存、探测缓存和HTTP连接池"""
+
+    def __init__(self):
+        self.rules = None
+        self._rules_key = None
+        self.fetch_cache = None
+        self.probe_cache = None
+        self.session = None
+        self.cycles = 0
+
+    def get_rules(self, path, fuzzy):
+        """规则文件没有变化时复用已编译的规则"""
+        key = (file_signature(path), fuzzy)
+        if self.rules is None or key != self._rules_key:
+            self.rules = load_rules(path, fuzzy=fuzzy)
+            self._rules_key = key
+        return self.rules
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+def file_signature(path):
+    """文件的 (修改时间, 大小)，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+# 守护模式下检查本地文件是否变化的间隔（秒）
+WATCH_POLL_SECONDS = 2.0
+
+def install_stop_handler():
+    """SIGTERM/SIGINT 时置位返回的Event，由主循环在合适的时机退出"""
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        debug_log(f"收到信号 {signum}，处理完当前一轮后退出")
+        stop.set()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, request_stop)
+    return stop
+
+def watch(args, stop=None, after_cycle=None):
+    """守护模式：常驻内存，按间隔轮询上游；本地文件源或规则文件变化时提前处理。收到SIGTERM/SIGINT后退出
+
+    after_cycle 在每轮处理后调用（例如刷新HTTP服务的内存内容）。
+    """
+    if stop is None:
+        stop = install_stop_handler()
+    state = PipelineState()
+    watched_paths = [source.local_path for source in configured_sources(args) if source.local_path is not None]
+    watched_paths.append(args.rules)
+    debug_log(f"守护模式启动，轮询间隔 {args.interval:g} 秒，监视 {len(watched_paths)} 个本地文件")
+    try:
+        while not stop.is_set():
+            signatures = [file_signature(path) for path in watched_paths]
+            exit_code = run_once(args, state)
+            state.cycles += 1
+            if after_cycle is not None:
+                after_cycle()
+            if exit_code != 0:
+                debug_log("本轮处理失败，等待下一轮", level=WARNING)
+            deadline = time.monotonic() + args.interval
+            while not stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if stop.wait(min(WATCH_POLL_SECONDS, remaining)):
+                    break
+                if [file_signature(path) for path in watched_paths] != signatures:
+                    debug_log("检测到本地文件变化，立即处理")
+                    break
+    finally:
+        state.close()
+    debug_log("守护模式退出")
+    return 0
+
+def run(args, state=None):
+    """执行一次获取、解析、分类和写出；state为PipelineState时复用其中的规则、缓存和连接池"""
+    metrics = get_metrics()
+    try:
+        debug_log("脚本开始执行" if state is None else f"开始第 {state.cycles + 1} 轮处理")
         
-        # 保存原始数据用于调试
-        with open('debug_original_content.txt', 'w', encoding='utf-8') as f:
-            f.write(original_content)
-        debug_log("原始数据已保存到 debug_original_content.txt")
+        try:
+            with metrics.stage('rules'):
+                if state is not None:
+                    rules = state.get_rules(args.rules, not args.no_fuzzy)
+                else:
+                    rules = load_rules(args.rules, fuzzy=not args.no_fuzzy)
+        except RulesError as e:
+            debug_log(f"错误: {e}", level=ERROR)
+            return 1
+        set_rules(rules)
         
-        # 显示前10行用于调试
-        lines = original_content.split('\n')
-        debug_log("原始数据前10行:")
-        for i, line in enumerate(lines[:10]):
-            debug_log(f"行 {i+1}: {repr(line)}")
+        sources = configured_sources(args)
         
-        debug_log("正在解析和格式化数据（跳过前两行）...")
-        formatted_channels = parse_original_data_skip_first_two_lines(original_content)
-        debug_log(f"成功解析 {len(formatted_channels)} 个频道")
+        session = None
+        if state is not None:
+            if state.fetch_cache is None:
+                state.fetch_cache = FetchCache()
+            if state.session is None:
+                state.session = create_session(pool_size=min(len(sources), 16))
+            cache = state.fetch_cache
+            session = state.session
+        else:
+            cache = FetchCache()
+        # 只影响获取过程的选项不参与指纹
+        output_options = {key: value for key, value in vars(args).items()
+                          if key not in ('source', 'workers', 'force', 'incremental', 'log_level', 'metrics',
+                                         'parallel_workers', 'parallel_threshold', 'watch', 'interval', 'serve')}
+        # 规则文件内容变化同样需要重新生成输出
+        output_options['rules'] = rules.digest
+        fingerprint = pipeline_fingerprint(sources, output_options)
+        outputs_exist = all(os.path.exists(path) for path in (OutputWriter.RECLASSIFIED_FILE, OutputWriter.FORMATTED_FILE))
+        # 开启探测时即使上游未变化，地址的可用性也可能变化，不走缓存短路
+        # 守护模式下 --force 只对第一轮生效
+        force = args.force and (state is None or state.cycles == 0)
+        # 记录可靠性历史时每次运行都要登记上游中出现的地址，同样不走短路
+        use_cache = (not force and not args.probe and not args.history and outputs_exist
+                     and cache.pipeline_fingerprint == fingerprint)
         
-        if len(formatted_channels) == 0:
-            debug_log("错误: 仍然没有解析到任何频道")
+        debug_log(f"正在并发获取 {len(sources)} 个上游源的原始数据...")
+        with metrics.stage('fetch'):
+            results = fetch_sources(sources, max_workers=args.workers, session=session,
+                                    cache=cache if use_cache else None)
+        if use_cache:
+            # 只有每个上游都未变化（内容哈希相同或返回304）时才跳过；获取失败的上游不算未变化，
+            # 全部失败时走下面的错误退出，避免把上游故障当作成功
+            if all(cache.is_unchanged(result) for result in results):
+                for result in results:
+                    cache.update(result)
+                    result.close()
+                cache.save()
+                debug_log("上游数据无变化，跳过解析和写入")
+                return 0
+            # 有上游发生变化，需要完整重建；返回304的上游没有正文，重新无条件获取
+            refetch = [i for i, result in enumerate(results) if result.not_modified]
+            if refetch:
+                debug_log(f"重新获取 {len(refetch)} 个未修改的上游源以完整重建输出")
+                with metrics.stage('fetch'):
+                    refetched = fetch_sources([results[i].source for i in refetch], max_workers=args.workers,
+                                              session=session)
+                for i, result in zip(refetch, refetched):
+                    results[i] = result
+        for result in results:
+            if result.ok:
+                check_source_content(result)
+            metrics.record_fetch(result)
+        fetched = [result for result in results if result.ok]
+        if not fetched:
+            debug_log("无法获取数据，程序退出", level=ERROR)
             return 1
+        for result in results:
+            if not result.ok:
+                debug_log(f"跳过获取失败的上游源 {result.source.name}: {result.error}", level=WARNING)
         
-        debug_log("正在重新分类频道...")
-        categorized_channels, uncategorized_channels = categorize_channels(formatted_channels)
+        debug_log("正在流式解析、分类并生成输出文件...")
+        output_formats = []
+        for name in dict.fromkeys(args.format):
+            options = {}
+            if name == 'm3u' and args.split_categories:
+                options = {'split': True}
+            elif name == 'lite':
+                options = {'per_channel': args.lite_urls_per_channel, 'per_category': args.lite_max_per_category}
+            output_formats.append((OUTPUT_FORMATS[name], options))
+        writer = None
+        parallel = None
+        history = None
+        reliability = None
+        try:
+            # 写出器最后创建：进程池或历史库打开失败时不会留下临时文件
+            if args.parallel_workers > 1:
+                parallel = ParallelCategorizer(args.parallel_workers, args.parallel_threshold, args.rules,
+                                               fuzzy=not args.no_fuzzy)
+            if args.history:
+                history = ReliabilityStore(args.history, retention_days=args.history_retention_days)
+                reliability = history.snapshot()
+                debug_log(f"可靠性历史: {len(reliability.urls)} 个地址，{len(reliability.hosts)} 个主机")
+            writer = OutputWriter(sources=[result.source for result in fetched], group_alternates=not args.no_dedup,
+                                  incremental=args.incremental, output_formats=output_formats)
+            channels = iter_fetched_channels(fetched, parallel=parallel)
+            deduplicator = None
+            if not args.no_dedup:
+                deduplicator = ChannelDeduplicator()
+                channels = metrics.timed(iter_deduplicated(channels, deduplicator), 'dedup')
+            probe_results = None
+            if args.probe:
+                # 探测需要先收集全部地址
+                channels = list(channels)
+                debug_log(f"正在探测 {len(channels)} 个频道的直播地址...")
+                probe_cache = state.probe_cache if state is not None else None
+                if probe_cache is None and args.probe_cache_ttl > 0:
+                    probe_cache = ProbeCache(url_ttl=args.probe_cache_ttl, host_ttl=args.probe_host_ttl)
+                    if state is not None:
+                        state.probe_cache = probe_cache
+                with metrics.stage('probe'):
+                    probe_results = probe_channel_urls(
+                        [channel.url for channel, _, _ in channels], cache=probe_cache,
+                        concurrency=args.probe_concurrency, per_host=args.probe_per_host,
+                        connect_timeout=args.probe_connect_timeout, first_byte_timeout=args.probe_timeout,
+                        sample_bytes=args.probe_sample_bytes, sample_seconds=args.probe_sample_seconds,
+                        fingerprint_bytes=args.probe_fingerprint_bytes)
+                if probe_cache is not None:
+                    probe_cache.save()
+
+            category_index = get_category_index()
+            if args.rank or args.max_urls_per_channel is not None:
+                writer.ranker = ChannelRanker(probe_results if args.rank else None,
+                                              max_urls_per_channel=args.max_urls_per_channel,
+                                              category_index=category_index,
+                                              reliability=reliability if args.rank else None)
+            dropped = 0
+            fake_uhd = 0
+            unreliable = 0
+            for channel, source, categorized in channels:
+                if history is not None:
+                    history.observe(channel.url, probe_results[channel.url] if probe_results is not None else None)
+                if args.min_uptime is not None:
+                    uptime = reliability.url_uptime(channel.url, min_probes=args.history_min_probes)
+                    if uptime is not None and uptime * 100 < args.min_uptime:
+                        unreliable += 1
+                        continue
+                dead = probe_results is not None and probe_results[channel.url].reachable is False
+                if dead and args.probe_dead == 'drop':
+                    dropped += 1
+                    continue
+                if args.drop_fake_4k and is_fake_uhd(categorized.name, probe_results[channel.url]):
+                    fake_uhd += 1
+                    continue
+                write_channel(writer, channel, source=source, category_index=category_index, dead=dead,
+                              result=categorized)
+            if dropped:
+                debug_log(f"丢弃失效频道 {dropped} 个")
+            if fake_uhd:
+                debug_log(f"丢弃分辨率不足4K的4K频道 {fake_uhd} 个")
+            if unreliable:
+                debug_log(f"丢弃历史成功率低于 {args.min_uptime:g}% 的地址 {unreliable} 个")
+            if deduplicator is not None:
+                debug_log(f"去除重复地址 {deduplicator.duplicate_count} 个")
+            debug_log(f"分类完成: 已分类 {writer.categorized_count}, 未分类 {writer.uncategorized_count}")
+            if metrics.counters['fuzzy_matched']:
+                debug_log(f"其中模糊匹配归类 {metrics.counters['fuzzy_matched']} 个")
+
+            if writer.channel_count == 0:
+                debug_log("错误: 仍然没有解析到任何频道", level=ERROR)
+                writer.abort()
+                return 1
+
+            with metrics.stage('write'):
+                writer.commit()
+            if history is not None:
+                with metrics.stage('history'):
+                    recorded = history.commit_run()
+                debug_log(f"可靠性历史已记录 {recorded} 个地址")
+            if writer.alternate_groups:
+                debug_log(f"归并同一组播组的备用地址 {writer.alternate_groups} 组")
+            if writer.ranker is not None and writer.ranker.dropped_count:
+                debug_log(f"按每个频道最多 {args.max_urls_per_channel} 个地址截断，省略 {writer.ranker.dropped_count} 个地址")
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            if parallel is not None:
+                parallel.close()
+            if history is not None:
+                history.close()
+            for result in results:
+                result.close()
         
-        debug_log("正在生成输出文件...")
-        generate_output_files(categorized_channels, uncategorized_channels, formatted_channels)
+        # 输出生成成功后才更新缓存，保证下次能正确判断是否有变化
+        for result in fetched:
+            cache.update(result)
+        cache.set_pipeline_fingerprint(fingerprint)
+        cache.save()
         
+        metrics.count('channels_written', writer.channel_count)
+        metrics.count('channels_categorized', writer.categorized_count)
+        metrics.count('channels_uncategorized', writer.uncategorized_count)
+        metrics.count('channels_dead', writer.dead_count)
+        metrics.count('channels_dropped_dead', dropped)
+        metrics.count('channels_dropped_fake_uhd', fake_uhd)
+        metrics.count('channels_dropped_unreliable', unreliable)
+        if deduplicator is not None:
+            metrics.count('duplicates_removed', deduplicator.duplicate_count)
+        if probe_results is not None:
+            metrics.count('urls_probed', len(probe_results))
+            metrics.count('urls_reachable', sum(1 for result in probe_results.values() if result.reachable))
         debug_log("完成！")
-        debug_log(f"已处理频道总数: {len(formatted_channels)}")
-        debug_log(f"已分类频道数: {sum(len(channels) for channels in categorized_channels.values())}")
-        debug_log(f"未分类频道数: {len(uncategorized_channels)}")
+        debug_log(f"已处理频道总数: {writer.channel_count}")
+        for source_name, count in writer.source_counts.items():
+            debug_log(f"  来自 {source_name}: {count}")
+        debug_log(f"已分类频道数: {writer.categorized_count}")
+        debug_log(f"未分类频道数: {writer.uncategorized_count}")
         debug_log("生成的文件:")
         debug_log("- reclassified_live_sources.txt (重新分类的直播源)")
         debug_log("- formatted_live_sources.txt (仅格式化的直播源)")
@@ -621,7 +4025,7 @@ def main():
         return 0
         
     except Exception as e:
-        debug_log(f"脚本执行过程中发生错误: {e}")
+        debug_log(f"脚本执行过程中发生错误: {e}", level=ERROR)
         debug_log("详细错误信息:")
         traceback.print_exc()
         return 1
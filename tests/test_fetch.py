@@ -0,0 +1,145 @@
+"""上游源下载的测试：并发下载、重试退避、gzip正文、条件请求，以及单个源失败不影响其他源
+
+HTTP服务在本地启动，不访问网络。
+"""
+
+import gzip
+import http.server
+import socket
+import threading
+import time
+
+import pytest
+
+import process_live_sources as pls
+
+TXT_BODY = "央视频道,#genre#\nCCTV-1综合,http://10.0.0.1:8000/rtp/239.1.1.1:5140$北京联通\n"
+
+
+class _SourceHandler(http.server.BaseHTTPRequestHandler):
+    # 路径 -> (状态码, 正文, 响应前等待秒数)；路径对应列表时每次请求依次取一个
+    routes = {}
+    hits = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.hits[self.path] = self.hits.get(self.path, 0) + 1
+            route = self.routes[self.path]
+            if isinstance(route, list):
+                route = route.pop(0) if len(route) > 1 else route[0]
+        status, body, delay = route
+        if delay:
+            time.sleep(delay)
+        if status == 200 and self.headers.get('If-None-Match') == '"v1"':
+            status, body = 304, b''
+        self.send_response(status)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def source_server():
+    _SourceHandler.routes = {
+        '/a.txt': (200, TXT_BODY.encode('utf-8'), 0),
+        '/slow1.txt': (200, b'1', 0.3),
+        '/slow2.txt': (200, b'2', 0.3),
+        '/slow3.txt': (200, b'3', 0.3),
+        '/flaky.txt': [(500, b'', 0), (200, TXT_BODY.encode('utf-8'), 0)],
+        '/down.txt': (503, b'', 0),
+        '/missing.txt': (404, b'', 0),
+        '/live.txt.gz': (200, gzip.compress(TXT_BODY.encode('utf-8')), 0),
+        '/broken.txt.gz': (200, gzip.compress(TXT_BODY.encode('utf-8'))[:30] + b'\x00' * 30, 0),
+    }
+    _SourceHandler.hits = {}
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _SourceHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def source(base, path, **kwargs):
+    kwargs.setdefault('timeout', 2)
+    kwargs.setdefault('backoff', 0.01)
+    return pls.UpstreamSource(path.strip('/'), base + path, **kwargs)
+
+
+def text_of(result):
+    return ''.join(result.iter_text())
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_sources_fetched_concurrently_in_order(source_server):
+    sources = [source(source_server, f'/slow{i}.txt') for i in (1, 2, 3)]
+    started = time.monotonic()
+    results = pls.fetch_sources(sources)
+    elapsed = time.monotonic() - started
+    assert [text_of(result) for result in results] == ['1', '2', '3']
+    # 串行至少需要0.9秒
+    assert elapsed < 0.8
+
+
+def test_retry_with_backoff_after_server_error(source_server):
+    result = pls.fetch_sources([source(source_server, '/flaky.txt', retries=2, backoff=0.2)])[0]
+    assert result.ok
+    assert result.attempts == 2
+    assert result.elapsed >= 0.2
+    assert text_of(result) == TXT_BODY
+
+
+def test_server_error_gives_up_after_retries(source_server):
+    result = pls.fetch_sources([source(source_server, '/down.txt', retries=2)])[0]
+    assert not result.ok
+    assert result.attempts == 3
+    assert result.error == 'HTTP 503'
+
+
+def test_client_error_is_not_retried(source_server):
+    result = pls.fetch_sources([source(source_server, '/missing.txt', retries=2)])[0]
+    assert (result.ok, result.attempts, result.status_code) == (False, 1, 404)
+    assert _SourceHandler.hits['/missing.txt'] == 1
+
+
+def test_gzip_body_is_decoded(source_server):
+    result = pls.fetch_sources([source(source_server, '/live.txt.gz')])[0]
+    assert result.ok
+    assert text_of(result) == TXT_BODY
+    assert result.length == len(TXT_BODY)
+
+
+def test_failing_sources_do_not_affect_others(source_server):
+    sources = [
+        source(source_server, '/broken.txt.gz', retries=2),
+        source(source_server, '/missing.txt'),
+        pls.UpstreamSource('refused', f"http://127.0.0.1:{unused_port()}/x.txt", timeout=2, retries=0),
+        source(source_server, '/a.txt'),
+    ]
+    broken, missing, refused, good = pls.fetch_sources(sources)
+    # 损坏的gzip重试也不会变好，只请求一次
+    assert not broken.ok and broken.attempts == 1 and broken.error.startswith('解压失败')
+    assert not missing.ok
+    assert not refused.ok
+    assert good.ok and text_of(good) == TXT_BODY
+
+
+def test_conditional_request_not_modified(source_server, tmp_path):
+    cache = pls.FetchCache(str(tmp_path / 'fetch_cache.json'))
+    upstream = source(source_server, '/a.txt')
+    first = pls.fetch_sources([upstream], cache=cache)[0]
+    assert first.ok and not cache.is_unchanged(first)
+    cache.update(first)
+    second = pls.fetch_sources([upstream], cache=cache)[0]
+    assert second.not_modified and second.status_code == 304
+    assert cache.is_unchanged(second)
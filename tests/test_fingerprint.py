@@ -0,0 +1,260 @@
+"""流格式指纹识别的测试：HLS主/分片播放列表、TS同步字节和参数集、读取字节预算、假4K判断
+
+TS流和HTTP服务都在本地构造，不访问网络。
+"""
+
+import http.server
+import threading
+
+import pytest
+
+import process_live_sources as pls
+
+# x264 1920x1080 High@4.0 的序列参数集（不含NAL头，带防竞争字节）
+H264_SPS_1080P = bytes.fromhex('640028acd940780227e5c044000003000400000300c83c60c658')
+# x265 1280x720 Main 的序列参数集（含2字节NAL头）
+HEVC_SPS_720P = bytes.fromhex('42010101600000030090000003000003005da00280802d165959a4932bc05a70800001f480003a9804')
+
+VIDEO_PID = 0x100
+PMT_PID = 0x1000
+
+
+def ts_packet(pid, payload, start=False):
+    """构造一个188字节的TS包，负载不足时用自适应字段填充"""
+    header = bytes([0x47, (0x40 if start else 0) | (pid >> 8), pid & 0xff])
+    stuffing = 184 - len(payload)
+    if stuffing == 0:
+        return header + b'\x10' + payload
+    if stuffing == 1:
+        return header + b'\x30\x00' + payload
+    return header + b'\x30' + bytes([stuffing - 1, 0x00]) + b'\xff' * (stuffing - 2) + payload
+
+
+def psi_packet(pid, table_id, table_ext, body):
+    """带指针字段的PSI表包（不校验CRC，用0填充）"""
+    length = 5 + len(body) + 4
+    section = bytes([table_id, 0xb0 | (length >> 8), length & 0xff, table_ext >> 8, table_ext & 0xff,
+                     0xc1, 0x00, 0x00]) + body + b'\x00' * 4
+    payload = b'\x00' + section
+    return ts_packet(pid, payload + b'\xff' * (184 - len(payload)), start=True)
+
+
+def pat_pmt(stream_type):
+    pat = psi_packet(0, 0x00, 1, bytes([0x00, 0x01, 0xe0 | (PMT_PID >> 8), PMT_PID & 0xff]))
+    pmt = psi_packet(PMT_PID, 0x02, 1, bytes([0xe0 | (VIDEO_PID >> 8), VIDEO_PID & 0xff, 0xf0, 0x00,
+                                              stream_type, 0xe0 | (VIDEO_PID >> 8), VIDEO_PID & 0xff, 0xf0, 0x00]))
+    return pat + pmt
+
+
+def pes_packets(es):
+    """把视频基本流装进一个PES包，切成TS包"""
+    pes = b'\x00\x00\x01\xe0\x00\x00\x80\x80\x05' + b'\x21\x00\x01\x00\x01' + es
+    packets = []
+    for i in range(0, len(pes), 184):
+        packets.append(ts_packet(VIDEO_PID, pes[i:i + 184], start=i == 0))
+    return b''.join(packets)
+
+
+def filler_packets(count):
+    """不含参数集的视频负载（没有起始码）"""
+    return b''.join(ts_packet(VIDEO_PID, b'\xaa' * 184) for _ in range(count))
+
+
+def h264_stream(sps=H264_SPS_1080P):
+    es = b'\x00\x00\x00\x01\x09\xf0' + b'\x00\x00\x00\x01\x67' + sps + b'\x00\x00\x00\x01\x68\xeb\xe3\xcb\x22\xc0'
+    return pat_pmt(0x1b) + pes_packets(es + b'\x00\x00\x01\x65' + b'\x88' * 400)
+
+
+MASTER_PLAYLIST = (
+    "#EXTM3U\n"
+    "#EXT-X-VERSION:3\n"
+    '#EXT-X-STREAM-INF:BANDWIDTH=1280000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"\n'
+    "720p.m3u8\n"
+    '#EXT-X-STREAM-INF:BANDWIDTH=6000000,RESOLUTION=1920x1080,CODECS="avc1.640028,mp4a.40.2"\n'
+    "1080p.m3u8\n"
+    '#EXT-X-STREAM-INF:BANDWIDTH=640000,RESOLUTION=640x360,CODECS="avc1.42e01e,mp4a.40.2"\n'
+    "360p.m3u8\n"
+)
+
+MEDIA_PLAYLIST = (
+    "#EXTM3U\n"
+    "#EXT-X-VERSION:3\n"
+    "#EXT-X-TARGETDURATION:6\n"
+    "#EXT-X-MEDIA-SEQUENCE:1024\n"
+    "#EXTINF:6.000,\n"
+    "seg1024.ts\n"
+    "#EXTINF:6.000,\n"
+    "seg1025.ts\n"
+)
+
+
+def test_hls_master_picks_highest_variant():
+    info = pls.fingerprint_stream(MASTER_PLAYLIST.encode('utf-8'))
+    assert info == {'container': 'hls', 'codec': 'h264', 'bandwidth': 6000000, 'width': 1920, 'height': 1080}
+
+
+def test_hls_master_hevc_codec_and_bom():
+    text = '\ufeff#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=15000000,RESOLUTION=3840x2160,CODECS="hvc1.2.4.L153.B0"\nuhd.m3u8\n'
+    info = pls.fingerprint_stream(text.encode('utf-8'))
+    assert (info['codec'], info['width'], info['height']) == ('hevc', 3840, 2160)
+
+
+def test_hls_media_playlist_has_no_resolution():
+    info = pls.fingerprint_stream(MEDIA_PLAYLIST.encode('utf-8'))
+    assert info['container'] == 'hls'
+    assert info['width'] is None and info['height'] is None and info['bandwidth'] is None
+    assert pls.parse_hls_master(MEDIA_PLAYLIST) is None
+
+
+def test_hls_detected_from_content_type():
+    info = pls.fingerprint_stream(b'', 'application/vnd.apple.mpegurl')
+    assert info['container'] == 'hls'
+
+
+def test_ts_sync_offset():
+    packets = filler_packets(3)
+    assert pls.ts_sync_offset(packets) == 0
+    # 从包中间开始转发时，同步字节不在开头
+    assert pls.ts_sync_offset(b'\x00' * 17 + packets) == 17
+    assert pls.ts_sync_offset(b'\x47' + b'\x00' * 400) is None
+    assert pls.ts_sync_offset(b'FLV\x01\x05' + b'\x00' * 400) is None
+
+
+def test_ts_h264_codec_and_resolution():
+    info = pls.fingerprint_stream(b'\x00' * 5 + h264_stream())
+    assert info['container'] == 'mpegts'
+    assert info['codec'] == 'h264'
+    assert (info['width'], info['height']) == (1920, 1080)
+
+
+def test_ts_hevc_resolution():
+    es = b'\x00\x00\x00\x01' + HEVC_SPS_720P + b'\x00\x00\x01\x26\x01' + b'\x88' * 200
+    info = pls.fingerprint_stream(pat_pmt(0x24) + pes_packets(es))
+    assert (info['codec'], info['width'], info['height']) == ('hevc', 1280, 720)
+
+
+def test_ts_mpeg2_sequence_header():
+    es = b'\x00\x00\x01\xb3' + bytes([0x2d, 0x02, 0x40, 0x33]) + b'\x00' * 8
+    info = pls.fingerprint_stream(pat_pmt(0x02) + pes_packets(es))
+    assert (info['codec'], info['width'], info['height']) == ('mpeg2', 720, 576)
+
+
+def test_ts_without_parameter_sets_has_unknown_resolution():
+    # 中继从两个关键帧之间开始转发：有PAT/PMT，但预算内没有序列参数集
+    info = pls.fingerprint_stream(pat_pmt(0x1b) + filler_packets(20))
+    assert (info['container'], info['codec']) == ('mpegts', 'h264')
+    assert info['width'] is None and info['height'] is None
+
+
+def test_ts_truncated_sps_is_ignored():
+    # 参数集不完整（下一个起始码提前出现）时不抛异常，分辨率未知
+    info = pls.fingerprint_stream(h264_stream(sps=H264_SPS_1080P[:6]))
+    assert info['codec'] == 'h264'
+    assert info['width'] is None
+
+
+def test_ts_without_pat_pmt():
+    info = pls.fingerprint_stream(filler_packets(5))
+    assert info == {'container': 'mpegts', 'codec': None, 'bandwidth': None, 'width': None, 'height': None}
+
+
+def test_flv_and_unknown():
+    assert pls.fingerprint_stream(b'FLV\x01\x05\x00\x00\x00\x09')['container'] == 'flv'
+    assert pls.fingerprint_stream(b'<html>not a stream</html>')['container'] == 'unknown'
+
+
+def test_dechunk_truncated_body():
+    assert pls.dechunk(b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n') == b'hello world'
+    # 被读取预算截断的最后一块也保留已读到的部分
+    assert pls.dechunk(b'5\r\nhello\r\n6\r\n wo') == b'hello wo'
+
+
+@pytest.mark.parametrize('name, width, height, expected', [
+    ('CCTV-4K超高清', 1920, 1080, True),
+    ('CCTV-4K超高清', 3840, 2160, False),
+    ('北京卫视4K', 4096, 2160, False),
+    ('欢笑剧场4K', None, None, False),
+    ('CCTV-1综合', 1280, 720, False),
+    ('爱上UHD', 1280, 720, True),
+])
+def test_is_fake_uhd(name, width, height, expected):
+    result = pls.ProbeResult('http://example.com/live', reachable=True, container='mpegts',
+                             width=width, height=height)
+    assert pls.is_fake_uhd(name, result) is expected
+
+
+def test_is_fake_uhd_without_probe_result():
+    assert pls.is_fake_uhd('CCTV-4K超高清', None) is False
+
+
+class _StreamHandler(http.server.BaseHTTPRequestHandler):
+    routes = {}
+
+    def do_GET(self):
+        body, content_type, chunked = self.routes[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(body), 1000):
+                chunk = body[i:i + 1000]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stream_server():
+    # 关键帧之前有约37KB不含参数集的数据
+    late_sps = pat_pmt(0x1b) + filler_packets(200) + h264_stream()[2 * 188:]
+    _StreamHandler.routes = {
+        '/master.m3u8': (MASTER_PLAYLIST.encode('utf-8'), 'application/vnd.apple.mpegurl', True),
+        '/live.ts': (h264_stream(), 'video/mp2t', False),
+        '/late.ts': (late_sps, 'video/mp2t', False),
+    }
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _StreamHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def probe(url, fingerprint_bytes):
+    prober = pls.StreamProber(connect_timeout=2, first_byte_timeout=2, fingerprint_bytes=fingerprint_bytes)
+    return prober.run([url])[url]
+
+
+def test_prober_fingerprints_chunked_hls(stream_server):
+    result = probe(stream_server + '/master.m3u8', pls.FINGERPRINT_DEFAULT_BYTES)
+    assert result.reachable is True
+    assert (result.container, result.resolution, result.bandwidth) == ('hls', '1920x1080', 6000000)
+
+
+def test_prober_fingerprints_ts(stream_server):
+    result = probe(stream_server + '/live.ts', pls.FINGERPRINT_DEFAULT_BYTES)
+    assert (result.container, result.codec, result.resolution) == ('mpegts', 'h264', '1920x1080')
+    assert result.is_uhd is False
+
+
+def test_prober_respects_byte_budget(stream_server):
+    # 预算内读不到关键帧前的参数集，分辨率未知，不会被当作假4K
+    small = probe(stream_server + '/late.ts', 16 * 1024)
+    assert (small.container, small.codec, small.resolution) == ('mpegts', 'h264', None)
+    assert pls.is_fake_uhd('CCTV-4K超高清', small) is False
+    large = probe(stream_server + '/late.ts', 64 * 1024)
+    assert large.resolution == '1920x1080'
+    assert pls.is_fake_uhd('CCTV-4K超高清', large) is True
+
+
+def test_prober_without_fingerprint(stream_server):
+    result = probe(stream_server + '/live.ts', 0)
+    assert result.reachable is True
+    assert result.container is None
@@ -0,0 +1,126 @@
+"""直播地址存活探测的测试：可达性和首字节时间、失效地址的丢弃/单独分段、每个主机的并发上限
+
+HTTP服务在本地启动，不访问网络。
+"""
+
+import http.server
+import socket
+import threading
+import time
+
+import pytest
+
+import process_live_sources as pls
+
+
+class _LiveHandler(http.server.BaseHTTPRequestHandler):
+    # 路径 -> (状态码, 响应前等待秒数)
+    routes = {}
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def do_GET(self):
+        status, delay = self.routes[self.path]
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        time.sleep(delay)
+        # 先减计数再响应：客户端收到首字节后才会释放名额
+        with cls.lock:
+            cls.active -= 1
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp2t')
+        self.send_header('Content-Length', '188')
+        self.end_headers()
+        self.wfile.write(b'\x47' + b'\xff' * 187)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def live_server():
+    _LiveHandler.routes = {
+        '/live.ts': (200, 0.1),
+        '/gone.ts': (404, 0),
+        '/busy.ts': (200, 0.1),
+    }
+    _LiveHandler.active = _LiveHandler.max_active = 0
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _LiveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prober(**kwargs):
+    return pls.StreamProber(connect_timeout=2, first_byte_timeout=2, **kwargs)
+
+
+def test_reachable_with_ttfb(live_server):
+    url = live_server + '/live.ts'
+    result = prober().run([url])[url]
+    assert (result.reachable, result.status, result.error) == (True, 200, None)
+    assert 0.1 <= result.ttfb < 2
+
+
+def test_error_status_is_dead(live_server):
+    url = live_server + '/gone.ts'
+    result = prober().run([url])[url]
+    assert (result.reachable, result.status) == (False, 404)
+
+
+def test_refused_connection_is_dead():
+    url = f"http://127.0.0.1:{unused_port()}/live.ts"
+    result = prober().run([url])[url]
+    assert result.reachable is False
+    assert result.ttfb is None
+
+
+def test_multicast_is_not_probed():
+    url = 'rtp://239.1.1.1:5140'
+    assert prober().run([url])[url].reachable is None
+
+
+def test_per_host_limit(live_server):
+    urls = [f"{live_server}/busy.ts?n={i}" for i in range(8)]
+    _LiveHandler.routes.update({f"/busy.ts?n={i}": (200, 0.1) for i in range(8)})
+    results = prober(per_host=2).run(urls)
+    assert all(result.reachable for result in results.values())
+    assert _LiveHandler.max_active == 2
+
+
+def run_with_probe(tmp_path, monkeypatch, live_server, mode):
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / 'source.txt'
+    source.write_text(
+        "央视频道,#genre#\n"
+        f"CCTV-1综合,{live_server}/live.ts\n"
+        f"CCTV-2财经,{live_server}/gone.ts\n",
+        encoding='utf-8')
+    assert pls.main(['--source', str(source), '--probe', '--probe-dead', mode,
+                     '--probe-cache-ttl', '0', '--probe-connect-timeout', '2', '--probe-timeout', '2']) == 0
+    return (tmp_path / pls.OutputWriter.RECLASSIFIED_FILE).read_text(encoding='utf-8')
+
+
+def test_dead_entries_dropped(tmp_path, monkeypatch, live_server):
+    text = run_with_probe(tmp_path, monkeypatch, live_server, 'drop')
+    assert f"{live_server}/live.ts" in text
+    assert '/gone.ts' not in text
+    assert pls.DEAD_HEADER not in text
+
+
+def test_dead_entries_separated(tmp_path, monkeypatch, live_server):
+    text = run_with_probe(tmp_path, monkeypatch, live_server, 'separate')
+    live, _, dead = text.partition(pls.DEAD_HEADER)
+    assert f"{live_server}/live.ts" in live and '/gone.ts' not in live
+    assert f"{live_server}/gone.ts" in dead
@@ -0,0 +1,71 @@
+"""可靠性历史库的测试：保留期清理不能删掉本次运行出现的地址，缓存的主机状态不算作探测，历史库打不开时不留临时文件"""
+
+import asyncio
+
+import process_live_sources as pls
+
+DAY = 24 * 3600
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_url_seen_again_after_retention_keeps_stats(tmp_path):
+    clock = FakeClock()
+    url = 'http://10.0.0.1:8000/rtp/239.1.1.1:5140'
+    with pls.ReliabilityStore(str(tmp_path / 'history.db'), retention_days=30, clock=clock) as store:
+        store.observe(url, pls.ProbeResult(url, reachable=True, ttfb=0.1))
+        store.commit_run()
+        clock.now = 40 * DAY
+        store.observe(url, pls.ProbeResult(url, reachable=False))
+        store.commit_run()
+        stats = store.snapshot()
+        assert stats.urls[url] == pls.Reliability(1, 1, 0, None, None)
+        assert '10.0.0.1:8000' in stats.hosts
+        orphans = store.connection.execute(
+            'SELECT COUNT(*) FROM observations WHERE url_id NOT IN (SELECT id FROM urls)').fetchone()[0]
+        assert orphans == 0
+
+
+def test_unseen_url_expires(tmp_path):
+    clock = FakeClock()
+    old, new = 'http://10.0.0.1/a', 'http://10.0.0.2/b'
+    with pls.ReliabilityStore(str(tmp_path / 'history.db'), retention_days=30, clock=clock) as store:
+        store.observe(old)
+        store.commit_run()
+        clock.now = 40 * DAY
+        store.observe(new)
+        store.commit_run()
+        stats = store.snapshot()
+        assert set(stats.urls) == {new}
+        assert set(stats.hosts) == {'10.0.0.2:80'}
+
+
+def test_cached_dead_host_is_not_a_probe(tmp_path):
+    url = 'http://127.0.0.1:9/live'
+    cache = pls.ProbeCache(path=str(tmp_path / 'probe_cache.json'))
+    cache.put_host('127.0.0.1:9', False)
+    prober = pls.StreamProber(connect_timeout=1, first_byte_timeout=1)
+    result = asyncio.run(prober.probe_all([url], cache=cache))[url]
+    assert (result.reachable, result.error, result.from_cache) == (False, '主机不可用', True)
+
+    with pls.ReliabilityStore(str(tmp_path / 'history.db')) as store:
+        store.observe(url, result)
+        store.commit_run()
+        assert store.snapshot().urls[url].probes == 0
+
+
+def test_unopenable_history_leaves_no_temp_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / 'source.txt'
+    source.write_text("央视频道,#genre#\nCCTV-1综合,http://10.0.0.1:8000/rtp/239.1.1.1:5140\n", encoding='utf-8')
+    # 历史库路径是目录，SQLite无法打开
+    (tmp_path / 'history.db').mkdir()
+    assert pls.main(['--source', str(source), '--history', str(tmp_path / 'history.db')]) == 1
+    assert not list(tmp_path.glob('*.tmp'))
+    assert not (tmp_path / pls.OutputWriter.RECLASSIFIED_FILE).exists()